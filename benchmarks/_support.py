@@ -0,0 +1,59 @@
+"""Shared helpers for the benchmark scripts: import path, stand-ins and stats."""
+from __future__ import annotations
+import asyncio, statistics, sys, tempfile, time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+if str(SRC) not in sys.path: sys.path.insert(0, str(SRC))
+
+from core.settings import Settings  # noqa: E402
+
+def pct(xs: Sequence[float], p: float) -> float:
+    s = sorted(xs); return s[min(len(s) - 1, int(len(s) * p))] if s else 0.0
+
+def summary(xs: Sequence[float], prefix: str, unit: str) -> Dict[str, float]:
+    if not xs: return {}
+    return {f"{prefix}_mean_{unit}": round(statistics.mean(xs), 3), f"{prefix}_p50_{unit}": round(pct(xs, .5), 3),
+            f"{prefix}_p99_{unit}": round(pct(xs, .99), 3), f"{prefix}_max_{unit}": round(max(xs), 3)}
+
+def mock_settings(**sections: Dict[str, Any]) -> Settings:
+    """Mock-mode Settings with a throwaway base_dir; keyword sections are merged into the defaults."""
+    raw: Dict[str, Any] = {"device": {"id": "bench-01", "mock_mode": True, "poll_interval_ms": 3000},
+                           "pubnub": {"publish_key": "demo", "subscribe_key": "demo"},
+                           "camera": {}, "thresholds": {"min_water_level_pct": 30.0}, "pins": {},
+                           "sensors": {"water_level": {"enabled": True}}}
+    for k, v in sections.items(): raw.setdefault(k, {}).update(v)
+    return Settings(raw=raw, device=raw["device"], pubnub=raw["pubnub"], camera=raw["camera"],
+                    thresholds=raw["thresholds"], pins=raw["pins"], base_dir=Path(tempfile.mkdtemp(prefix="bench-")))
+
+class MemoryBus:
+    """In-memory stand-in for ``core.bus.Bus``: records publishes, serves injected commands."""
+    def __init__(self) -> None:
+        self.published: List[Tuple[float, dict]] = []
+        self._inbox: asyncio.Queue = asyncio.Queue()
+        self._waiters: List[Tuple[int, asyncio.Future]] = []
+
+    def publish_nowait(self, payload: dict) -> bool:
+        self.published.append((time.perf_counter(), payload))
+        for w in [w for w in self._waiters if len(self.published) >= w[0]]:
+            self._waiters.remove(w)
+            if not w[1].done(): w[1].set_result(None)
+        return True
+
+    async def publish(self, payload: dict) -> None:
+        self.publish_nowait(payload)
+
+    async def wait_for(self, count: int, timeout: Optional[float] = None) -> None:
+        if len(self.published) >= count: return
+        fut = asyncio.get_running_loop().create_future(); self._waiters.append((count, fut))
+        await asyncio.wait_for(fut, timeout)
+
+    def inject(self, msg: dict) -> None:
+        self._inbox.put_nowait(msg)
+
+    async def next_command(self) -> Optional[dict]:
+        return await self._inbox.get()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": len(self.published)}
@@ -0,0 +1,48 @@
+"""
+Telemetry wire size and encode/decode cost: JSON vs the compact codec.
+
+    PYTHONPATH=src python benchmarks/bench_codec.py [--n 20000]
+"""
+from __future__ import annotations
+import argparse, json, time
+from typing import Any, Dict
+import _support  # noqa: F401  (sets up the import path)
+from core.codec import decode_message, encode_message
+
+SAMPLES = {
+    "environment": {"type": "telemetry", "ts": "2026-10-18T12:00:00.123456+00:00", "device_id": "pi-feeder-01",
+                    "sensors": {"environment": {"temperature_c": 23.4, "humidity_pct": 48.2}}},
+    "water": {"type": "telemetry", "ts": "2026-10-18T12:00:00.123456+00:00", "device_id": "pi-feeder-01",
+              "sensors": {"water": {"raw": 20150, "voltage": 2.519, "level_pct": 30.7,
+                                    "window": {"n": 60, "median_pct": 30.7, "ema_pct": 30.9,
+                                               "min_pct": 29.8, "max_pct": 31.6}}}},
+}
+
+def _time(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n): fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+def run(n: int = 20000) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for name, p in SAMPLES.items():
+        j = json.dumps(p, separators=(",", ":")); c = encode_message(p)
+        cj = json.dumps(c)   # as it appears inside the PubNub message body
+        assert decode_message(c)["sensors"] == p["sensors"], "round trip changed values"
+        out[f"{name}_json_bytes"] = len(j); out[f"{name}_compact_bytes"] = len(cj)
+        out[f"{name}_json_encode_us"] = round(_time(lambda: json.dumps(p, separators=(",", ":")), n), 3)
+        out[f"{name}_compact_encode_us"] = round(_time(lambda: json.dumps(encode_message(p)), n), 3)
+        out[f"{name}_decode_us"] = round(_time(lambda: decode_message(c), n), 3)
+    return out
+
+def main() -> None:
+    ap = argparse.ArgumentParser(); ap.add_argument("--n", type=int, default=20000)
+    r = run(ap.parse_args().n)
+    print(f"{'payload':12} {'json B':>7} {'compact B':>9} {'ratio':>6} {'json enc us':>11} {'compact enc us':>14} {'decode us':>9}")
+    for name in SAMPLES:
+        jb, cb = r[f"{name}_json_bytes"], r[f"{name}_compact_bytes"]
+        print(f"{name:12} {jb:7d} {cb:9d} {cb / jb:6.2f} {r[f'{name}_json_encode_us']:11.2f} "
+              f"{r[f'{name}_compact_encode_us']:14.2f} {r[f'{name}_decode_us']:9.2f}")
+
+if __name__ == "__main__":
+    main()
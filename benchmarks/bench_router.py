@@ -0,0 +1,62 @@
+"""
+CommandRouter benchmark, in mock mode against an in-memory bus.
+
+* throughput: ``--commands`` listSchedules commands through ``run()``
+  (bus pull, in-flight limit, dedupe, ack) until every ack is published;
+* feedNow latency: command injected -> ack published, one at a time, with
+  the coalescing window (0.25 s) and the mock servo's travel time
+  (3 x 0.4 s per dispense) included.
+
+    PYTHONPATH=src python benchmarks/bench_router.py [--commands 5000] [--feeds 3]
+"""
+from __future__ import annotations
+import argparse, asyncio, time
+from typing import Any, Dict
+from _support import MemoryBus, mock_settings, summary
+from actuators.feeder import Feeder
+from core.hw import HardwareExecutor
+from core.scheduler import Scheduler
+from services.command_router import CommandRouter
+
+async def _bench(commands: int, feeds: int) -> Dict[str, Any]:
+    settings = mock_settings()
+    bus = MemoryBus(); hw = HardwareExecutor()
+    sched = Scheduler(str(settings.base_dir / "schedules.json"), on_fire=lambda job, lateness_s: asyncio.sleep(0), fsync=False)
+    router = CommandRouter(settings, bus, sched, Feeder(pin=18, mock=True, hw=hw), camera=None)  # type: ignore[arg-type]
+    task = asyncio.create_task(router.run())
+    out: Dict[str, Any] = {"commands": commands, "feeds": feeds}
+    try:
+        t0 = time.perf_counter()
+        for i in range(commands):
+            bus.inject({"type": "command", "command": "listSchedules", "command_id": f"ls-{i}"})
+        await bus.wait_for(commands, timeout=120)
+        dt = time.perf_counter() - t0
+        out["throughput_per_s"] = round(commands / dt, 1)
+
+        lat_ms = []
+        for i in range(feeds):
+            n = len(bus.published); t0 = time.perf_counter()
+            bus.inject({"type": "command", "command": "feedNow", "command_id": f"feed-{i}"})
+            await bus.wait_for(n + 1, timeout=30)
+            t1, ack = bus.published[n]
+            assert ack.get("status") == "ok", ack
+            lat_ms.append((t1 - t0) * 1e3)
+        out.update(summary(lat_ms, "feed_ack", "ms"))
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await sched.stop(); hw.shutdown()
+    return out
+
+def run(commands: int = 5000, feeds: int = 3) -> Dict[str, Any]:
+    return asyncio.run(_bench(commands, feeds))
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--commands", type=int, default=5000)
+    ap.add_argument("--feeds", type=int, default=3)
+    args = ap.parse_args()
+    for k, v in run(args.commands, args.feeds).items(): print(f"{k:24} {v}")
+
+if __name__ == "__main__":
+    main()
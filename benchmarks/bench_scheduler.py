@@ -0,0 +1,70 @@
+"""
+Scheduler benchmark: index add/remove latency, head lookup and next-run
+computation at scale, plus snapshot compaction and load.
+
+    PYTHONPATH=src python benchmarks/bench_scheduler.py [--jobs 100000]
+
+Mutations go through the write-ahead log; pass ``--fsync`` to include the
+per-record fsync (dominated by the storage device, not the index). They run
+on an event loop, as in the service, so compactions happen on a worker thread.
+"""
+from __future__ import annotations
+import argparse, asyncio, random, tempfile, time, uuid
+from pathlib import Path
+from typing import Any, Dict
+from _support import summary
+from core.scheduler import DAYS, Job, Scheduler
+
+def _job(i: int) -> Job:
+    if i % 4 == 0:
+        return Job(id=str(uuid.uuid4()), type="once", at=f"2099-01-{1 + i % 28:02d}T{i % 24:02d}:{i % 60:02d}:00")
+    days = random.sample(DAYS, random.randint(1, 7))
+    return Job(id=str(uuid.uuid4()), type="daily", time_local=f"{i % 24:02d}:{(i * 7) % 60:02d}", days=days)
+
+async def _noop(job: Job, lateness_s: float) -> None:
+    return None
+
+async def _run(jobs: int, fsync: bool) -> Dict[str, Any]:
+    random.seed(1)
+    sched = Scheduler(str(Path(tempfile.mkdtemp()) / "schedules.json"), on_fire=_noop, fsync=fsync)
+    sched.load()
+    all_jobs = [_job(i) for i in range(jobs)]
+
+    add_us = []
+    for j in all_jobs:
+        t0 = time.perf_counter(); sched.add_job(j); add_us.append((time.perf_counter() - t0) * 1e6)
+        await asyncio.sleep(0)
+    t0 = time.perf_counter()
+    for _ in range(1000): sched.next_fire()
+    head_us = (time.perf_counter() - t0) * 1e3
+    now = time.time()
+    t0 = time.perf_counter()
+    for j in all_jobs: Scheduler._next_run(j, now)
+    next_run_us = (time.perf_counter() - t0) / len(all_jobs) * 1e6
+
+    victims = random.sample(all_jobs, len(all_jobs) // 2)
+    rm_us = []
+    for j in victims:
+        t0 = time.perf_counter(); sched.remove_job(j.id); rm_us.append((time.perf_counter() - t0) * 1e6)
+        await asyncio.sleep(0)   # let the loop breathe like it would between commands
+    await sched.compacted()
+    t0 = time.perf_counter(); sched.save(); save_ms = (time.perf_counter() - t0) * 1e3
+    t0 = time.perf_counter(); sched.load(); load_ms = (time.perf_counter() - t0) * 1e3
+    out: Dict[str, Any] = {"jobs": jobs}
+    out.update(summary(add_us, "add_job", "us")); out.update(summary(rm_us, "remove_job", "us"))
+    out.update({"next_fire_us": round(head_us, 3), "next_run_us": round(next_run_us, 3),
+                "compact_ms": round(save_ms, 1), "load_ms": round(load_ms, 1)})
+    return out
+
+def run(jobs: int = 100_000, fsync: bool = False) -> Dict[str, Any]:
+    return asyncio.run(_run(jobs, fsync))
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--jobs", type=int, default=100_000)
+    ap.add_argument("--fsync", action="store_true")
+    args = ap.parse_args()
+    for k, v in run(args.jobs, args.fsync).items(): print(f"{k:24} {v}")
+
+if __name__ == "__main__":
+    main()
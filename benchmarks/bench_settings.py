@@ -0,0 +1,74 @@
+"""
+Settings load time: ``load_settings`` on a representative config tree
+(TOML parse plus ``env:`` resolution).
+
+    PYTHONPATH=src python benchmarks/bench_settings.py [--n 2000]
+"""
+from __future__ import annotations
+import argparse, os, tempfile, time
+from pathlib import Path
+from typing import Any, Dict
+from _support import summary
+from core.settings import load_settings
+
+CONFIG = """
+[device]
+id = "pi-feeder-01"
+mock_mode = true
+poll_interval_ms = 3000
+
+[pubnub]
+publish_key = "env:BENCH_PUB_KEY"
+subscribe_key = "env:BENCH_SUB_KEY"
+channel = "feeder"
+batch_window_ms = 50
+max_batch = 50
+journal = true
+
+[camera]
+port = 8080
+relay_enabled = false
+status_ttl_s = 5
+
+[thresholds]
+min_water_level_pct = 30.0
+water_level_hysteresis_pct = 5.0
+
+[pins]
+dht22_data = 4
+servo = 18
+water_alarm = 23
+
+[sensors.water_level]
+enabled = true
+sample_rate_hz = 20
+window_s = 2.0
+filter = "median"
+
+[telemetry]
+max_silence_s = 300
+deadband = { temperature_c = 0.2, humidity_pct = "2%", level_pct = 1.0 }
+
+[history]
+enabled = true
+"""
+
+def run(n: int = 2000) -> Dict[str, Any]:
+    root = Path(tempfile.mkdtemp(prefix="bench-settings-"))
+    (root / "config").mkdir()
+    (root / "config/settings.toml").write_text(CONFIG)
+    os.environ.setdefault("BENCH_PUB_KEY", "demo"); os.environ.setdefault("BENCH_SUB_KEY", "demo")
+    load_settings(root)
+    us = []
+    for _ in range(n):
+        t0 = time.perf_counter(); load_settings(root); us.append((time.perf_counter() - t0) * 1e6)
+    out: Dict[str, Any] = {"n": n}
+    out.update(summary(us, "load", "us"))
+    return out
+
+def main() -> None:
+    ap = argparse.ArgumentParser(); ap.add_argument("--n", type=int, default=2000)
+    for k, v in run(ap.parse_args().n).items(): print(f"{k:24} {v}")
+
+if __name__ == "__main__":
+    main()
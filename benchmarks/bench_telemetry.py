@@ -0,0 +1,49 @@
+"""
+Telemetry loop jitter: runs TelemetryService in mock mode at a short poll
+interval and measures the spread of the intervals between publishes.
+
+    PYTHONPATH=src python benchmarks/bench_telemetry.py [--samples 100] [--interval-ms 50]
+
+Deadbands are off, so every (randomised) mock sample is published; the
+random values also keep the adaptive poll rate at its base. Reads are due
+one interval after the previous read was due, so the nominal period is the
+poll interval itself; jitter is the deviation of each interval from the
+measured mean.
+"""
+from __future__ import annotations
+import argparse, asyncio, statistics
+from typing import Any, Dict
+from _support import MemoryBus, mock_settings, summary
+from core.hw import HardwareExecutor
+from services.telemetry import TelemetryService
+
+async def _bench(samples: int, interval_ms: int) -> Dict[str, Any]:
+    settings = mock_settings(device={"poll_interval_ms": interval_ms})
+    bus = MemoryBus(); hw = HardwareExecutor()
+    task = asyncio.create_task(TelemetryService(settings, bus, hw=hw).run())  # type: ignore[arg-type]
+    try:
+        await bus.wait_for(samples + 1, timeout=samples * interval_ms / 1000 * 10 + 10)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        hw.shutdown()
+    ts = [t for t, _ in bus.published[:samples + 1]]
+    periods = [(b - a) * 1e3 for a, b in zip(ts, ts[1:])]
+    mean = statistics.mean(periods)
+    out: Dict[str, Any] = {"samples": samples, "interval_ms": interval_ms, "period_mean_ms": round(mean, 3),
+                           "jitter_stdev_ms": round(statistics.pstdev(periods), 3)}
+    out.update(summary([abs(p - mean) for p in periods], "jitter", "ms"))
+    return out
+
+def run(samples: int = 100, interval_ms: int = 50) -> Dict[str, Any]:
+    return asyncio.run(_bench(samples, interval_ms))
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--samples", type=int, default=100)
+    ap.add_argument("--interval-ms", type=int, default=50)
+    args = ap.parse_args()
+    for k, v in run(args.samples, args.interval_ms).items(): print(f"{k:24} {v}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Compares two ``run_all.py`` result files metric by metric.
+
+    python benchmarks/compare.py base.json new.json [--threshold 10]
+
+Metrics ending in ``_per_s`` are higher-is-better, byte counts and timings
+lower-is-better; size parameters (``jobs``, ``n``, ...), ``wall_s`` and
+single-sample maxima (``*_max_*``, too noisy to gate on) are shown but never
+flagged. Exits 1 when any metric regressed by more than
+``--threshold`` percent.
+"""
+from __future__ import annotations
+import argparse, json, sys
+from typing import Any, Dict, Optional
+
+PARAMS = {"jobs", "n", "commands", "feeds", "samples", "interval_ms", "wall_s"}
+
+def _direction(metric: str) -> int:
+    """+1 higher is better, -1 lower is better, 0 informational."""
+    if metric in PARAMS or "_max_" in metric: return 0
+    return 1 if metric.endswith("_per_s") else -1
+
+def _change(old: Any, new: Any) -> Optional[float]:
+    if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or not old: return None
+    return (new - old) / abs(old) * 100.0
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float) -> int:
+    regressions = 0
+    print(f"base {base['meta'].get('git_rev')} ({base['meta'].get('timestamp')})  ->  "
+          f"new {new['meta'].get('git_rev')} ({new['meta'].get('timestamp')})")
+    for bench in sorted(set(base["results"]) | set(new["results"])):
+        a, b = base["results"].get(bench, {}), new["results"].get(bench, {})
+        print(f"\n[{bench}]")
+        for metric in sorted(set(a) | set(b)):
+            pct = _change(a.get(metric), b.get(metric)); d = _direction(metric)
+            flag = ""
+            if pct is not None and d and -d * pct > threshold:
+                flag = "  REGRESSION"; regressions += 1
+            elif pct is not None and d and d * pct > threshold:
+                flag = "  improved"
+            delta = f"{pct:+7.1f}%" if pct is not None else "       -"
+            print(f"  {metric:28} {str(a.get(metric, '-')):>12} {str(b.get(metric, '-')):>12} {delta}{flag}")
+    print(f"\n{regressions} regression(s) over {threshold:g}%")
+    return 1 if regressions else 0
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("base"); ap.add_argument("new")
+    ap.add_argument("--threshold", type=float, default=10.0, help="percent change that counts as a regression")
+    args = ap.parse_args()
+    with open(args.base) as f: base = json.load(f)
+    with open(args.new) as f: new = json.load(f)
+    sys.exit(compare(base, new, args.threshold))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Runs every benchmark in mock mode and writes one JSON document:
+
+    {"meta": {...}, "results": {"<bench>": {"<metric>": value, ...}, ...}}
+
+    PYTHONPATH=src python benchmarks/run_all.py [--quick] [--only scheduler,router] [-o results.json]
+
+Compare two runs with ``benchmarks/compare.py``.
+"""
+from __future__ import annotations
+import argparse, json, logging, platform, subprocess, sys, time
+from pathlib import Path
+from typing import Any, Callable, Dict
+import _support  # noqa: F401
+import bench_codec, bench_router, bench_scheduler, bench_settings, bench_telemetry
+
+# name -> (full run, quick run)
+BENCHES: Dict[str, tuple[Callable[[], Dict[str, Any]], Callable[[], Dict[str, Any]]]] = {
+    "scheduler": (lambda: bench_scheduler.run(100_000), lambda: bench_scheduler.run(10_000)),
+    "router": (lambda: bench_router.run(5000, 3), lambda: bench_router.run(1000, 1)),
+    "telemetry": (lambda: bench_telemetry.run(100, 50), lambda: bench_telemetry.run(30, 50)),
+    "settings": (lambda: bench_settings.run(2000), lambda: bench_settings.run(300)),
+    "codec": (lambda: bench_codec.run(20000), lambda: bench_codec.run(2000)),
+}
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--quick", action="store_true", help="smaller sizes, for a smoke run")
+    ap.add_argument("--only", default="", help="comma-separated subset of: " + ",".join(BENCHES))
+    ap.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    names = [n for n in args.only.split(",") if n] or list(BENCHES)
+    unknown = set(names) - set(BENCHES)
+    if unknown: ap.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    doc: Dict[str, Any] = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git_rev": _git_rev(),
+                                    "python": platform.python_version(), "platform": platform.platform(),
+                                    "machine": platform.machine(), "quick": args.quick}, "results": {}}
+    for name in names:
+        print(f"running {name} ...", file=sys.stderr)
+        t0 = time.perf_counter()
+        doc["results"][name] = BENCHES[name][1 if args.quick else 0]()
+        doc["results"][name]["wall_s"] = round(time.perf_counter() - t0, 2)
+    text = json.dumps(doc, indent=2, sort_keys=True)
+    if args.output:
+        Path(args.output).write_text(text + "\n"); print(f"wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
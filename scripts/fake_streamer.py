@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Stand-in for mjpg_streamer_pi5.sh when there is no camera (development, CI).
+
+Same interface: ``start|stop|restart|status`` with RES, FPS, Q and PORT from
+the environment, and "RUNNING" in the status output. ``start`` forks a small
+HTTP server serving ``/?action=stream`` (multipart MJPEG) and
+``/?action=snapshot`` with dummy JPEG frames whose size scales with
+resolution and quality, paced at FPS. State lives in FAKE_STREAMER_DIR
+(default /tmp/fake_streamer): ``streamer_<PORT>.pid`` and ``starts.log``, one
+"RES FPS Q" line per start so tests can count restarts.
+
+Point ``camera.script_path`` at this file and set ``camera.use_sudo = false``.
+"""
+from __future__ import annotations
+import os, signal, subprocess, sys, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+RES = os.environ.get("RES", "1280x720")
+FPS = max(1, int(os.environ.get("FPS", "30")))
+Q = int(os.environ.get("Q", "85"))
+PORT = int(os.environ.get("PORT", "8080"))
+STATE = Path(os.environ.get("FAKE_STREAMER_DIR", "/tmp/fake_streamer"))
+PID = STATE / f"streamer_{PORT}.pid"
+
+def _pid() -> int | None:
+    try:
+        pid = int(PID.read_text().strip()); os.kill(pid, 0); return pid
+    except (OSError, ValueError):
+        return None
+
+def _frame(seq: int) -> bytes:
+    w, h = (int(x) for x in RES.lower().split("x"))
+    size = max(64, w * h * Q // 800)   # roughly what mjpg_streamer produces
+    return b"\xff\xd8" + seq.to_bytes(4, "big") + b"\x00" * (size - 8) + b"\xff\xd9"
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if "action=snapshot" in self.path:
+            frame = _frame(0)
+            self.send_response(200); self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(frame))); self.end_headers()
+            self.wfile.write(frame); return
+        if "action=stream" not in self.path:
+            self.send_error(404); return
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/x-mixed-replace;boundary=boundarydonotcross"); self.end_headers()
+        seq, period, due = 0, 1.0 / FPS, time.monotonic()
+        try:
+            while True:
+                frame = _frame(seq); seq += 1
+                self.wfile.write(b"--boundarydonotcross\r\nContent-Type: image/jpeg\r\n"
+                                 b"Content-Length: %d\r\n\r\n" % len(frame) + frame + b"\r\n")
+                due += period
+                time.sleep(max(0.0, due - time.monotonic()))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def serve() -> None:
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer(("127.0.0.1", PORT), _Handler).serve_forever()
+
+def start() -> None:
+    if _pid() is not None:
+        print(f"fake_streamer: already running on port {PORT}"); return
+    STATE.mkdir(parents=True, exist_ok=True)
+    proc = subprocess.Popen([sys.executable, __file__, "serve"], start_new_session=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    PID.write_text(str(proc.pid))
+    with open(STATE / "starts.log", "a") as f: f.write(f"{RES} {FPS} {Q}\n")
+    time.sleep(0.2)
+    print(f"[+] fake_streamer running: http://127.0.0.1:{PORT}/?action=stream ({RES}@{FPS} q{Q})")
+
+def stop() -> None:
+    pid = _pid()
+    if pid is not None:
+        os.kill(pid, signal.SIGTERM)
+        for _ in range(50):
+            try: os.kill(pid, 0); time.sleep(0.02)
+            except OSError: break
+    PID.unlink(missing_ok=True)
+
+def status() -> None:
+    print(f"fake_streamer: RUNNING (port {PORT})" if _pid() is not None else "fake_streamer: STOPPED")
+
+if __name__ == "__main__":
+    action = sys.argv[1] if len(sys.argv) > 1 else ""
+    if action == "restart": stop(); start()
+    elif action in ("start", "stop", "status", "serve"): globals()[action]()
+    else:
+        print("Usage: fake_streamer.py start|stop|restart|status"); sys.exit(1)
@@ -1,15 +1,204 @@
 from __future__ import annotations
-import logging
+import asyncio, logging, time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, List, Optional, Sequence, Tuple
 from actuators.servo_gz import GpioZeroServo
+from core.hw import HardwareExecutor
+from core.metrics import MetricsRegistry, default_registry
 logger = logging.getLogger("actuators.feeder")
 
+SWEEP=(0, 90, 0)
+
+class FeedRateLimited(RuntimeError):
+    """A dispense request would exceed the feeding rate limit."""
+    def __init__(self, msg: str, retry_after_s: float):
+        super().__init__(msg); self.retry_after_s = retry_after_s
+
 class Feeder:
-    def __init__(self, pin: int):
-        self.servo = GpioZeroServo(pin)
+    """
+    Servo-driven dispenser. One portion is one sweep: open to ``open_angle``
+    (or a per-portion angle for a smaller/larger opening), hold ``dwell_s``,
+    close to ``closed_angle``. Several portions run as one motion, so a
+    merged batch of N portions costs 2N+1 moves instead of 3N.
+    """
+    def __init__(self, pin: int, mock: bool = False, hw: HardwareExecutor | None = None,
+                 metrics: MetricsRegistry | None = None, open_angle: float = SWEEP[1],
+                 closed_angle: float = SWEEP[0], travel_s: float = 0.4, dwell_s: float = 0.0):
+        self.servo = GpioZeroServo(pin, mock=mock, hw=hw, travel_s=travel_s)
+        self.device = f"servo:{pin}"
+        self.open_angle = float(open_angle); self.closed_angle = float(closed_angle)
+        self.dwell_s = max(0.0, float(dwell_s))
+        m = metrics or default_registry()
+        self._m_sweep = m.histogram("feeder_dispense_seconds", "Servo time per dispense sweep")
+        self._m_errors = m.counter("feeder_errors_total", "Dispense sweeps that failed or were cancelled")
+
+    def _moves(self, angles: Sequence[Optional[float]]) -> List[Tuple[float, Optional[float]]]:
+        """(angle, settle time) steps for one motion; ``None`` angles use ``open_angle``."""
+        hold = self.servo.travel_s + self.dwell_s
+        moves: List[Tuple[float, Optional[float]]] = [(self.closed_angle, None)]
+        for a in angles:
+            moves += [(self.open_angle if a is None else float(a), hold), (self.closed_angle, None)]
+        return moves
 
     def dispense_small(self)->None:
         logger.info("Feeder: dispensing...")
-        self.servo.move_to(0)
-        self.servo.move_to(90)
-        self.servo.move_to(0)
+        for angle, sleep in self._moves([None]):
+            self.servo.move_to(angle, sleep)
         logger.info("Feeder: done.")
+
+    async def dispense_async(self, angles: Sequence[Optional[float]] = (None,)) -> float:
+        """
+        One motion dispensing ``len(angles)`` portions on the GPIO worker;
+        concurrent callers queue on the servo lock. Returns the motion time.
+        """
+        async with self.servo.hw.lock(self.device):
+            logger.info("Feeder: dispensing %d portion(s)...", len(angles))
+            t0 = time.perf_counter(); t_sweep = t0
+            try:
+                for i, (angle, sleep) in enumerate(self._moves(angles)):
+                    await self.servo.move_to_async(angle, sleep)
+                    if i and i % 2 == 0:   # back at closed: one sweep done
+                        now = time.perf_counter(); self._m_sweep.observe(now - t_sweep); t_sweep = now
+            except BaseException:
+                self._m_errors.inc()
+                # don't leave the chute open if a move failed or we were cancelled mid-sweep
+                await self._close_chute()
+                raise
+            logger.info("Feeder: done.")
+            return time.perf_counter() - t0
+
+    async def _close_chute(self) -> None:
+        # submitted without a timeout: a timed-out move may still occupy the GPIO
+        # worker, and a queued call that times out would be dropped, not run later
+        close = asyncio.ensure_future(self.servo.hw.run("gpio", self.servo.move_to, self.closed_angle))
+        close.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            await asyncio.wait_for(asyncio.shield(close), self.servo.travel_s + self.servo.move_timeout)
+        except asyncio.TimeoutError:
+            logger.error("Feeder: chute still open after a failed dispense; close is queued behind the stuck move")
+        except Exception as e:
+            logger.error("Feeder: could not close the chute after a failed dispense: %s", e)
+
+    async def dispense_small_async(self)->None:
+        await self.dispense_async()
+
+@dataclass
+class Dispensed:
+    """Outcome of one ``DispenseQueue.request``."""
+    portions: int
+    motion_portions: int     # portions in the motion this request rode on
+    merged: int              # requests served by that motion
+    duration_s: float        # servo time of the whole motion
+    waited_s: float          # request -> motion finished
+
+class _Request:
+    __slots__ = ("angles", "fut", "t0")
+    def __init__(self, angles: List[Optional[float]], fut: asyncio.Future):
+        self.angles = angles; self.fut = fut; self.t0 = time.perf_counter()
+
+class DispenseQueue:
+    """
+    Async queue in front of ``Feeder``.
+
+    The first request opens a ``window_s`` collection window; everything
+    arriving in it is dispensed as one motion of up to ``max_motion_portions``
+    portions (the rest goes out in the next motion right away), and every
+    caller gets the shared outcome. A sliding rate limit of
+    ``rate_limit_portions`` per ``rate_limit_window_s`` guards against
+    overfeeding: a request that does not fit is refused with
+    ``FeedRateLimited`` rather than partly served.
+    """
+    def __init__(self, feeder: Feeder, window_s: float = 0.25, max_motion_portions: int = 6,
+                 max_request_portions: int = 4, rate_limit_portions: int = 12,
+                 rate_limit_window_s: float = 3600.0, metrics: MetricsRegistry | None = None):
+        self.feeder = feeder
+        self.window = max(0.0, float(window_s)); self.max_motion = max(1, int(max_motion_portions))
+        self.max_request = max(1, int(max_request_portions))
+        self.rate_portions = int(rate_limit_portions); self.rate_window = float(rate_limit_window_s)
+        self._pending: Deque[_Request] = deque()
+        self._dispensed: Deque[Tuple[float, int]] = deque()   # (monotonic time, portions)
+        self._task: Optional[asyncio.Task] = None
+        m = metrics or default_registry()
+        self._m_motion = m.histogram("feeder_motion_seconds", "Servo time per dispense motion")
+        portions = m.counter("feeder_portions_total", "Portions requested", ("result",))
+        self._m_portions = {r: portions.labels(r) for r in ("dispensed", "rate_limited", "failed")}
+        self._m_merged = m.counter("feeder_requests_coalesced_total", "Requests that shared a motion with an earlier one")
+        m.gauge("feeder_queue_depth", "Portions waiting to be dispensed").set_function(self.depth)
+
+    def depth(self) -> int:
+        return sum(len(r.angles) for r in self._pending)
+
+    def used(self) -> int:
+        """Portions dispensed within the current rate-limit window."""
+        cutoff = time.monotonic() - self.rate_window
+        while self._dispensed and self._dispensed[0][0] <= cutoff: self._dispensed.popleft()
+        return sum(n for _, n in self._dispensed)
+
+    async def request(self, portions: int = 1, angle: Optional[float] = None) -> Dispensed:
+        portions = int(portions)
+        if not 1 <= portions <= self.max_request:
+            raise ValueError(f"portions must be 1..{self.max_request}")
+        if angle is not None: angle = max(0.0, min(180.0, float(angle)))
+        req = _Request([angle] * portions, asyncio.get_running_loop().create_future())
+        self._pending.append(req)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="dispense-queue")
+        return await asyncio.shield(req.fut)   # a cancelled caller doesn't cancel a shared motion
+
+    def _refuse(self, req: _Request) -> None:
+        retry = 0.0
+        if self._dispensed: retry = max(0.0, self._dispensed[0][0] + self.rate_window - time.monotonic())
+        self._m_portions["rate_limited"].inc(len(req.angles))
+        logger.warning("Feeder: refusing %d portion(s), rate limit %d per %.0fs reached",
+                       len(req.angles), self.rate_portions, self.rate_window)
+        if not req.fut.done():
+            req.fut.set_exception(FeedRateLimited(
+                f"rate limit of {self.rate_portions} portions per {self.rate_window:.0f}s reached", round(retry, 1)))
+
+    def _take_batch(self) -> List[_Request]:
+        batch: List[_Request] = []; n = 0; budget = self.rate_portions - self.used()
+        while self._pending:
+            req = self._pending[0]; k = len(req.angles)
+            if batch and n + k > self.max_motion: break
+            self._pending.popleft()
+            if k > budget - n: self._refuse(req); continue
+            batch.append(req); n += k
+        return batch
+
+    async def _run(self) -> None:
+        # requests left over after a motion arrived while it ran: no second window
+        if self.window: await asyncio.sleep(self.window)
+        batch: List[_Request] = []
+        try:
+            while self._pending:
+                batch = self._take_batch()
+                if batch: await self._dispense(batch)
+        except asyncio.CancelledError:
+            for r in [*batch, *self._pending]:
+                if not r.fut.done(): r.fut.cancel()
+            self._pending.clear()
+            raise
+
+    async def _dispense(self, batch: List[_Request]) -> None:
+        angles = [a for r in batch for a in r.angles]
+        self._dispensed.append((time.monotonic(), len(angles)))   # counted even if the motion fails
+        if len(batch) > 1: self._m_merged.inc(len(batch) - 1)
+        try:
+            duration = await self.feeder.dispense_async(angles)
+        except Exception as e:
+            self._m_portions["failed"].inc(len(angles))
+            for r in batch:
+                if not r.fut.done(): r.fut.set_exception(e)
+            return
+        self._m_motion.observe(duration); self._m_portions["dispensed"].inc(len(angles))
+        end = time.perf_counter()
+        for r in batch:
+            if not r.fut.done():
+                r.fut.set_result(Dispensed(len(r.angles), len(angles), len(batch),
+                                           round(duration, 3), round(end - r.t0, 3)))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
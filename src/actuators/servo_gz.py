@@ -1,20 +1,46 @@
 from __future__ import annotations
 import logging, os, time
-from gpiozero import AngularServo
+from typing import Optional
+from core.hw import HardwareExecutor, LazyDevice, default_executor
 logger = logging.getLogger("actuators.servo_gz")
 
-class GpioZeroServo:
-    def __init__(self, pin: int, min_us: int = 500, max_us: int = 2500):
+class _MockAngularServo:
+    def __init__(self): self.angle: Optional[float] = None
+    def detach(self)->None: self.angle = None
+
+class GpioZeroServo(LazyDevice):
+    def __init__(self, pin: int, min_us: int = 500, max_us: int = 2500, mock: bool = False,
+                 hw: HardwareExecutor | None = None, move_timeout_s: float = 2.0, travel_s: float = 0.4):
+        self.pin = pin; self.mock = mock; self.hw = hw or default_executor()
+        self.move_timeout = move_timeout_s; self.travel_s = travel_s
+        self.min_us = min_us; self.max_us = max_us
+        self.name = f"servo GPIO{pin}"
+        self._mock_servo = _MockAngularServo(); self._servo = None
+
+    def _open(self) -> None:
         os.environ.setdefault("GPIOZERO_PIN_FACTORY", "lgpio")
-        self.servo = AngularServo(pin, min_angle=0, max_angle=180,
-                                  min_pulse_width=min_us/1_000_000,
-                                  max_pulse_width=max_us/1_000_000)
-        logger.info("AngularServo initialized on GPIO %s", pin)
+        from gpiozero import AngularServo  # type: ignore
+        self._servo = AngularServo(self.pin, min_angle=0, max_angle=180,
+                                   min_pulse_width=self.min_us/1_000_000,
+                                   max_pulse_width=self.max_us/1_000_000)
+        logger.info("AngularServo initialized on GPIO %s", self.pin)
 
-    def move_to(self, angle: float, sleep: float | None = 0.4) -> None:
+    @property
+    def servo(self):
+        self.open()
+        return self._mock_servo if self.mock or self._servo is None else self._servo
+
+    def move_to(self, angle: float, sleep: float | None = None) -> None:
         angle = max(0.0, min(180.0, float(angle)))
         self.servo.angle = angle
-        if sleep and sleep > 0: time.sleep(sleep)
+        # the sleep is the servo's travel time, so mock mode keeps it too
+        if sleep is None: sleep = self.travel_s
+        if sleep > 0: time.sleep(sleep)
+
+    async def move_to_async(self, angle: float, sleep: float | None = None) -> None:
+        # move_timeout_s is the margin on top of the move's own settle time, so long dwells don't time out
+        hold = self.travel_s if sleep is None else max(0.0, sleep)
+        await self.hw.run("gpio", self.move_to, angle, sleep, timeout=hold + self.move_timeout)
 
     def stop(self)->None:
         self.servo.detach()
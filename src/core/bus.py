@@ -1,49 +1,325 @@
 from __future__ import annotations
-import asyncio, json, logging
+import asyncio, logging, time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Sequence, Set, Tuple
+from core.codec import encode_message
+from core.journal import Journal
+from core.metrics import MetricsRegistry, default_registry
+from core.transport import TransportError, default_transport
 logger = logging.getLogger("core.bus")
-try:
-    from pubnub.pnconfiguration import PNConfiguration
-    from pubnub.pubnub_asyncio import PubNubAsyncio, SubscribeListener  # type: ignore
-except Exception:
-    PNConfiguration = None; PubNubAsyncio = None; SubscribeListener = None
-    logger.warning("PubNub SDK unavailable; NO-OP bus.")
+
+# Message types that may be dropped under backpressure. Everything else
+# (events, acks) is kept until it has been handed to PubNub.
+DROPPABLE_TYPES = frozenset({"telemetry"})
 
 class Bus:
-    def __init__(self, publish_key: str, subscribe_key: str, uuid: str, channel: str):
+    """
+    PubNub wrapper with a bounded outbound queue.
+
+    ``publish``/``publish_nowait`` only enqueue; a background sender coalesces
+    everything produced within ``batch_window_ms`` into one PubNub message (a
+    JSON array when more than one payload is sent) and keeps up to
+    ``max_inflight`` publishes outstanding. When the telemetry queue holds
+    ``max_queue`` items the oldest telemetry is dropped; events and acks are
+    never dropped, ``publish`` waits for room instead.
+
+    With ``journal_dir`` set, batches that fail to publish are written to an
+    on-disk journal (one lane for events/acks, one for telemetry) and a replay
+    worker drains it in order once the transport accepts messages again,
+    events first. While a backlog exists new messages go to the journal too,
+    so ordering is kept and memory stays flat during long outages.
+
+    ``encoding="compact"`` sends telemetry as base64 binary records (see
+    ``core.codec``); events and acks stay JSON either way.
+
+    Commands are read from ``command_channel`` (one channel or several, e.g.
+    one per device; defaults to ``channel``), so the device does not receive
+    its own telemetry back. Every publish carries PubNub ``meta``
+    (``source = 'device'`` and the payload type) for server-side
+    ``filter_expression``s such as ``source != 'device'`` when commands share
+    the telemetry channel. Incoming messages are drained up to
+    ``incoming_batch`` per wake-up and non-commands are discarded before
+    ``next_command`` sees them.
+
+    Publish latency, batch sizes, drops and queue depth are exported as
+    ``bus_*`` metrics on ``metrics`` (the default registry if omitted).
+    """
+    def __init__(self, publish_key: str, subscribe_key: str, uuid: str, channel: str,
+                 batch_window_ms: int = 50, max_batch: int = 50, max_inflight: int = 2,
+                 max_queue: int = 500, flush_timeout_s: float = 2.0,
+                 journal_dir: str | Path | None = None, journal_max_mb: float = 32,
+                 retry_min_s: float = 1.0, retry_max_s: float = 30.0, transport: Any = None,
+                 encoding: str = "json", metrics: MetricsRegistry | None = None,
+                 command_channel: str | Sequence[str] | None = None, filter_expression: str | None = None,
+                 incoming_batch: int = 32):
         self.channel = channel
-        self._pn = None; self._listener = None
-        if PNConfiguration and PubNubAsyncio:
-            cfg = PNConfiguration(); cfg.publish_key=publish_key; cfg.subscribe_key=subscribe_key; cfg.uuid=uuid
-            self._pn = PubNubAsyncio(cfg)
-        else:
-            logger.warning("Running without PubNub connection.")
+        cmd = command_channel or channel
+        self.command_channels: List[str] = [cmd] if isinstance(cmd, str) else list(cmd)
+        self.incoming_batch = max(1, int(incoming_batch))
+        self._incoming: Deque[Tuple[str, dict]] = deque()
+        if encoding not in ("json", "compact"): raise ValueError(f"unknown bus encoding: {encoding}")
+        self.encoding = encoding
+        self._transport = transport or default_transport(publish_key, subscribe_key, uuid, filter_expression)
+        self.online = True
+        self.retry_min = float(retry_min_s); self.retry_max = float(retry_max_s)
+        self._journals: Dict[str, Journal] = {}
+        if journal_dir:
+            cap = int(float(journal_max_mb) * (1 << 20))
+            # each lane is capped separately so a telemetry flood cannot evict events
+            self._journals = {"priority": Journal(Path(journal_dir) / "priority", max_bytes=cap // 2),
+                              "telemetry": Journal(Path(journal_dir) / "telemetry", max_bytes=cap // 2)}
+        self._replay_wake = asyncio.Event()
+        self._replayer: Optional[asyncio.Task] = None
+        self.batch_window = max(0, int(batch_window_ms)) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self.max_inflight = max(1, int(max_inflight))
+        self.max_queue = max(1, int(max_queue))
+        self.flush_timeout = float(flush_timeout_s)
+        self._telemetry: Deque[dict] = deque()
+        self._priority: Deque[dict] = deque()
+        self._wake = asyncio.Event()
+        self._room = asyncio.Event(); self._room.set()
+        self._closing = False
+        self._idle = asyncio.Event()   # set whenever the queue is empty and nothing is in flight
+        self._sender: asyncio.Task | None = None
+        self._inflight: Set[asyncio.Task] = set()
+        self._counters: Dict[str, int] = {"queued": 0, "sent": 0, "dropped": 0, "errors": 0,
+                                          "batches": 0, "last_batch_size": 0, "max_batch_size": 0,
+                                          "journaled": 0, "replayed": 0}
+        m = metrics or default_registry()
+        latency = m.histogram("bus_publish_seconds", "Transport publish duration per batch", ("path",))
+        self._m_publish = latency.labels("live"); self._m_replay = latency.labels("replay")
+        self._m_batch = m.histogram("bus_batch_size", "Messages per published batch",
+                                    buckets=(1, 2, 5, 10, 20, 50, 100, 200))
+        msgs = m.counter("bus_messages_total", "Outbound messages by outcome", ("result",))
+        self._m_sent, self._m_dropped, self._m_journaled, self._m_replayed = (
+            msgs.labels(r) for r in ("sent", "dropped", "journaled", "replayed"))
+        self._m_errors = m.counter("bus_publish_errors_total", "Failed transport publishes")
+        incoming = m.counter("bus_incoming_total", "Incoming messages by outcome", ("result",))
+        self._m_commands = incoming.labels("command"); self._m_ignored = incoming.labels("ignored")
+        depth = m.gauge("bus_queue_depth", "Messages waiting in the outbound queue", ("lane",))
+        depth.labels("priority").set_function(lambda: len(self._priority))
+        depth.labels("telemetry").set_function(lambda: len(self._telemetry))
+        m.gauge("bus_online", "1 while the transport accepts publishes").set_function(lambda: float(self.online))
+        backlog = m.gauge("bus_journal_records", "Messages waiting in the on-disk journal", ("lane",))
+        for lane, j in self._journals.items(): backlog.labels(lane).set_function(j.__len__)
 
     async def start(self):
-        if self._pn is None: return
-        self._listener = SubscribeListener()
-        self._pn.add_listener(self._listener)
-        self._pn.subscribe().channels(self.channel).execute()
+        self._closing = False
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.create_task(self._send_loop(), name="bus-sender")
+        if self._journals and (self._replayer is None or self._replayer.done()):
+            self._replayer = asyncio.create_task(self._replay_loop(), name="bus-replay")
+        chans = self.command_channels
+        await self._transport.start(chans[0] if len(chans) == 1 else chans)
 
     async def stop(self):
-        if self._pn is None: return
-        self._pn.unsubscribe_all(); await asyncio.sleep(0.1)
+        await self._close()
+        if self._replayer is not None:
+            # wait_for() in the replay loop can swallow a cancel that races its wake-up, so repeat it
+            while not self._replayer.done():
+                self._replayer.cancel()
+                await asyncio.wait({self._replayer}, timeout=0.1)
+            self._replayer = None
+        for j in self._journals.values(): j.close()
+        await self._transport.stop()
+
+    async def flush(self, timeout: float | None = None) -> bool:
+        """
+        Wait until everything queued so far has been handed to the transport
+        (or journaled), at most ``timeout`` seconds (default ``flush_timeout_s``).
+        The Bus keeps running; returns False on timeout.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (self.flush_timeout if timeout is None else timeout)
+        self._wake.set()
+        while self.pending() or self._inflight:
+            if self._sender is None or self._sender.done(): return False
+            self._idle.clear()
+            try: await asyncio.wait_for(self._idle.wait(), deadline - loop.time())
+            except asyncio.TimeoutError: return False
+        return True
+
+    async def _close(self) -> None:
+        """Stop the sender after it has drained; on timeout unsent and in-flight batches are journaled."""
+        self._closing = True; self._wake.set()
+        sender = self._sender
+        if sender is None: return
+        try:
+            await asyncio.wait_for(asyncio.shield(sender), self.flush_timeout)
+        except asyncio.TimeoutError:
+            sender.cancel()
+            inflight = list(self._inflight)
+            for t in inflight: t.cancel()
+            await asyncio.gather(sender, *inflight, return_exceptions=True)
+            if self._journals:
+                self._spill(self._take_all())
+            else:
+                logger.warning("Bus flush timed out; %d message(s) not sent", self.pending())
+        self._sender = None
+
+    def pending(self) -> int:
+        return len(self._priority) + len(self._telemetry)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = dict(self._counters)
+        out["queue_priority"] = len(self._priority)
+        out["queue_telemetry"] = len(self._telemetry)
+        out["inflight"] = len(self._inflight)
+        out["avg_batch_size"] = round(out["sent"] / out["batches"], 2) if out["batches"] else 0.0
+        out["online"] = self.online
+        for lane, j in self._journals.items():
+            out[f"journal_{lane}"] = len(j); out[f"journal_{lane}_dropped"] = j.dropped
+        return out
+
+    def publish_nowait(self, payload: dict) -> bool:
+        """Enqueue without waiting. Returns False only if telemetry had to be dropped to make room."""
+        self._counters["queued"] += 1
+        accepted = True
+        if payload.get("type") in DROPPABLE_TYPES:
+            if len(self._telemetry) >= self.max_queue:
+                self._telemetry.popleft(); self._counters["dropped"] += 1; accepted = False
+                self._m_dropped.inc()
+            self._telemetry.append(payload)
+        else:
+            self._priority.append(payload)
+            if len(self._priority) >= self.max_queue: self._room.clear()
+        self._wake.set()
+        return accepted
 
     async def publish(self, payload: dict):
-        if self._pn is None:
-            logger.info("[NO-OP publish] %s", json.dumps(payload))
+        if payload.get("type") not in DROPPABLE_TYPES:
+            while not self._room.is_set() and not self._closing:
+                await self._room.wait()
+        self.publish_nowait(payload)
+
+    def _take_batch(self) -> List[dict]:
+        batch: List[dict] = []
+        for q in (self._priority, self._telemetry):
+            while q and len(batch) < self.max_batch:
+                batch.append(q.popleft())
+        if len(self._priority) < self.max_queue: self._room.set()
+        return batch
+
+    def _take_all(self) -> List[dict]:
+        batch = list(self._priority) + list(self._telemetry)
+        self._priority.clear(); self._telemetry.clear(); self._room.set()
+        return batch
+
+    def _backlog(self) -> int:
+        return sum(len(j) for j in self._journals.values())
+
+    def _spill(self, batch: List[dict]) -> None:
+        for p in batch:
+            self._journals["telemetry" if p.get("type") in DROPPABLE_TYPES else "priority"].append(p)
+        self._counters["journaled"] += len(batch); self._m_journaled.inc(len(batch))
+        self._replay_wake.set()
+
+    def _done(self, task: asyncio.Task, sem: asyncio.Semaphore) -> None:
+        self._inflight.discard(task); sem.release()
+        if not self._inflight and not self.pending(): self._idle.set()
+
+    async def _send_loop(self) -> None:
+        sem = asyncio.Semaphore(self.max_inflight)
+        while True:
+            if not self.pending():
+                if not self._inflight: self._idle.set()
+                if self._closing: break
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            if self.batch_window and not self._closing and self.pending() < self.max_batch:
+                await asyncio.sleep(self.batch_window)
+            batch = self._take_batch()
+            if self._backlog():
+                self._spill(batch); continue
+            try:
+                await sem.acquire()
+            except asyncio.CancelledError:
+                if self._journals: self._spill(batch)
+                raise
+            t = asyncio.create_task(self._send_batch(batch))
+            self._inflight.add(t)
+            t.add_done_callback(lambda task: self._done(task, sem))
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    @staticmethod
+    def _meta(batch: List[dict]) -> Dict[str, Any]:
+        kinds = {p.get("type") for p in batch}
+        return {"source": "device", "type": kinds.pop() if len(kinds) == 1 else "batch"}
+
+    def _wire(self, batch: List[dict]) -> Any:
+        items = [encode_message(p) for p in batch] if self.encoding == "compact" else batch
+        return items[0] if len(items) == 1 else items
+
+    async def _send_batch(self, batch: List[dict]) -> None:
+        t0 = time.perf_counter()
+        try:
+            await self._transport.publish(self.channel, self._wire(batch), meta=self._meta(batch))
+        except asyncio.CancelledError:
+            if self._journals: self._spill(batch)   # cut off by stop(); replayed on next start
+            raise
+        except Exception as e:
+            self._counters["errors"] += 1; self.online = False; self._m_errors.inc()
+            if self._journals:
+                logger.warning("Publish failed (%s); journaling %d message(s)", e, len(batch))
+                self._spill(batch)
+            else:
+                logger.error("PubNub publish failed (%d message(s)): %s", len(batch), e)
             return
-        env = await self._pn.publish().channel(self.channel).message(payload).future()
-        if env.status.is_error():
-            logger.error("PubNub publish error: %s", env.status.error_data)
+        self.online = True
+        self._m_publish.observe(time.perf_counter() - t0)
+        self._m_batch.observe(len(batch)); self._m_sent.inc(len(batch))
+        c = self._counters
+        c["sent"] += len(batch); c["batches"] += 1; c["last_batch_size"] = len(batch)
+        c["max_batch_size"] = max(c["max_batch_size"], len(batch))
+
+    async def _replay_loop(self) -> None:
+        delay = self.retry_min
+        while True:
+            lane = next((j for j in self._journals.values() if len(j)), None)
+            if lane is None:
+                self._replay_wake.clear()
+                try: await asyncio.wait_for(self._replay_wake.wait(), timeout=1.0)
+                except asyncio.TimeoutError: pass
+                for j in self._journals.values(): j.sync()
+                continue
+            records, cursor = lane.read_batch(self.max_batch)
+            if not records:
+                lane.commit(cursor); continue
+            t0 = time.perf_counter()
+            try:
+                await self._transport.publish(self.channel, self._wire(records), meta=self._meta(records))
+            except TransportError as e:
+                self.online = False; self._m_errors.inc()
+                logger.debug("Replay deferred %.1fs: %s", delay, e)
+                await asyncio.sleep(delay); delay = min(delay * 2, self.retry_max)
+                continue
+            lane.commit(cursor)
+            if not self.online: logger.info("Bus back online; replaying journal")
+            self.online = True; delay = self.retry_min
+            self._m_replay.observe(time.perf_counter() - t0)
+            self._m_batch.observe(len(records)); self._m_sent.inc(len(records)); self._m_replayed.inc(len(records))
+            c = self._counters
+            c["replayed"] += len(records); c["sent"] += len(records); c["batches"] += 1
+            await asyncio.sleep(0)
 
     async def next_command(self) -> dict | None:
-        if self._pn is None or self._listener is None:
-            await asyncio.sleep(1.0); return None
-        msg = await self._listener.wait_for_message_on(self.channel)
-        try:
-            payload = msg.message
-            if isinstance(payload, dict) and payload.get("type") == "command":
-                return payload
-        except Exception:
-            logger.exception("Incoming message parse failed")
-        return None
+        """Next incoming command; everything that arrived together is buffered, non-commands dropped."""
+        item = await self.next_command_on()
+        return item[1] if item else None
+
+    async def next_command_on(self) -> Tuple[str, dict] | None:
+        """Like ``next_command`` but also returns the channel the command arrived on ("" if unknown)."""
+        if not self._incoming:
+            try:
+                for ch, payload in await self._transport.next_messages(self.incoming_batch):
+                    if isinstance(payload, dict) and payload.get("type") == "command" and (not ch or ch in self.command_channels):
+                        self._incoming.append((ch or "", payload)); self._m_commands.inc()
+                    else:
+                        self._m_ignored.inc()
+            except Exception:
+                logger.exception("Incoming message parse failed")
+        return self._incoming.popleft() if self._incoming else None
@@ -0,0 +1,101 @@
+"""
+Compact telemetry encoding.
+
+A record is ``<version:u8><ts_ms:u64><present:u16><id_len:u8><device_id>``
+followed by one fixed-width quantized value per bit set in ``present``, in
+field order. It is base64-encoded so it travels as a plain PubNub string.
+Only ``type == "telemetry"`` payloads whose fields are all in the schema are
+encoded; anything else (events, acks, unknown fields, out-of-range values)
+stays JSON, so consumers can treat every ``str`` item as a compact record and
+every ``dict`` as before. ``decode`` is pure Python with no dependencies and
+rebuilds the nested dict (values rounded to the field's resolution).
+"""
+from __future__ import annotations
+import base64, struct
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+SCHEMA_VERSION = 1
+_HEAD = struct.Struct("<BQHB")
+
+# (path, struct code, scale). Append only: a field's bit is its index.
+FIELDS_V1: List[Tuple[Tuple[str, ...], str, int]] = [
+    (("environment", "temperature_c"), "h", 100),
+    (("environment", "humidity_pct"), "H", 100),
+    (("water", "level_pct"), "H", 10),
+    (("water", "raw"), "H", 1),
+    (("water", "voltage"), "H", 1000),
+    (("water", "window", "n"), "H", 1),
+    (("water", "window", "median_pct"), "H", 10),
+    (("water", "window", "ema_pct"), "H", 10),
+    (("water", "window", "min_pct"), "H", 10),
+    (("water", "window", "max_pct"), "H", 10),
+]
+SCHEMAS = {1: FIELDS_V1}
+_STRUCTS = {v: [struct.Struct("<" + code) for _, code, _ in f] for v, f in SCHEMAS.items()}
+_INDEX = {v: {path: i for i, (path, _, _) in enumerate(f)} for v, f in SCHEMAS.items()}
+
+class CodecError(ValueError):
+    pass
+
+def _ts_ms(ts: Any) -> int:
+    if isinstance(ts, (int, float)): return int(ts)
+    dt = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+    if dt.tzinfo is None: dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+def _flatten(d: Dict[str, Any], prefix: Tuple[str, ...] = ()) -> List[Tuple[Tuple[str, ...], Any]]:
+    out: List[Tuple[Tuple[str, ...], Any]] = []
+    for k, v in d.items():
+        if isinstance(v, dict): out.extend(_flatten(v, prefix + (k,)))
+        else: out.append((prefix + (k,), v))
+    return out
+
+def encode(payload: Dict[str, Any], version: int = SCHEMA_VERSION) -> bytes:
+    """Pack a telemetry payload; raises CodecError if it doesn't fit the schema."""
+    if payload.get("type") != "telemetry" or set(payload) - {"type", "ts", "device_id", "sensors"}:
+        raise CodecError("not a plain telemetry payload")
+    fields, structs, index = SCHEMAS[version], _STRUCTS[version], _INDEX[version]
+    values: Dict[int, int] = {}
+    for path, v in _flatten(payload.get("sensors") or {}):
+        i = index.get(path)
+        if i is None: raise CodecError(f"field {'.'.join(path)} not in schema v{version}")
+        if v is None: continue
+        values[i] = int(round(float(v) * fields[i][2]))
+    dev = str(payload.get("device_id", "")).encode("utf-8")
+    if len(dev) > 255: raise CodecError("device_id too long")
+    present = 0
+    for i in values: present |= 1 << i
+    try:
+        parts = [_HEAD.pack(version, _ts_ms(payload.get("ts", 0)), present, len(dev)), dev]
+        parts.extend(structs[i].pack(values[i]) for i in sorted(values))
+    except (struct.error, ValueError) as e:
+        raise CodecError(str(e)) from e
+    return b"".join(parts)
+
+def decode(data: bytes) -> Dict[str, Any]:
+    version, ts_ms, present, n = _HEAD.unpack_from(data, 0)
+    if version not in SCHEMAS: raise CodecError(f"unknown schema version {version}")
+    off = _HEAD.size
+    device_id = data[off:off + n].decode("utf-8"); off += n
+    sensors: Dict[str, Any] = {}
+    for i, (path, _, scale) in enumerate(SCHEMAS[version]):
+        if not present >> i & 1: continue
+        (raw,) = _STRUCTS[version][i].unpack_from(data, off); off += _STRUCTS[version][i].size
+        node = sensors
+        for k in path[:-1]: node = node.setdefault(k, {})
+        node[path[-1]] = raw if scale == 1 else raw / scale
+    ts = datetime.fromtimestamp(ts_ms / 1000, timezone.utc).isoformat()
+    return {"type": "telemetry", "ts": ts, "ts_ms": ts_ms, "device_id": device_id, "sensors": sensors}
+
+def encode_message(payload: Dict[str, Any]) -> Any:
+    """Wire form for the Bus: a base64 string when the payload fits, else the dict unchanged."""
+    try:
+        return base64.b64encode(encode(payload)).decode("ascii")
+    except CodecError:
+        return payload
+
+def decode_message(item: Any) -> Optional[Dict[str, Any]]:
+    """Inverse of ``encode_message`` for one item of a (possibly batched) PubNub message."""
+    if isinstance(item, str): return decode(base64.b64decode(item))
+    return item if isinstance(item, dict) else None
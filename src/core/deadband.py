@@ -0,0 +1,64 @@
+from __future__ import annotations
+import time
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+def parse_band(spec: Any) -> Tuple[float, float]:
+    """``0.5`` -> absolute band, ``"2%"`` -> percent of the last published value."""
+    if isinstance(spec, str) and spec.strip().endswith("%"):
+        return 0.0, float(spec.strip()[:-1])
+    if isinstance(spec, Mapping):
+        return float(spec.get("abs", 0.0)), float(spec.get("pct", 0.0))
+    return float(spec or 0.0), 0.0
+
+class TelemetryGate:
+    """
+    Decides whether a telemetry sample is worth publishing.
+
+    A sample goes out when any metric moved outside its deadband since the
+    last *published* sample, when it crossed one of the metric's thresholds,
+    when ``max_silence_s`` passed (heartbeat), or when the caller forces it.
+    Metrics without a configured band publish on any change.
+    """
+    def __init__(self, deadbands: Optional[Mapping[str, Any]] = None, max_silence_s: float = 300.0,
+                 thresholds: Optional[Mapping[str, Iterable[float]]] = None):
+        self.bands: Dict[str, Tuple[float, float]] = {k: parse_band(v) for k, v in (deadbands or {}).items()}
+        self.max_silence = float(max_silence_s)
+        self.thresholds: Dict[str, Tuple[float, ...]] = {k: tuple(float(x) for x in v) for k, v in (thresholds or {}).items()}
+        self._last: Dict[str, Optional[float]] = {}
+        self._last_at: Optional[float] = None
+        self.stats: Dict[str, int] = {"published": 0, "suppressed": 0, "heartbeats": 0, "forced": 0, "crossings": 0}
+
+    @classmethod
+    def from_settings(cls, settings: Any, thresholds: Optional[Mapping[str, Iterable[float]]] = None) -> "TelemetryGate":
+        cfg = settings.raw.get("telemetry", {})
+        return cls(cfg.get("deadband", {}), float(cfg.get("max_silence_s", 300.0)), thresholds)
+
+    def _moved(self, key: str, value: Optional[float]) -> bool:
+        if key not in self._last: return True
+        prev = self._last[key]
+        if prev is None or value is None: return prev is not value
+        abs_band, pct_band = self.bands.get(key, (0.0, 0.0))
+        band = max(abs_band, abs(prev) * pct_band / 100.0)
+        return abs(value - prev) > band if band else value != prev
+
+    def _crossed(self, key: str, value: Optional[float]) -> bool:
+        prev = self._last.get(key)
+        if prev is None or value is None: return False
+        return any((prev < t) != (value < t) for t in self.thresholds.get(key, ()))
+
+    def should_publish(self, metrics: Mapping[str, Optional[float]], force: bool = False,
+                       now: Optional[float] = None) -> bool:
+        """Returns True (and records ``metrics`` as last published) when the sample should go out."""
+        now = time.monotonic() if now is None else now
+        reason = None
+        if force: reason = "forced"
+        elif any(self._crossed(k, v) for k, v in metrics.items()): reason = "crossings"
+        elif self._last_at is None or any(self._moved(k, v) for k, v in metrics.items()): reason = "published"
+        elif now - self._last_at >= self.max_silence: reason = "heartbeats"
+        if reason is None:
+            self.stats["suppressed"] += 1
+            return False
+        if reason != "published": self.stats[reason] += 1
+        self.stats["published"] += 1
+        self._last.update(metrics); self._last_at = now
+        return True
@@ -0,0 +1,104 @@
+from __future__ import annotations
+import asyncio, functools, logging, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+logger = logging.getLogger("core.hw")
+
+BUSES=("gpio", "i2c")
+
+class HardwareTimeout(TimeoutError):
+    pass
+
+class HardwareExecutor:
+    """
+    Runs blocking driver calls off the event loop.
+
+    Each bus (GPIO, I2C) gets one worker thread, so calls on the same bus are
+    serialized in submission order while the two buses proceed independently.
+    ``lock(device)`` serializes multi-step sequences (e.g. a servo sweep)
+    against other users of the same device. A call that times out or whose
+    awaiting task is cancelled is abandoned by the caller; the driver call
+    itself finishes on its worker before the next queued call starts.
+    """
+    def __init__(self, buses=BUSES):
+        self._pools: Dict[str, ThreadPoolExecutor]={b: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"hw-{b}")
+                                                    for b in buses}
+        self._locks: Dict[str, asyncio.Lock]={}
+
+    def lock(self, device: str)->asyncio.Lock:
+        lk=self._locks.get(device)
+        if lk is None: lk=self._locks[device]=asyncio.Lock()
+        return lk
+
+    async def run(self, bus: str, fn: Callable[..., Any], *args: Any, timeout: Optional[float]=None, **kwargs: Any)->Any:
+        loop=asyncio.get_running_loop()
+        fut=loop.run_in_executor(self._pools[bus], functools.partial(fn, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            name=getattr(fn, "__qualname__", repr(fn))
+            logger.warning("Hardware call %s on %s timed out after %.2fs", name, bus, timeout or 0.0)
+            raise HardwareTimeout(f"{name} on {bus} timed out") from None
+
+    def shutdown(self, wait: bool=False)->None:
+        for p in self._pools.values(): p.shutdown(wait=wait, cancel_futures=True)
+
+_default: Optional[HardwareExecutor]=None
+
+def default_executor()->HardwareExecutor:
+    """Process-wide executor for components constructed without an explicit one."""
+    global _default
+    if _default is None: _default=HardwareExecutor()
+    return _default
+
+class LazyDevice:
+    """
+    Driver whose hardware (and driver library import) is set up on first use
+    instead of in the constructor.
+
+    Subclasses implement ``_open()``, which raises to fall back to mock mode.
+    ``open_async`` runs it on a plain thread under a timeout so several
+    devices can come up at once; a device that times out is switched to mock
+    and its late result is discarded.
+    """
+    mock: bool = False
+    _opened: bool = False
+    _open_lock: Optional[threading.Lock] = None
+    name: str = "device"
+
+    def _open(self) -> None:
+        raise NotImplementedError
+
+    def _fallback(self, reason: str) -> None:
+        logger.warning("%s init failed (%s); using mock.", self.name, reason)
+        self.mock = True
+
+    def open(self) -> bool:
+        """Set up the hardware if not done yet. Returns True when running on the real device."""
+        if self._opened: return not self.mock
+        if self._open_lock is None: self._open_lock = threading.Lock()
+        with self._open_lock:
+            if not self._opened:
+                if not self.mock:
+                    try: self._open()
+                    except Exception as e: self._fallback(str(e))
+                self._opened = True
+        return not self.mock
+
+    async def open_async(self, timeout: Optional[float] = None) -> bool:
+        if self._opened: return not self.mock
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(self.open), timeout)
+        except asyncio.TimeoutError:
+            self._fallback(f"no response within {timeout:.1f}s")
+            self._opened = True
+            return False
+
+async def open_devices(devices: Mapping[str, LazyDevice], timeout: float) -> Dict[str, Tuple[bool, float]]:
+    """Open all devices concurrently; ``{name: (real hardware?, seconds)}``."""
+    async def one(dev: LazyDevice) -> Tuple[bool, float]:
+        t0 = time.perf_counter()
+        ok = await dev.open_async(timeout)
+        return ok, time.perf_counter() - t0
+    results = await asyncio.gather(*(one(d) for d in devices.values()))
+    return dict(zip(devices, results))
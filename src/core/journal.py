@@ -0,0 +1,181 @@
+from __future__ import annotations
+import json, logging, os, struct, time, zlib
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Tuple
+logger = logging.getLogger("core.journal")
+
+_HDR = struct.Struct("<II")   # payload length, crc32(payload)
+_SUFFIX = ".seg"
+
+class Journal:
+    """
+    Append-only, segment-based on-disk queue.
+
+    Records are ``<len><crc32><json>`` frames appended to numbered segment
+    files. A small ``cursor`` file (replaced atomically) remembers how far the
+    reader got; fully consumed segments are deleted. On open the tail of the
+    newest segment is verified and a torn write is truncated, so a power cut
+    loses at most the records since the last fsync. Only offsets and counters
+    are kept in memory, regardless of how much is on disk.
+    """
+    def __init__(self, directory: str | Path, segment_bytes: int = 1 << 20, max_bytes: int = 32 << 20,
+                 fsync_every: int = 32, fsync_interval_s: float = 1.0):
+        self.dir = Path(directory); self.dir.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = max(4096, int(segment_bytes))
+        self.max_bytes = max(self.segment_bytes, int(max_bytes))
+        self.fsync_every = max(1, int(fsync_every)); self.fsync_interval = float(fsync_interval_s)
+        self.dropped = 0
+        self._cursor_path = self.dir / "cursor"
+        self._w: Optional[BinaryIO] = None; self._w_seg = 0; self._w_size = 0
+        self._r: Optional[BinaryIO] = None; self._r_seg = 0; self._r_off = 0
+        self._unsynced = 0; self._last_sync = time.monotonic()
+        self._recover()
+
+    # ---- layout helpers ----
+    def _seg_path(self, seg: int) -> Path:
+        return self.dir / f"{seg:012d}{_SUFFIX}"
+
+    def _segments(self) -> List[int]:
+        return sorted(int(p.stem) for p in self.dir.glob(f"*{_SUFFIX}") if p.stem.isdigit())
+
+    @staticmethod
+    def _scan(f: BinaryIO, start: int = 0) -> Tuple[int, int]:
+        """Walk frames from ``start``; return (records, offset of last good byte)."""
+        f.seek(start); n = 0; good = start
+        while True:
+            hdr = f.read(_HDR.size)
+            if len(hdr) < _HDR.size: break
+            size, crc = _HDR.unpack(hdr)
+            body = f.read(size)
+            if len(body) < size or zlib.crc32(body) != crc: break
+            n += 1; good = f.tell()
+        return n, good
+
+    def _recover(self) -> None:
+        segs = self._segments()
+        self._r_seg, self._r_off = self._load_cursor(segs)
+        self._pending = 0; self._bytes = 0
+        for seg in [s for s in segs if s < self._r_seg]:
+            self._seg_path(seg).unlink(missing_ok=True)
+        segs = [s for s in segs if s >= self._r_seg]
+        for seg in segs:
+            path = self._seg_path(seg)
+            with open(path, "rb+") as f:
+                n, good = self._scan(f)
+                if good < os.fstat(f.fileno()).st_size:
+                    logger.warning("Journal %s: truncating torn tail of %s at %d", self.dir.name, path.name, good)
+                    f.truncate(good)
+                if seg == self._r_seg and self._r_off:
+                    self._r_off = min(self._r_off, good)
+                    n = self._scan(f, self._r_off)[0]
+            self._pending += n; self._bytes += path.stat().st_size
+        self._w_seg = segs[-1] if segs else max(self._r_seg, 1)
+        if self._r_seg not in segs: self._r_seg, self._r_off = self._w_seg, 0
+        self._open_writer()
+        if self._pending:
+            logger.info("Journal %s: %d record(s) pending replay", self.dir.name, self._pending)
+
+    def _load_cursor(self, segs: List[int]) -> Tuple[int, int]:
+        try:
+            seg, off = (int(x) for x in self._cursor_path.read_text().split())
+        except (OSError, ValueError):
+            return (segs[0] if segs else 0), 0
+        if segs and seg < segs[0]: return segs[0], 0
+        return seg, off
+
+    def _save_cursor(self) -> None:
+        tmp = self._cursor_path.with_suffix(".tmp")
+        tmp.write_text(f"{self._r_seg} {self._r_off}")
+        os.replace(tmp, self._cursor_path)
+
+    def _open_writer(self) -> None:
+        self._w = open(self._seg_path(self._w_seg), "ab")
+        self._w_size = self._w.tell()
+
+    # ---- writer ----
+    def __len__(self) -> int:
+        return self._pending
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def append(self, record: dict) -> None:
+        body = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        if self._w_size and self._w_size + _HDR.size + len(body) > self.segment_bytes:
+            self._roll()
+        self._w.write(_HDR.pack(len(body), zlib.crc32(body))); self._w.write(body)  # type: ignore
+        n = _HDR.size + len(body)
+        self._w_size += n; self._bytes += n; self._pending += 1; self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+        if self._bytes > self.max_bytes:
+            self._drop_oldest()
+
+    def sync(self) -> None:
+        if self._w is None or not self._unsynced: return
+        self._w.flush(); os.fsync(self._w.fileno())
+        self._unsynced = 0; self._last_sync = time.monotonic()
+
+    def _roll(self) -> None:
+        self.sync(); self._w.close()  # type: ignore
+        self._w_seg += 1; self._open_writer()
+
+    def _drop_oldest(self) -> None:
+        """Enforce ``max_bytes`` by discarding the oldest unread segment."""
+        if self._r_seg >= self._w_seg: return
+        path = self._seg_path(self._r_seg)
+        with open(path, "rb") as f:
+            lost = self._scan(f, self._r_off)[0]
+        size = path.stat().st_size
+        if self._r is not None: self._r.close(); self._r = None
+        path.unlink(missing_ok=True)
+        self._bytes -= size; self._pending -= lost; self.dropped += lost
+        self._r_seg += 1; self._r_off = 0; self._save_cursor()
+        logger.warning("Journal %s over %d bytes; dropped %d oldest record(s)", self.dir.name, self.max_bytes, lost)
+
+    # ---- reader ----
+    def read_batch(self, max_records: int) -> Tuple[List[dict], Tuple[int, int, int]]:
+        """Return up to ``max_records`` in order plus the cursor to ``commit`` once they are delivered."""
+        out: List[dict] = []; seg, off = self._r_seg, self._r_off; frames = 0
+        if self._w is not None: self._w.flush()
+        while frames < max_records and self._pending:
+            if self._r is None or self._r.name != str(self._seg_path(seg)):
+                if self._r is not None: self._r.close()
+                self._r = open(self._seg_path(seg), "rb")
+            self._r.seek(off)
+            while frames < max_records:
+                hdr = self._r.read(_HDR.size)
+                if len(hdr) < _HDR.size: break
+                size, crc = _HDR.unpack(hdr)
+                body = self._r.read(size)
+                if len(body) < size or zlib.crc32(body) != crc: break
+                off += _HDR.size + size; frames += 1
+                try: out.append(json.loads(body))
+                except ValueError: logger.error("Journal %s: skipping undecodable record", self.dir.name)
+            if frames >= max_records or seg >= self._w_seg: break
+            seg += 1; off = 0
+        if not frames: self._pending = 0
+        return out, (seg, off, frames)
+
+    def commit(self, cursor: Tuple[int, int, int]) -> None:
+        seg, off, count = cursor
+        if seg < self._r_seg: return   # segment was dropped by the size cap meanwhile
+        for old in range(self._r_seg, seg):
+            path = self._seg_path(old)
+            try: self._bytes -= path.stat().st_size
+            except OSError: pass
+            if self._r is not None and self._r.name == str(path): self._r.close(); self._r = None
+            path.unlink(missing_ok=True)
+        self._r_seg, self._r_off = seg, off
+        self._pending = max(0, self._pending - count)
+        if not self._pending and self._r_seg == self._w_seg and self._w_size:
+            # everything delivered: start a fresh segment so the old one can go
+            self._roll(); self.commit((self._w_seg, 0, 0)); return
+        self._save_cursor()
+
+    def close(self) -> None:
+        self.sync()
+        if self._w is not None: self._w.close(); self._w = None
+        if self._r is not None: self._r.close(); self._r = None
+        self._save_cursor()
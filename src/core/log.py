@@ -1,6 +1,177 @@
-import logging, sys
+"""
+Logging that never blocks the event loop.
 
-def setup_logging(level: str='INFO'):
-    lvl=getattr(logging, level.upper(), logging.INFO)
-    fmt='%(asctime)s | %(levelname)s | %(name)s | %(message)s'
-    logging.basicConfig(stream=sys.stdout, level=lvl, format=fmt)
+``setup_logging`` installs a ``QueueHandler`` on the root logger; the calling
+thread only filters, formats the message and enqueues it (dropping, and
+counting, when the queue is full). A background thread writes the records to
+stdout and optionally to a size-capped rotating file, as text or JSON lines.
+``RateLimitFilter`` caps each call site (file:line) at a burst plus a steady
+rate and drops exact repeats within ``dedupe_s``; suppressed messages are
+counted and reported as "suppressed N messages" on the site's next record, or
+by the drain thread once the site has gone quiet.
+"""
+from __future__ import annotations
+import atexit, json, logging, logging.handlers, queue, sys, threading, time
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+TEXT_FORMAT='%(asctime)s | %(levelname)s | %(name)s | %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg (+ suppressed). Tracebacks are part of msg."""
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any]={'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+                             'level': record.levelname, 'logger': record.name, 'msg': record.getMessage()}
+        n=getattr(record, 'suppressed', 0)
+        if n: out['suppressed']=n
+        return json.dumps(out, ensure_ascii=False)
+
+class _Site:
+    __slots__=('tokens', 'stamp', 'last_msg', 'last_at', 'suppressed', 'since', 'record')
+    def __init__(self, burst: float, now: float):
+        self.tokens=burst; self.stamp=now; self.last_msg=''; self.last_at=0.0
+        self.suppressed=0; self.since=now; self.record: Optional[logging.LogRecord]=None
+
+class RateLimitFilter(logging.Filter):
+    """
+    Per call site token bucket (``burst`` records, refilled at ``rate_per_s``)
+    plus suppression of identical messages within ``dedupe_s``. Records at or
+    above ``exempt_level`` always pass.
+    """
+    def __init__(self, burst: float=10, rate_per_s: float=1.0, dedupe_s: float=30.0,
+                 exempt_level: int=logging.CRITICAL, max_sites: int=4096):
+        super().__init__()
+        self.burst=float(burst); self.rate=float(rate_per_s); self.dedupe=float(dedupe_s)
+        self.exempt=exempt_level; self.max_sites=max_sites
+        self._sites: Dict[Tuple[str, int], _Site]={}
+        self._lock=threading.Lock()
+        self.suppressed_total=0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno>=self.exempt: return True
+        now=time.monotonic(); key=(record.pathname, record.lineno)
+        with self._lock:
+            site=self._sites.get(key)
+            if site is None:
+                if len(self._sites)>=self.max_sites: self._sites.clear()
+                site=self._sites[key]=_Site(self.burst, now)
+            site.tokens=min(self.burst, site.tokens+(now-site.stamp)*self.rate); site.stamp=now
+            msg=record.getMessage()
+            if site.tokens<1.0 or (msg==site.last_msg and now-site.last_at<self.dedupe):
+                if not site.suppressed: site.since=now
+                site.suppressed+=1; site.record=record; self.suppressed_total+=1
+                return False
+            site.tokens-=1.0; site.last_msg=msg; site.last_at=now
+            if site.suppressed:
+                record.msg=f'{msg} [suppressed {site.suppressed} messages in {now-site.since:.0f}s]'
+                record.args=None; record.suppressed=site.suppressed  # type: ignore[attr-defined]
+                site.suppressed=0; site.record=None
+        return True
+
+    def pending(self, quiet_s: float) -> List[logging.LogRecord]:
+        """Summary records for sites that suppressed messages and have been quiet for ``quiet_s``."""
+        now=time.monotonic(); out=[]
+        with self._lock:
+            for site in self._sites.values():
+                if site.suppressed and site.record is not None and now-site.stamp>=quiet_s:
+                    r=site.record
+                    attrs={k: v for k, v in r.__dict__.items() if k not in ('created', 'msecs', 'relativeCreated')}
+                    out.append(logging.makeLogRecord({**attrs, 'args': None, 'suppressed': site.suppressed,
+                        'msg': f'suppressed {site.suppressed} messages like: {r.getMessage()}'}))
+                    site.suppressed=0; site.record=None
+        return out
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q: queue.Queue):
+        super().__init__(q); self.dropped=0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try: self.queue.put_nowait(record)
+        except queue.Full: self.dropped+=1
+
+class LogPipeline:
+    """The queue handler, its drain thread and the output handlers; ``stop`` flushes and joins."""
+    def __init__(self, handlers: List[logging.Handler], queue_size: int=10000,
+                 limiter: Optional[RateLimitFilter]=None, summary_s: float=10.0):
+        self.handlers=handlers; self.limiter=limiter; self.summary_s=summary_s
+        self.queue: queue.Queue=queue.Queue(maxsize=max(1, queue_size))
+        self.handler=_DroppingQueueHandler(self.queue)
+        if limiter is not None: self.handler.addFilter(limiter)
+        self._reported_drops=0
+        self._thread=threading.Thread(target=self._drain, name='log-drain', daemon=True)
+        self._thread.start()
+
+    def _emit(self, record: logging.LogRecord) -> None:
+        for h in self.handlers:
+            if record.levelno>=h.level: h.handle(record)
+
+    def _housekeeping(self) -> None:
+        if self.limiter is not None:
+            for r in self.limiter.pending(self.summary_s): self._emit(r)
+        dropped=self.handler.dropped
+        if dropped>self._reported_drops:
+            self._emit(logging.makeLogRecord({'name': 'core.log', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                                              'msg': f'log queue full: dropped {dropped-self._reported_drops} records'}))
+            self._reported_drops=dropped
+
+    def _drain(self) -> None:
+        next_check=time.monotonic()+self.summary_s
+        while True:
+            try:
+                record=self.queue.get(timeout=max(0.05, next_check-time.monotonic()))
+            except queue.Empty:
+                record=None
+            if record is self.queue:   # stop sentinel
+                self._housekeeping(); return
+            if record is not None:
+                try: self._emit(record)
+                except Exception: pass
+            if time.monotonic()>=next_check:
+                self._housekeeping(); next_check=time.monotonic()+self.summary_s
+
+    def stop(self, timeout: float=2.0) -> None:
+        if not self._thread.is_alive(): return
+        try: self.queue.put(self.queue, timeout=timeout)
+        except queue.Full: pass
+        self._thread.join(timeout)
+        for h in self.handlers:
+            try: h.flush(); h.close()
+            except Exception: pass
+
+_pipeline: Optional[LogPipeline]=None
+
+def _stop() -> None:
+    if _pipeline is not None: _pipeline.stop()
+
+def setup_logging(level: str='INFO', cfg: Optional[Mapping[str, Any]]=None, base_dir: Optional[Path]=None) -> LogPipeline:
+    """
+    (Re)configure root logging from a ``[logging]`` section: ``level``,
+    ``format`` ("text" | "json"), ``file`` (relative to ``base_dir``),
+    ``max_bytes``, ``backup_count``, ``queue_size``, ``rate_limit_burst``
+    (0 disables limiting), ``rate_limit_per_s``, ``dedupe_s``, ``summary_s``.
+    """
+    global _pipeline
+    cfg=cfg or {}
+    lvl=getattr(logging, str(cfg.get('level', level)).upper(), logging.INFO)
+    formatter=JsonFormatter() if str(cfg.get('format', 'text')).lower()=='json' else logging.Formatter(TEXT_FORMAT)
+    handlers: List[logging.Handler]=[logging.StreamHandler(sys.stdout)]
+    if cfg.get('file'):
+        path=Path(cfg['file'])
+        if not path.is_absolute() and base_dir is not None: path=base_dir/path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(path, maxBytes=int(cfg.get('max_bytes', 10_000_000)),
+                                                             backupCount=int(cfg.get('backup_count', 3)), encoding='utf-8'))
+    for h in handlers: h.setFormatter(formatter)
+    burst=float(cfg.get('rate_limit_burst', 10))
+    limiter=(RateLimitFilter(burst, float(cfg.get('rate_limit_per_s', 1.0)), float(cfg.get('dedupe_s', 30.0)))
+             if burst>0 else None)
+    pipeline=LogPipeline(handlers, int(cfg.get('queue_size', 10000)), limiter, float(cfg.get('summary_s', 10.0)))
+    root=logging.getLogger()
+    if _pipeline is not None:
+        root.removeHandler(_pipeline.handler); _pipeline.stop()
+    else:
+        for h in list(root.handlers): root.removeHandler(h)
+        atexit.register(_stop)
+    root.addHandler(pipeline.handler); root.setLevel(lvl)
+    _pipeline=pipeline
+    return pipeline
@@ -0,0 +1,229 @@
+"""
+In-process metrics: counters, gauges and fixed-bucket histograms.
+
+Components take an optional ``metrics`` registry (``default_registry()``
+otherwise) and bind their label children once at construction, so a hot
+path update is an attribute lookup plus an integer/float add; a histogram
+observation is one ``bisect`` over a small tuple of bucket bounds. The
+registry renders a JSON-friendly ``snapshot()`` (the ``getMetrics`` command)
+and the Prometheus text exposition format (``MetricsServer``).
+"""
+from __future__ import annotations
+import asyncio, logging, math
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+logger = logging.getLogger("core.metrics")
+
+# seconds; covers sub-ms publishes up to multi-second servo sweeps
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _Counter:
+    __slots__ = ("value",)
+    def __init__(self) -> None: self.value = 0.0
+    def inc(self, n: float = 1.0) -> None: self.value += n
+
+class _Gauge:
+    __slots__ = ("value", "fn")
+    def __init__(self) -> None:
+        self.value = 0.0; self.fn: Optional[Callable[[], float]] = None
+    def set(self, v: Optional[float]) -> None: self.value = math.nan if v is None else float(v)
+    def inc(self, n: float = 1.0) -> None: self.value += n
+    def dec(self, n: float = 1.0) -> None: self.value -= n
+    def set_function(self, fn: Callable[[], float]) -> None:
+        """Sample ``fn()`` at read time instead of storing a value."""
+        self.fn = fn
+    def get(self) -> float:
+        if self.fn is None: return self.value
+        try: return float(self.fn())
+        except Exception: return math.nan
+
+class _Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds; self.counts = [0] * (len(bounds) + 1)   # last slot is +Inf
+        self.sum = 0.0; self.count = 0
+    def observe(self, v: float) -> None:
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.sum += v; self.count += 1
+    def cumulative(self) -> List[int]:
+        out, acc = [], 0
+        for c in self.counts:
+            acc += c; out.append(acc)
+        return out
+
+_KINDS = {"counter": _Counter, "gauge": _Gauge, "histogram": _Histogram}
+
+class Metric:
+    """A named family; ``labels(*values)`` returns (and caches) the child for one label set."""
+    def __init__(self, name: str, help: str, kind: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name; self.help = help; self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def labels(self, *values: Any) -> Any:
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            child = self._children[key] = (_Histogram(self.buckets) if self.kind == "histogram"
+                                           else _KINDS[self.kind]())
+        return child
+
+    # unlabelled shorthands
+    def inc(self, n: float = 1.0) -> None: self.labels().inc(n)
+    def set(self, v: Optional[float]) -> None: self.labels().set(v)
+    def observe(self, v: float) -> None: self.labels().observe(v)
+    def set_function(self, fn: Callable[[], float]) -> None: self.labels().set_function(fn)
+
+    def samples(self) -> List[Tuple[Dict[str, str], Any]]:
+        return [(dict(zip(self.labelnames, k)), c) for k, c in sorted(self._children.items())]
+
+def _fmt(v: float) -> str:
+    if math.isnan(v): return "NaN"
+    if math.isinf(v): return "+Inf" if v > 0 else "-Inf"
+    return repr(int(v)) if float(v).is_integer() and abs(v) < 1e15 else repr(float(v))
+
+def _labelstr(labels: Dict[str, str], extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels.items()) + ([extra] if extra else [])
+    if not items: return ""
+    esc = lambda s: s.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+class _BoundMetric:
+    """A family with leading label values fixed (see ``MetricsRegistry.scoped``)."""
+    __slots__ = ("metric", "prefix")
+    def __init__(self, metric: Metric, prefix: Tuple[str, ...]):
+        self.metric = metric; self.prefix = prefix
+    def labels(self, *values: Any) -> Any: return self.metric.labels(*self.prefix, *values)
+    def inc(self, n: float = 1.0) -> None: self.labels().inc(n)
+    def set(self, v: Optional[float]) -> None: self.labels().set(v)
+    def observe(self, v: float) -> None: self.labels().observe(v)
+    def set_function(self, fn: Callable[[], float]) -> None: self.labels().set_function(fn)
+
+class ScopedRegistry:
+    """Registry view that adds constant labels (e.g. ``device``) in front of every metric's own."""
+    def __init__(self, parent: "MetricsRegistry", labels: Dict[str, str]):
+        self.parent = parent
+        self.names = tuple(labels); self.values = tuple(str(v) for v in labels.values())
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> _BoundMetric:
+        return _BoundMetric(self.parent.counter(name, help, self.names + tuple(labels)), self.values)
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> _BoundMetric:
+        return _BoundMetric(self.parent.gauge(name, help, self.names + tuple(labels)), self.values)
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> _BoundMetric:
+        return _BoundMetric(self.parent.histogram(name, help, self.names + tuple(labels), buckets), self.values)
+
+    def scoped(self, **labels: Any) -> "ScopedRegistry":
+        return ScopedRegistry(self.parent, {**dict(zip(self.names, self.values)), **labels})
+
+    def snapshot(self, prefix: str = "") -> Dict[str, Any]:
+        return self.parent.snapshot(prefix)
+
+    def render(self) -> str:
+        return self.parent.render()
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+
+    def scoped(self, **labels: Any) -> ScopedRegistry:
+        """View whose metrics all carry ``labels``, for several instances of one component."""
+        return ScopedRegistry(self, labels)
+
+    def _get(self, name: str, help: str, kind: str, labels: Sequence[str], **kw: Any) -> Metric:
+        m = self._metrics.get(name)
+        if m is None:
+            m = self._metrics[name] = Metric(name, help, kind, labels, **kw)
+        elif m.kind != kind or m.labelnames != tuple(labels):
+            raise ValueError(f"metric {name} already registered as {m.kind}{m.labelnames}")
+        return m
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Metric:
+        return self._get(name, help, "counter", labels)
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Metric:
+        return self._get(name, help, "gauge", labels)
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Metric:
+        return self._get(name, help, "histogram", labels, buckets=buckets)
+
+    def snapshot(self, prefix: str = "") -> Dict[str, Any]:
+        """``{name: {type, help, values: [...]}}`` for metrics starting with ``prefix``."""
+        out: Dict[str, Any] = {}
+        for name, m in sorted(self._metrics.items()):
+            if not name.startswith(prefix): continue
+            values = []
+            for labels, c in m.samples():
+                if m.kind == "histogram":
+                    cum = c.cumulative()
+                    values.append({"labels": labels, "count": c.count, "sum": round(c.sum, 6),
+                                   "mean": round(c.sum / c.count, 6) if c.count else None,
+                                   "buckets": {_fmt(b): n for b, n in zip(m.buckets + (math.inf,), cum)}})
+                else:
+                    v = c.get() if m.kind == "gauge" else c.value
+                    values.append({"labels": labels, "value": None if math.isnan(v) else v})
+            out[name] = {"type": m.kind, "help": m.help, "values": values}
+        return out
+
+    def render(self) -> str:
+        """Prometheus text exposition format (0.0.4)."""
+        lines: List[str] = []
+        for name, m in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {m.help}"); lines.append(f"# TYPE {name} {m.kind}")
+            for labels, c in m.samples():
+                if m.kind == "histogram":
+                    for b, n in zip(m.buckets + (math.inf,), c.cumulative()):
+                        lines.append(f"{name}_bucket{_labelstr(labels, ('le', _fmt(b)))} {n}")
+                    lines.append(f"{name}_sum{_labelstr(labels)} {_fmt(c.sum)}")
+                    lines.append(f"{name}_count{_labelstr(labels)} {c.count}")
+                else:
+                    lines.append(f"{name}{_labelstr(labels)} {_fmt(c.get() if m.kind == 'gauge' else c.value)}")
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Minimal HTTP endpoint serving ``registry.render()`` on ``GET /metrics``."""
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9108):
+        self.registry = registry; self.host = host; self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Metrics endpoint on http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close(); await self._server.wait_closed(); self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            while (await asyncio.wait_for(reader.readline(), timeout=5.0)).strip():
+                pass
+            parts = request.split(b" ")
+            path = parts[1].split(b"?")[0] if len(parts) >= 2 else b""
+            if parts[0] == b"GET" and path in (b"/metrics", b"/"):
+                body = self.registry.render().encode()
+                writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                             b"Content-Length: %d\r\n\r\n" % len(body) + body)
+            else:
+                writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+_default: Optional[MetricsRegistry] = None
+
+def default_registry() -> MetricsRegistry:
+    """Process-wide registry for components constructed without an explicit one."""
+    global _default
+    if _default is None: _default = MetricsRegistry()
+    return _default
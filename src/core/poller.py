@@ -0,0 +1,188 @@
+"""
+One engine for every periodic sensor read.
+
+Sources are grouped by hardware lane (``gpio``, ``i2c``, as in
+``HardwareExecutor``); each lane has one worker that reads its sources in
+due order, so reads on a bus never overlap or pile up in the executor, and
+start phases are staggered so sources with equal intervals don't fire
+together. Each source's interval comes from its ``AdaptiveRate``, which the
+consuming service feeds. Readings go through one bounded pipeline to the
+sources' sinks.
+"""
+from __future__ import annotations
+import asyncio, heapq, itertools, logging, time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Mapping, Optional, Tuple
+from core.deadband import parse_band
+from core.metrics import MetricsRegistry, default_registry
+logger = logging.getLogger("core.poller")
+
+PHASE_STEP=0.618   # golden-ratio spacing of start phases within an interval
+
+class AdaptiveRate:
+    """
+    Poll interval between ``min_s`` and ``max_s`` driven by observed values.
+
+    A value within ``margin`` of one of its thresholds pins the interval to
+    ``min_s``; a move beyond its band (same specs as telemetry deadbands)
+    since the previous observation divides the interval by ``speedup``;
+    otherwise it stretches by ``slowdown``. Without observations it stays at
+    ``base_s``.
+    """
+    def __init__(self, base_s: float, min_s: Optional[float] = None, max_s: Optional[float] = None,
+                 bands: Optional[Mapping[str, Any]] = None, thresholds: Optional[Mapping[str, Iterable[float]]] = None,
+                 margin: float = 0.0, speedup: float = 2.0, slowdown: float = 1.25):
+        self.base = max(1e-3, float(base_s))
+        self.min = self.base if min_s is None else max(1e-3, min(float(min_s), self.base))
+        self.max = self.base if max_s is None else max(float(max_s), self.base)
+        self.bands = {k: parse_band(v) for k, v in (bands or {}).items()}
+        self.thresholds = {k: tuple(float(x) for x in v) for k, v in (thresholds or {}).items()}
+        self.margin = float(margin); self.speedup = max(1.0, speedup); self.slowdown = max(1.0, slowdown)
+        self.interval = self.base
+        self._last: Dict[str, float] = {}
+
+    @property
+    def scale(self) -> float:
+        """Current interval relative to the base one."""
+        return self.interval / self.base
+
+    def _near(self, key: str, value: float) -> bool:
+        return any(abs(value - t) <= self.margin for t in self.thresholds.get(key, ()))
+
+    def _moved(self, key: str, value: float) -> bool:
+        prev = self._last.get(key)
+        if prev is None: return False
+        abs_band, pct_band = self.bands.get(key, (0.0, 0.0))
+        return abs(value - prev) > max(abs_band, abs(prev) * pct_band / 100.0)
+
+    def observe(self, values: Mapping[str, Optional[float]]) -> float:
+        vals = {k: float(v) for k, v in values.items() if v is not None}
+        if not vals: return self.interval
+        if any(self._near(k, v) for k, v in vals.items()): self.interval = self.min
+        elif any(self._moved(k, v) for k, v in vals.items()): self.interval = max(self.min, self.interval / self.speedup)
+        else: self.interval = min(self.max, self.interval * self.slowdown)
+        self._last.update(vals)
+        return self.interval
+
+@dataclass
+class Reading:
+    source: str
+    value: Any            # None when the read failed
+    ts: float             # wall clock at read start
+    t_mono: float         # loop time at read start
+    duration_s: float
+
+Sink = Callable[[Reading], Awaitable[None]]
+
+class _Source:
+    __slots__ = ("name", "read", "rate", "sink", "lane", "m_read", "m_errors", "m_interval")
+    def __init__(self, name: str, read: Callable[[], Awaitable[Any]], rate: AdaptiveRate, sink: Sink,
+                 lane: str, metrics: Any, sensor: str):
+        self.name = name; self.read = read; self.rate = rate; self.sink = sink; self.lane = lane
+        self.m_read = metrics.histogram("sensor_read_seconds", "Sensor read duration", ("sensor",)).labels(sensor)
+        self.m_errors = metrics.counter("sensor_read_errors_total", "Failed sensor reads", ("sensor",)).labels(sensor)
+        self.m_interval = metrics.gauge("sensor_poll_interval_seconds", "Current adaptive poll interval", ("sensor",)).labels(sensor)
+        self.m_interval.set_function(lambda: rate.interval)
+
+class _Lane:
+    def __init__(self) -> None:
+        self.heap: List[Tuple[float, int, _Source]] = []
+        self.pending: List[Tuple[float, _Source]] = []   # (start offset, source) added before the lane started
+        self.wake = asyncio.Event()
+
+class SensorPoller:
+    """
+    Owns the sensor read loops. ``add`` registers a source; ``run`` drives
+    every lane plus the pipeline until cancelled. ``read`` returns the value
+    or None on failure; ``sink`` gets every ``Reading`` in order.
+    """
+    def __init__(self, pipeline_size: int = 256, metrics: MetricsRegistry | None = None):
+        self._lanes: Dict[str, _Lane] = {}
+        self._sources: Dict[str, _Source] = {}
+        self._seq = itertools.count()
+        self._pipeline: Deque[Reading] = deque(maxlen=max(1, int(pipeline_size)))
+        self._ready = asyncio.Event()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._running = False
+        m = metrics or default_registry()
+        self._m_lag = m.histogram("sensor_poll_lag_seconds", "Read start delay behind its due time", ("lane",),
+                                  buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+        self._m_dropped = m.counter("sensor_pipeline_dropped_total", "Readings dropped because the pipeline was full")
+        m.gauge("sensor_pipeline_depth", "Readings waiting for their sink").set_function(lambda: len(self._pipeline))
+
+    def add(self, name: str, read: Callable[[], Awaitable[Any]], rate: AdaptiveRate, sink: Sink,
+            lane: str = "i2c", metrics: Any = None, sensor: Optional[str] = None) -> None:
+        """``metrics`` is the source owner's registry (per-device in gateway mode); ``sensor`` labels its series."""
+        if name in self._sources: raise ValueError(f"sensor source {name} already registered")
+        src = self._sources[name] = _Source(name, read, rate, sink, lane, metrics or default_registry(), sensor or name)
+        ln = self._lanes.get(lane)
+        if ln is None: ln = self._lanes[lane] = _Lane()
+        # stagger: the k-th source on a lane starts a golden-ratio fraction into its interval;
+        # the offset is relative until the lane worker puts it on the loop clock
+        offset = rate.interval * ((len(ln.heap) * PHASE_STEP) % 1.0)
+        if self._running:
+            heapq.heappush(ln.heap, (asyncio.get_running_loop().time() + offset, next(self._seq), src)); ln.wake.set()
+            if lane not in self._tasks:
+                self._tasks[lane] = asyncio.create_task(self._lane(lane, ln), name=f"poll-{lane}")
+        else:
+            ln.pending.append((offset, src))
+
+    def sources(self) -> Dict[str, Dict[str, Any]]:
+        return {n: {"lane": s.lane, "interval_s": round(s.rate.interval, 3)} for n, s in self._sources.items()}
+
+    async def _lane(self, name: str, ln: _Lane) -> None:
+        loop = asyncio.get_running_loop(); lag = self._m_lag.labels(name)
+        for offset, src in ln.pending: heapq.heappush(ln.heap, (loop.time() + offset, next(self._seq), src))
+        ln.pending.clear()
+        while True:
+            if not ln.heap:
+                ln.wake.clear(); await ln.wake.wait(); continue
+            due = ln.heap[0][0]; delay = due - loop.time()
+            if delay > 0:
+                ln.wake.clear()
+                try: await asyncio.wait_for(ln.wake.wait(), timeout=delay)
+                except asyncio.TimeoutError: pass
+                continue
+            _, _, src = heapq.heappop(ln.heap)
+            start = loop.time(); lag.observe(start - due); ts = time.time()
+            try:
+                value = await src.read()
+            except Exception as e:
+                logger.warning("Sensor %s read failed: %s", src.name, e); value = None
+            dur = loop.time() - start
+            src.m_read.observe(dur)
+            if value is None: src.m_errors.inc()
+            self._emit(Reading(src.name, value, ts, start, dur))
+            # next read one interval after this one was due, so lateness doesn't accumulate;
+            # if that is already past (long read, slow lane) don't try to catch up
+            heapq.heappush(ln.heap, (max(due + src.rate.interval, loop.time()), next(self._seq), src))
+
+    def _emit(self, r: Reading) -> None:
+        if len(self._pipeline) == self._pipeline.maxlen: self._m_dropped.inc()
+        self._pipeline.append(r); self._ready.set()
+
+    async def _drain(self) -> None:
+        while True:
+            await self._ready.wait(); self._ready.clear()
+            while self._pipeline:
+                r = self._pipeline.popleft()
+                src = self._sources.get(r.source)
+                if src is None: continue
+                try: await src.sink(r)
+                except Exception:
+                    logger.exception("Sensor %s sink failed", r.source)
+
+    async def run(self) -> None:
+        self._running = True
+        self._tasks = {lane: asyncio.create_task(self._lane(lane, ln), name=f"poll-{lane}")
+                       for lane, ln in self._lanes.items()}
+        drain = asyncio.create_task(self._drain(), name="poll-pipeline")
+        try:
+            await drain
+        finally:
+            self._running = False
+            tasks = [drain, *self._tasks.values()]
+            for t in tasks: t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._tasks = {}
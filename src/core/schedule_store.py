@@ -0,0 +1,133 @@
+from __future__ import annotations
+import json, logging, os, shutil, zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, TextIO
+logger = logging.getLogger("core.schedule_store")
+SNAPSHOT_VERSION=2
+
+def _fsync_dir(path: Path)->None:
+    try:
+        fd=os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try: os.fsync(fd)
+    except OSError: pass
+    finally: os.close(fd)
+
+class ScheduleStore:
+    """
+    Snapshot + write-ahead log for scheduler jobs.
+
+    ``schedules.json`` holds a compact snapshot ``{"version": 2, "jobs": [...]}``
+    and ``schedules.wal`` gets one ``<crc32> {"op": ...}`` line per add/remove
+    (and per fire, recording the job's ``last_fired`` slot).
+    Startup loads the snapshot and replays the log tail (a torn last line is
+    dropped); ``compact`` writes a new snapshot via tmp file + atomic rename and
+    truncates the log. A legacy snapshot (a bare JSON list, as written before
+    the log existed) is read as-is and rewritten in the new format on load.
+
+    Compaction can also run off the event loop: ``rotate`` moves the log to
+    ``schedules.wal.prev`` (new records go to a fresh log) and
+    ``write_snapshot``, safe to call from a worker thread, writes the snapshot
+    as of the rotation and then deletes the previous log. Every record is
+    idempotent, so loading replays ``.wal.prev`` and then ``.wal`` over
+    whichever snapshot survived a crash.
+    """
+    def __init__(self, snapshot_path: str | Path, compact_every: int=500, fsync: bool=True):
+        self.snapshot=Path(snapshot_path); self.wal=self.snapshot.with_suffix('.wal')
+        self.prev=self.snapshot.with_suffix('.wal.prev')
+        self.compact_every=max(1, int(compact_every)); self.fsync=fsync
+        self.wal_records=0
+        self._f: Optional[TextIO]=None
+
+    def load(self)->Dict[str, Dict[str, Any]]:
+        jobs: Dict[str, Dict[str, Any]]={}
+        legacy=False
+        if self.snapshot.exists():
+            data=json.loads(self.snapshot.read_text('utf-8'))
+            if isinstance(data, list):
+                legacy=True; items=data
+            else:
+                items=data.get('jobs', [])
+            for j in items: jobs[j['id']]=j
+        self.wal_records=self._replay(self.prev, jobs)+self._replay(self.wal, jobs)
+        if legacy:
+            logger.info('Migrating legacy %s to snapshot v%d', self.snapshot.name, SNAPSHOT_VERSION)
+            self.compact(jobs.values())
+        return jobs
+
+    def _replay(self, path: Path, jobs: Dict[str, Dict[str, Any]])->int:
+        if not path.exists(): return 0
+        n=0; good=0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    crc, body=line.rstrip(b'\n').split(b' ', 1)
+                    if not line.endswith(b'\n') or int(crc, 16)!=zlib.crc32(body): raise ValueError('crc')
+                    rec=json.loads(body)
+                except ValueError:
+                    logger.warning('Schedule log: dropping torn record at offset %d', good); break
+                if rec.get('op')=='add': jobs[rec['job']['id']]=rec['job']
+                elif rec.get('op')=='rm': jobs.pop(rec.get('id'), None)
+                elif rec.get('op')=='fired' and rec.get('id') in jobs: jobs[rec['id']]['last_fired']=rec.get('at')
+                n+=1; good+=len(line)
+        if good<path.stat().st_size:
+            with open(path, 'rb+') as f: f.truncate(good)
+        return n
+
+    def _append(self, rec: Dict[str, Any])->None:
+        if self._f is None:
+            self.snapshot.parent.mkdir(parents=True, exist_ok=True)
+            self._f=open(self.wal, 'a', encoding='utf-8')
+        body=json.dumps(rec, separators=(',', ':'))
+        self._f.write(f'{zlib.crc32(body.encode("utf-8")):08x} {body}\n'); self._f.flush()
+        if self.fsync: os.fsync(self._f.fileno())
+        self.wal_records+=1
+
+    def append_add(self, job: Dict[str, Any])->None:
+        self._append({'op': 'add', 'job': job})
+
+    def append_remove(self, job_id: str)->None:
+        self._append({'op': 'rm', 'id': job_id})
+
+    def append_fired(self, job_id: str, at: str)->None:
+        self._append({'op': 'fired', 'id': job_id, 'at': at})
+
+    def needs_compaction(self, live_jobs: int=0)->bool:
+        # scale with the job count so compaction stays amortised O(1) per mutation
+        return self.wal_records>=max(self.compact_every, live_jobs)
+
+    def write_snapshot(self, jobs: Iterable[Dict[str, Any]])->None:
+        """Atomically replace the snapshot, then drop the rotated log it covers. Thread-safe."""
+        self.snapshot.parent.mkdir(parents=True, exist_ok=True)
+        tmp=self.snapshot.with_suffix('.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': SNAPSHOT_VERSION, 'jobs': list(jobs)}, f, separators=(',', ':'))
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot)
+        _fsync_dir(self.snapshot.parent)
+        self.prev.unlink(missing_ok=True)
+
+    def rotate(self)->None:
+        """Start a fresh log; records so far move to (or are appended to) the previous one."""
+        if self._f is not None: self._f.close(); self._f=None
+        if self.wal.exists():
+            if self.prev.exists():   # an earlier background compaction failed or was interrupted
+                with open(self.prev, 'ab') as dst, open(self.wal, 'rb') as src:
+                    shutil.copyfileobj(src, dst); dst.flush()
+                    if self.fsync: os.fsync(dst.fileno())
+                self.wal.unlink()
+            else:
+                os.replace(self.wal, self.prev)
+        self.wal_records=0
+
+    def compact(self, jobs: Iterable[Dict[str, Any]])->None:
+        self.write_snapshot(jobs)
+        # the snapshot already contains every logged change, so replaying a
+        # log that survived a crash right here is harmless
+        if self._f is not None: self._f.close(); self._f=None
+        with open(self.wal, 'w', encoding='utf-8'): pass
+        self.wal_records=0
+
+    def close(self)->None:
+        if self._f is not None: self._f.close(); self._f=None
@@ -1,11 +1,17 @@
 from __future__ import annotations
-import asyncio, json, logging
+import asyncio, heapq, itertools, logging, time
 from dataclasses import dataclass, asdict
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone, tzinfo
 from pathlib import Path
-from typing import Callable, Awaitable, Optional, List
+from typing import Callable, Awaitable, Optional, List, Dict, Tuple
+from core.metrics import MetricsRegistry, default_registry
+from core.schedule_store import ScheduleStore
 logger = logging.getLogger("core.scheduler")
 DAYS=['Mon','Tue','Wed','Thu','Fri','Sat','Sun']
+ALL_DAYS_MASK=(1<<len(DAYS))-1
+MAX_SLEEP_S=30.0   # resync with the wall clock at least this often so steps and suspends are noticed
+JUMP_TOLERANCE_S=2.0
+MISFIRE_POLICIES=('skip','once','catchup')
 
 @dataclass
 class Job:
@@ -14,70 +20,323 @@ class Job:
     at: Optional[str]=None
     time_local: Optional[str]=None
     days: Optional[List[str]]=None
+    misfire: Optional[str]=None         # skip | once | catchup; None uses the scheduler default
+    catchup_limit: Optional[int]=None
+    portions: Optional[int]=None
+    created: Optional[str]=None
+    last_fired: Optional[str]=None      # slot time (UTC) of the most recent fire
+
+def day_mask(days: Optional[List[str]])->int:
+    """Weekday bitmask, bit 0 = Monday (``datetime.weekday()``). ``None``/empty means every day."""
+    if not days: return ALL_DAYS_MASK
+    mask=0
+    for d in days:
+        mask|=1<<DAYS.index(d)
+    return mask
+
+def _iso(ts: float)->str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec='seconds')
+
+def _ts(iso: Optional[str])->Optional[float]:
+    if not iso: return None
+    try: return datetime.fromisoformat(iso.replace('Z','+00:00')).timestamp()
+    except ValueError: return None
+
+def _boottime()->float:
+    # unlike CLOCK_MONOTONIC this keeps counting while the system is suspended
+    clk=getattr(time, 'CLOCK_BOOTTIME', None)
+    return time.clock_gettime(clk) if clk is not None else time.monotonic()
+
+def _local_slot(d: date, hh: int, mm: int, tz: Optional[tzinfo])->float:
+    # fold=0: a time skipped by a DST jump lands the same distance past the jump
+    # (02:30 -> 03:30), a repeated one resolves to its first occurrence
+    return datetime(d.year, d.month, d.day, hh, mm, tzinfo=tz).timestamp()
 
 class Scheduler:
-    def __init__(self, storage_path: str, on_fire: Callable[[Job], Awaitable[None]]):
+    """
+    Jobs are indexed in a heap of ``(next_fire, seq, job_id)``, fire times as
+    epoch seconds. Add/remove/fire only touch the affected job (removal is
+    lazy: stale heap entries are skipped when they surface and the heap is
+    rebuilt once they outnumber live ones). ``add_job`` wakes the run loop so
+    an earlier job preempts the current sleep. Mutations are appended to a
+    write-ahead log (see ``ScheduleStore``) and folded into the snapshot once
+    the log outgrows ``compact_every`` records (or the job count, whichever is
+    larger); with a running loop the snapshot is written on a worker thread,
+    so a mutation never waits for it.
+
+    Timing runs on the monotonic clock, re-anchored to the wall clock every
+    ``resync_s``; steps of the wall clock (NTP) and suspends are detected at
+    resync and logged. Daily ``time_local`` slots are resolved in ``tz`` (the
+    system zone by default) per date, so DST changes neither shift nor repeat
+    them. Every fire persists the slot as ``last_fired``; slots already
+    fired are never fired again, and slots missed (process down, clock
+    stepped, loop busy) by more than ``misfire_grace_s`` follow the job's
+    misfire policy: ``skip`` them, fire ``once`` for the lot, or ``catchup``
+    each of the latest ``catchup_limit``. Slots older than
+    ``misfire_max_age_s`` are always skipped.
+    """
+    def __init__(self, storage_path: str, on_fire: Callable[[Job, float], Awaitable[None]],
+                 compact_every: int=500, fsync: bool=True, metrics: MetricsRegistry | None=None,
+                 tz: str | tzinfo | None=None, misfire: str='once', misfire_grace_s: float=60.0,
+                 catchup_limit: int=3, misfire_max_age_s: float=86400.0, resync_s: float=MAX_SLEEP_S):
         self.storage=Path(storage_path); self.on_fire=on_fire
-        self.jobs:list[Job]=[]; self._stop=asyncio.Event()
+        self.store=ScheduleStore(self.storage, compact_every=compact_every, fsync=fsync)
+        if isinstance(tz, str):
+            from zoneinfo import ZoneInfo
+            tz=ZoneInfo(tz)
+        self.tz: Optional[tzinfo]=tz
+        if misfire not in MISFIRE_POLICIES: raise ValueError(f'unknown misfire policy {misfire!r}')
+        self.misfire=misfire; self.catchup_limit=max(1, int(catchup_limit))
+        self.misfire_grace=max(0.0, float(misfire_grace_s)); self.max_age=float(misfire_max_age_s)
+        self.resync_s=max(0.1, float(resync_s))
+        self._jobs:Dict[str,Job]={}
+        self._heap:List[Tuple[float,int,str]]=[]
+        self._live:Dict[str,int]={}   # job id -> seq of its current heap entry
+        self._daily:Dict[str,Tuple[int,int,int]]={}   # job id -> (hh, mm, weekday mask)
+        self._seq=itertools.count()
+        self._stop=asyncio.Event(); self._wake=asyncio.Event()
+        self._compacting: Optional[asyncio.Future]=None
+        m=metrics or default_registry()
+        self._m_lateness=m.histogram('scheduler_fire_lateness_seconds','Delay between a job\'s slot and its firing',
+                                     buckets=(0.01,0.05,0.1,0.25,0.5,1.0,2.5,5.0,15.0,60.0))
+        fires=m.counter('scheduler_fires_total','Jobs fired',('type',))
+        self._m_fires={t: fires.labels(t) for t in ('once','daily')}
+        missed=m.counter('scheduler_missed_slots_total','Slots missed by more than the grace period',('action',))
+        self._m_missed={a: missed.labels(a) for a in ('fired','skipped')}
+        self._m_jumps=m.counter('scheduler_clock_jumps_total','Wall-clock steps seen at resync')
+        m.gauge('scheduler_jobs','Scheduled jobs').set_function(lambda: len(self._jobs))
+        self._offset=time.time()-time.monotonic(); self._suspend=_boottime()-time.monotonic()
+        self._synced=time.monotonic()
+
+    @property
+    def jobs(self)->List[Job]:
+        return list(self._jobs.values())
+
+    # ---- clock ----
+    def _now(self)->float:
+        """Wall-clock time as of the last resync, advanced by the monotonic clock."""
+        return time.monotonic()+self._offset
+
+    def _resync(self)->None:
+        mono=time.monotonic(); offset=time.time()-mono; suspend=_boottime()-mono
+        slept=suspend-self._suspend; step=offset-self._offset-slept
+        if slept>JUMP_TOLERANCE_S:
+            logger.info('Scheduler: system was suspended for %.0fs', slept)
+        if abs(step)>JUMP_TOLERANCE_S:
+            logger.warning('Scheduler: wall clock stepped %+.1fs', step); self._m_jumps.inc()
+        self._offset=offset; self._suspend=suspend; self._synced=mono
 
     def load(self)->None:
-        if self.storage.exists():
-            self.jobs=[Job(**j) for j in json.loads(self.storage.read_text('utf-8'))]
-        else:
-            self.jobs=[]
-        logger.info('Scheduler: loaded %d job(s)', len(self.jobs))
+        jobs=[Job(**j) for j in self.store.load().values()]
+        self._jobs={}; self._heap=[]; self._live={}; self._daily={}
+        self._resync(); now=self._now(); expired=[]
+        for j in jobs:
+            self._jobs[j.id]=j; self._index(j, self._resume_after(j, now), push=False)
+            if j.type=='once' and j.id not in self._live: expired.append(j.id)
+        heapq.heapify(self._heap)
+        for jid in expired:
+            logger.info('Scheduler: dropping expired one-shot job %s', jid); self.remove_job(jid)
+        self._wake.set()
+        logger.info('Scheduler: loaded %d job(s)', len(self._jobs))
+
+    def _resume_after(self, job: Job, now: float)->float:
+        # resume from the last fired slot (or creation) so slots missed while
+        # down are indexed and handed to the misfire policy; a job with no
+        # history (written before either was recorded) resumes from now
+        anchor=_ts(job.last_fired) or _ts(job.created)
+        if anchor is None: return now if job.type=='daily' else now-self.max_age
+        return max(anchor, now-self.max_age)
 
     def save(self)->None:
-        self.storage.parent.mkdir(parents=True, exist_ok=True)
-        self.storage.write_text(json.dumps([asdict(j) for j in self.jobs], indent=2), 'utf-8')
+        """Write a full snapshot and truncate the log (blocking; await ``compacted()`` first)."""
+        self.store.compact(asdict(j) for j in self._jobs.values())
+
+    def _maybe_compact(self)->None:
+        if self._compacting is not None or not self.store.needs_compaction(len(self._jobs)): return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.save(); return
+        # cut the log here; the thread serialises the jobs as of this point
+        # (a later last_fired may slip in, which replaying the new log repeats)
+        self.store.rotate(); jobs=list(self._jobs.values())
+        self._compacting=asyncio.ensure_future(asyncio.to_thread(self.store.write_snapshot, (asdict(j) for j in jobs)))
+        self._compacting.add_done_callback(self._compacted)
+
+    def _compacted(self, fut: asyncio.Future)->None:
+        self._compacting=None
+        if not fut.cancelled() and fut.exception() is not None:
+            logger.error('Scheduler: snapshot compaction failed (log kept): %s', fut.exception())
+
+    async def compacted(self)->None:
+        """Wait for a background compaction in progress."""
+        if self._compacting is not None: await asyncio.shield(self._compacting)
 
     def add_job(self, job: Job)->Job:
-        self.jobs.append(job); self.save(); return job
+        if job.misfire is not None and job.misfire not in MISFIRE_POLICIES:
+            raise ValueError(f'unknown misfire policy {job.misfire!r}')
+        now=self._now()
+        if job.created is None: job.created=_iso(now)
+        self._jobs[job.id]=job
+        self._index(job, max(now, _ts(job.last_fired) or now))
+        self.store.append_add(asdict(job)); self._maybe_compact(); return job
 
     def remove_job(self, job_id: str)->bool:
-        n0=len(self.jobs); self.jobs=[j for j in self.jobs if j.id!=job_id]; self.save(); return len(self.jobs)<n0
+        if self._unindex(job_id) is None: return False
+        self.store.append_remove(job_id); self._maybe_compact(); return True
+
+    def next_fire(self)->Optional[datetime]:
+        """Earliest pending fire time (in ``tz``; naive local time by default), or None when nothing is scheduled."""
+        t=self._head()
+        return None if t is None else datetime.fromtimestamp(t, self.tz)
+
+    def _head(self)->Optional[float]:
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    # ---- index maintenance ----
+    def _index(self, job: Job, after: float, push: bool=True)->None:
+        if job.type=='daily':
+            try:
+                hh,mm=[int(x) for x in job.time_local.split(':')]  # type: ignore
+                self._daily[job.id]=(hh, mm, day_mask(job.days))
+            except Exception:
+                self._daily.pop(job.id, None)
+        nxt=self._next_indexed(job, after)
+        if nxt is None:
+            self._live.pop(job.id, None); return
+        seq=next(self._seq); self._live[job.id]=seq
+        if not push:
+            self._heap.append((nxt, seq, job.id)); return
+        if not self._heap or nxt<self._heap[0][0]: self._wake.set()
+        heapq.heappush(self._heap, (nxt, seq, job.id))
+
+    def _unindex(self, job_id: str)->Optional[Job]:
+        job=self._jobs.pop(job_id, None)
+        if job is None: return None
+        self._live.pop(job_id, None); self._daily.pop(job_id, None)
+        if len(self._heap)>64 and len(self._heap)>2*len(self._live):
+            self._heap=[e for e in self._heap if self._live.get(e[2])==e[1]]
+            heapq.heapify(self._heap)
+        return job
+
+    def _discard_stale(self)->None:
+        h=self._heap
+        while h and self._live.get(h[0][2])!=h[0][1]:
+            heapq.heappop(h)
+
+    def _next_indexed(self, job: Job, after: float)->Optional[float]:
+        if job.type=='daily':
+            c=self._daily.get(job.id)
+            return None if c is None else self._next_for_mask(c[0], c[1], c[2], after, self.tz)
+        return self._next_run(job, after, self.tz)
 
     @staticmethod
-    def _next_for_daily(job: Job, now: datetime)->datetime:
+    def _next_for_mask(hh: int, mm: int, mask: int, after: float, tz: Optional[tzinfo]=None)->Optional[float]:
+        if not mask: return None
+        d=datetime.fromtimestamp(after, tz).date()
+        for i in range(8):   # today's slot may already be past; the next 7 days cover every weekday
+            day=d+timedelta(days=i)
+            if mask>>day.weekday() & 1:
+                t=_local_slot(day, hh, mm, tz)
+                if t>after: return t
+        return None
+
+    @staticmethod
+    def _next_for_daily(job: Job, after: float, tz: Optional[tzinfo]=None)->float:
         hh,mm=[int(x) for x in job.time_local.split(':')]  # type: ignore
-        candidate=now.replace(hour=hh, minute=mm, second=0, microsecond=0)
-        days=job.days or DAYS
-        while candidate<now or DAYS[candidate.weekday()] not in days:
-            candidate += timedelta(days=1)
-            candidate=candidate.replace(hour=hh, minute=mm, second=0, microsecond=0)
-        return candidate
+        nxt=Scheduler._next_for_mask(hh, mm, day_mask(job.days), after, tz)
+        if nxt is None: raise ValueError(f'daily job {job.id} has no valid days')
+        return nxt
 
     @staticmethod
-    def _next_run(job: Job, now: datetime)->Optional[datetime]:
+    def _next_run(job: Job, after: float, tz: Optional[tzinfo]=None)->Optional[float]:
+        """Next slot of ``job`` strictly after ``after`` (epoch seconds), or None."""
         if job.type=='once':
             if not job.at: return None
             try:
-                t=datetime.fromisoformat(job.at.replace('Z','+00:00')).astimezone(tz=None).replace(tzinfo=None)
+                t=datetime.fromisoformat(job.at.replace('Z','+00:00'))
+                if t.tzinfo is None: t=t.replace(tzinfo=tz)
+                ts=t.timestamp()
             except Exception:
                 return None
-            return t if t>now else None
+            return ts if ts>after else None
         elif job.type=='daily':
-            try: return Scheduler._next_for_daily(job, now)
+            try: return Scheduler._next_for_daily(job, after, tz)
             except Exception: return None
         return None
 
+    def _pop_due(self, now: float)->List[Tuple[float,Job]]:
+        due=[]
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0]>now: break
+            when,_,jid=heapq.heappop(self._heap)
+            self._live.pop(jid, None)
+            due.append((when, self._jobs[jid]))
+        return due
+
+    def _slots_to_fire(self, job: Job, when: float, now: float)->Tuple[List[float], float]:
+        """Slots to fire among those due from ``when`` up to ``now``, and the last slot consumed."""
+        due=[when]
+        if job.type=='daily' and now-when>self.misfire_grace:
+            c=self._daily.get(job.id)
+            while c is not None and len(due)<1000:
+                nxt=self._next_for_mask(c[0], c[1], c[2], due[-1], self.tz)
+                if nxt is None or nxt>now: break
+                due.append(nxt)
+        last=due[-1]
+        on_time=[due.pop()] if now-last<=self.misfire_grace else []
+        if not due: return on_time, last
+        policy=job.misfire or self.misfire
+        recent=[t for t in due if now-t<=self.max_age]
+        if policy=='catchup': fire=recent[-(job.catchup_limit or self.catchup_limit):]
+        elif policy=='once' and not on_time: fire=recent[-1:]   # an on-time slot covers the missed ones
+        else: fire=[]
+        skipped=len(due)-len(fire)
+        self._m_missed['fired'].inc(len(fire)); self._m_missed['skipped'].inc(skipped)
+        logger.warning('Scheduler: job %s missed %d slot(s) since %s (policy %s): firing %d, skipping %d',
+                       job.id, len(due), _iso(due[0]), policy, len(fire), skipped)
+        return fire+on_time, last
+
+    # ---- loop ----
     async def run(self)->None:
         self._stop.clear()
         while not self._stop.is_set():
-            now=datetime.now(); nexts=[]
-            for j in list(self.jobs):
-                nxt=self._next_run(j, now)
-                if nxt is not None: nexts.append((j,nxt))
-            if not nexts:
-                await asyncio.sleep(1.0); continue
-            job,when=min(nexts, key=lambda p:p[1])
-            delay=max(0.0,(when-datetime.now()).total_seconds())
-            try:
-                await asyncio.wait_for(self._stop.wait(), timeout=delay); break
-            except asyncio.TimeoutError:
-                pass
-            await self.on_fire(job)
-            if job.type=='once': self.remove_job(job.id)
+            self._wake.clear()
+            if time.monotonic()-self._synced>=self.resync_s: self._resync()
+            head=self._head(); now=self._now()
+            if head is None or head>now:
+                # the wait runs on the loop's monotonic clock; cap it at the next resync
+                left=self.resync_s-(time.monotonic()-self._synced)
+                delay=left if head is None else min(left, head-now)
+                try: await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, delay))
+                except asyncio.TimeoutError: pass
+                continue
+            for when,job in self._pop_due(now):
+                await self._fire(job, when, now)
+
+    async def _fire(self, job: Job, when: float, now: float)->None:
+        fire, last=self._slots_to_fire(job, when, now)
+        fired=self._m_fires.get(job.type)
+        for slot in fire:
+            if job.id not in self._jobs: return   # removed from inside on_fire
+            # record the slot before firing: a crash mid-dispense must not feed twice on restart
+            job.last_fired=_iso(slot); self.store.append_fired(job.id, job.last_fired); self._maybe_compact()
+            lateness=max(0.0, self._now()-slot)
+            self._m_lateness.observe(lateness)
+            if fired is not None: fired.inc()
+            await self.on_fire(job, lateness)
+        if job.id not in self._jobs: return
+        if job.type=='once':
+            self.remove_job(job.id)
+        else:
+            # step past the consumed slots so a fast handler can't refire them
+            self._index(job, last)
 
     async def stop(self)->None:
-        self._stop.set()
+        self._stop.set(); self._wake.set()
+        try: await self.compacted()
+        except Exception: pass   # logged by _compacted; the save below covers it
+        if self.store.wal_records or self.store.prev.exists(): self.save()
+        self.store.close()
@@ -2,7 +2,7 @@ from __future__ import annotations
 import os, re
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List
 try:
     import tomllib  # py3.11+
 except ModuleNotFoundError:
@@ -56,3 +56,37 @@ def load_settings(base_dir: Path | None = None) -> Settings:
         pins=resolved.get("pins", {}),
         base_dir=root,
     )
+
+SECTIONS = ("device", "pubnub", "camera", "thresholds", "pins")
+
+def _merge(base: Dict[str, Any], over: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(base)
+    for k, v in over.items():
+        out[k] = _merge(out[k], v) if isinstance(v, dict) and isinstance(out.get(k), dict) else v
+    return out
+
+def device_settings(settings: Settings) -> List[Settings]:
+    """
+    One Settings per ``[[devices]]`` entry (gateway mode), or ``[settings]``.
+
+    Each entry needs an ``id``. Table-valued keys (``pins``, ``thresholds``,
+    ``sensors``, ...) are merged over the top-level sections of the same name;
+    scalar keys go into that device's ``[device]`` section.
+    """
+    entries = settings.raw.get("devices")
+    if not entries: return [settings]
+    out: List[Settings] = []
+    seen = set()
+    for entry in entries:
+        entry = dict(entry)
+        dev_id = str(entry.pop("id", "") or "")
+        if not dev_id: raise RuntimeError("every [[devices]] entry needs an id")
+        if dev_id in seen: raise RuntimeError(f"duplicate device id in [[devices]]: {dev_id}")
+        seen.add(dev_id)
+        tables = {k: v for k, v in entry.items() if isinstance(v, dict)}
+        scalars = {k: v for k, v in entry.items() if not isinstance(v, dict)}
+        raw = _merge({k: v for k, v in settings.raw.items() if k != "devices"}, tables)
+        raw["device"] = {**raw.get("device", {}), **scalars, "id": dev_id}
+        out.append(Settings(raw=raw, base_dir=settings.base_dir,
+                            **{k: raw.get(k, {}) for k in SECTIONS}))
+    return out
@@ -0,0 +1,52 @@
+from __future__ import annotations
+import logging, time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from core.metrics import MetricsRegistry, default_registry
+logger = logging.getLogger("core.startup")
+
+T = TypeVar("T")
+
+class StartupTimer:
+    """
+    Wall-clock breakdown of process startup.
+
+    Sequential phases use ``with timer.phase(name)``; work running alongside
+    other phases (the bus connecting while hardware comes up) uses
+    ``await timer.track(name, coro)``. Each phase is recorded with its start
+    offset so overlapping phases are visible in the report.
+    """
+    def __init__(self, t0: Optional[float] = None, metrics: MetricsRegistry | None = None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.phases: List[Tuple[str, float, float]] = []   # name, start offset, duration
+        self.details: Dict[str, Any] = {}
+        self._m = (metrics or default_registry()).gauge("startup_phase_seconds", "Duration of each startup phase", ("phase",))
+
+    def record(self, name: str, start: float) -> None:
+        """Close a phase that began at ``start`` (a ``perf_counter`` value)."""
+        d = time.perf_counter() - start
+        self.phases.append((name, start - self.t0, d)); self._m.labels(name).set(d)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try: yield
+        finally: self.record(name, start)
+
+    async def track(self, name: str, aw: Awaitable[T]) -> T:
+        start = time.perf_counter()
+        try: return await aw
+        finally: self.record(name, start)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def report(self, log: Optional[logging.Logger] = None) -> Dict[str, Any]:
+        """Log one line per phase and return ``{total_s, phases: {name: {start_s, duration_s}}, ...}``."""
+        log = log or logger
+        total = self.total()
+        lines = [f"  {name:<24} +{start:6.3f}s  {dur:6.3f}s" for name, start, dur in self.phases]
+        log.info("Startup finished in %.3fs:\n%s", total, "\n".join(lines))
+        return {"total_s": round(total, 3),
+                "phases": {n: {"start_s": round(s, 3), "duration_s": round(d, 3)} for n, s, d in self.phases},
+                **self.details}
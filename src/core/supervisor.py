@@ -0,0 +1,162 @@
+from __future__ import annotations
+import asyncio, logging, sys, threading, time, traceback
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from core.metrics import MetricsRegistry, default_registry
+from utils.time import now_iso
+logger = logging.getLogger("core.supervisor")
+
+@dataclass
+class Stall:
+    """One event-loop stall: when it started, how long it lasted and what was running."""
+    started: str
+    duration_s: float
+    task: Optional[str]
+    stack: List[str] = field(default_factory=list)
+
+class LoopMonitor:
+    """
+    Measures event-loop lag and catches long stalls in the act.
+
+    A ticker task sleeps ``interval_s`` and records how late it woke up
+    (``event_loop_lag_seconds``). A watchdog thread watches the ticker's
+    heartbeat; when the loop has not ticked for ``stall_threshold_s`` it
+    grabs the loop thread's Python stack and the current task while the
+    blocking call is still on it, so the culprit is logged, not just the lag.
+    """
+    def __init__(self, interval_s: float = 0.1, stall_threshold_s: float = 0.25,
+                 metrics: MetricsRegistry | None = None, keep: int = 20):
+        self.interval = max(0.01, float(interval_s))
+        self.threshold = max(self.interval, float(stall_threshold_s))
+        self.stalls: Deque[Stall] = deque(maxlen=keep)
+        self.max_lag = 0.0
+        m = metrics or default_registry()
+        self._m_lag = m.histogram("event_loop_lag_seconds", "Ticker wake-up delay",
+                                  buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+        self._m_stalls = m.counter("event_loop_stalls_total", "Loop blocked longer than the stall threshold")
+        m.gauge("event_loop_lag_max_seconds", "Worst lag seen since start").set_function(lambda: self.max_lag)
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop(); self._thread_id = threading.get_ident()
+        self._beat = time.monotonic(); self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        try:
+            while True:
+                t0 = time.monotonic()
+                await asyncio.sleep(self.interval)
+                now = time.monotonic(); self._beat = now
+                lag = max(0.0, now - t0 - self.interval)
+                self._m_lag.observe(lag)
+                if lag > self.max_lag: self.max_lag = lag
+        finally:
+            self._stop.set()
+
+    def _watch(self) -> None:
+        caught: Optional[Stall] = None; caught_beat = 0.0
+        while not self._stop.wait(self.interval / 2):
+            beat = self._beat; blocked = time.monotonic() - beat
+            if caught is not None and beat != caught_beat:
+                caught.duration_s = round(beat - caught_beat - self.interval, 3)
+                logger.warning("Event loop was blocked %.3fs (task %s)", caught.duration_s, caught.task)
+                caught = None
+            if caught is None and blocked >= self.threshold:
+                caught, caught_beat = self._capture(beat), beat
+                self.stalls.append(caught); self._m_stalls.inc()
+                logger.warning("Event loop blocked for %.3fs in task %s:\n%s", blocked, caught.task,
+                               "".join(caught.stack[-6:]).rstrip())
+
+    def _capture(self, beat: float) -> Stall:
+        frame = sys._current_frames().get(self._thread_id or 0)
+        stack = traceback.format_stack(frame, limit=12) if frame is not None else []
+        task = asyncio.current_task(self._loop) if self._loop is not None else None
+        started = time.time() - (time.monotonic() - beat)
+        return Stall(started=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+                     duration_s=round(time.monotonic() - beat, 3),
+                     task=task.get_name() if task is not None else None, stack=stack)
+
+class Supervisor:
+    """
+    Runs long-lived service coroutines and keeps them running.
+
+    Each service is registered with a factory returning a fresh coroutine.
+    If a service raises, the error is logged, a ``SERVICE_DEGRADED`` event is
+    published and the service is restarted after an exponential backoff
+    (``restart_min_s`` .. ``restart_max_s``, reset once it has stayed up for
+    ``healthy_s``). A service that returns normally is considered finished.
+    ``shutdown`` cancels everything and waits up to ``shutdown_timeout_s``.
+    """
+    def __init__(self, bus: Any, device_id: str, restart_min_s: float = 1.0, restart_max_s: float = 60.0,
+                 healthy_s: float = 60.0, shutdown_timeout_s: float = 10.0,
+                 metrics: MetricsRegistry | None = None):
+        self.bus = bus; self.device_id = device_id
+        self.restart_min = float(restart_min_s); self.restart_max = float(restart_max_s)
+        self.healthy = float(healthy_s); self.shutdown_timeout = float(shutdown_timeout_s)
+        self._factories: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.restarts: Dict[str, int] = {}
+        self.last_error: Dict[str, str] = {}
+        m = metrics or default_registry()
+        self._m_restarts = m.counter("service_restarts_total", "Service restarts after a crash", ("service",))
+        self._m_up = m.gauge("service_up", "1 while the service is running", ("service",))
+
+    def add(self, name: str, factory: Callable[[], Awaitable[Any]]) -> None:
+        self._factories[name] = factory
+
+    def start(self) -> None:
+        for name, factory in self._factories.items():
+            if name not in self._tasks or self._tasks[name].done():
+                self._tasks[name] = asyncio.create_task(self._supervise(name, factory), name=name)
+
+    def status(self) -> Dict[str, Any]:
+        return {name: {"running": not t.done(), "restarts": self.restarts.get(name, 0),
+                       "last_error": self.last_error.get(name)} for name, t in self._tasks.items()}
+
+    async def _supervise(self, name: str, factory: Callable[[], Awaitable[Any]]) -> None:
+        up = self._m_up.labels(name); restarts = self._m_restarts.labels(name)
+        delay = self.restart_min
+        while True:
+            started = time.monotonic(); up.set(1)
+            try:
+                await factory()
+                logger.info("Service %s finished", name)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if time.monotonic() - started >= self.healthy: delay = self.restart_min
+                n = self.restarts[name] = self.restarts.get(name, 0) + 1
+                self.last_error[name] = f"{type(e).__name__}: {e}"
+                logger.exception("Service %s crashed (restart #%d in %.1fs)", name, n, delay)
+                restarts.inc()
+                await self._degraded(name, e, n, delay)
+            finally:
+                up.set(0)
+            await asyncio.sleep(delay); delay = min(delay * 2, self.restart_max)
+
+    async def _degraded(self, name: str, error: BaseException, restarts: int, retry_in: float) -> None:
+        try:
+            await asyncio.wait_for(self.bus.publish({
+                "type": "event", "level": "error", "code": "SERVICE_DEGRADED", "ts": now_iso(),
+                "device_id": self.device_id, "service": name, "error": f"{type(error).__name__}: {error}",
+                "restarts": restarts, "retry_in_s": round(retry_in, 1)}), timeout=5.0)
+        except Exception:
+            logger.exception("Could not publish SERVICE_DEGRADED for %s", name)
+
+    async def shutdown(self, timeout: Optional[float] = None) -> None:
+        """Cancel every service and wait for them to unwind, at most ``timeout`` seconds."""
+        tasks = [t for t in self._tasks.values() if not t.done()]
+        for t in tasks: t.cancel()
+        if not tasks: return
+        done, pending = await asyncio.wait(tasks, timeout=self.shutdown_timeout if timeout is None else timeout)
+        for t in pending:
+            logger.warning("Service %s did not stop within the shutdown deadline", t.get_name())
+        for t in done:
+            if not t.cancelled() and t.exception() is not None:
+                logger.error("Service %s ended with %r", t.get_name(), t.exception())
@@ -0,0 +1,172 @@
+from __future__ import annotations
+import asyncio, importlib.util, json, logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple, Union
+logger = logging.getLogger("core.transport")
+
+_pubnub: Optional[Tuple[Any, Any, Any]] = None
+
+def _load_pubnub() -> Tuple[Any, Any, Any]:
+    """Import the PubNub SDK on first use (it is slow to import on a Pi)."""
+    global _pubnub
+    if _pubnub is None:
+        from pubnub.callbacks import SubscribeCallback  # type: ignore
+        from pubnub.pnconfiguration import PNConfiguration
+        from pubnub.pubnub_asyncio import PubNubAsyncio  # type: ignore
+        _pubnub = (PNConfiguration, PubNubAsyncio, SubscribeCallback)
+    return _pubnub
+
+def pubnub_available() -> bool:
+    return importlib.util.find_spec("pubnub") is not None
+
+class TransportError(RuntimeError):
+    """Raised by ``publish`` when a message could not be delivered."""
+
+Channels = Union[str, Sequence[str]]
+
+def _as_list(channels: Channels) -> List[str]:
+    return [channels] if isinstance(channels, str) else list(channels)
+
+class _Inbox:
+    """
+    Bounded queue of ``(channel, message)`` shared by the transports. Readers
+    drain everything that arrived since their last wake-up in one call; when
+    full, the oldest message is dropped.
+    """
+    def __init__(self, maxsize: int = 1000):
+        self._q: Deque[Tuple[str, Any]] = deque(); self.maxsize = maxsize
+        self._ready = asyncio.Event(); self.dropped = 0
+
+    def put(self, channel: str, message: Any) -> None:
+        if len(self._q) >= self.maxsize:
+            self._q.popleft(); self.dropped += 1
+        self._q.append((channel, message)); self._ready.set()
+
+    async def get_many(self, max_n: int) -> List[Tuple[str, Any]]:
+        while not self._q:
+            self._ready.clear(); await self._ready.wait()
+        n = min(max_n, len(self._q))
+        return [self._q.popleft() for _ in range(n)]
+
+class PubNubTransport:
+    """
+    PubNub SDK adapter. The SDK is imported and the client created in
+    ``start`` (on a worker thread), so constructing the Bus costs nothing and
+    connecting can overlap hardware initialisation; publishes issued before
+    the client exists wait up to ``connect_timeout_s`` for it.
+
+    ``filter_expression`` is applied server-side to the ``meta`` of incoming
+    messages, so traffic the device does not need (e.g. other devices'
+    telemetry, tagged ``source = 'device'`` by the Bus) is never delivered.
+    Incoming messages are pushed from the SDK callback into an inbox that
+    ``next_messages`` drains in batches.
+    """
+    def __init__(self, publish_key: str, subscribe_key: str, uuid: str, connect_timeout_s: float = 10.0,
+                 filter_expression: Optional[str] = None, inbox_size: int = 1000):
+        self._keys = (publish_key, subscribe_key, uuid)
+        self.filter_expression = filter_expression
+        self._pn: Any = None; self._inbox = _Inbox(inbox_size)
+        self._ready = asyncio.Event(); self.connect_timeout = connect_timeout_s
+
+    def _client(self) -> Any:
+        PNConfiguration, PubNubAsyncio, _ = _load_pubnub()
+        cfg = PNConfiguration(); cfg.publish_key, cfg.subscribe_key, cfg.uuid = self._keys
+        if self.filter_expression: cfg.filter_expression = self.filter_expression
+        return PubNubAsyncio(cfg)
+
+    def _listener(self) -> Any:
+        inbox = self._inbox
+        class Listener(_load_pubnub()[2]):  # type: ignore[misc]
+            def status(self, pubnub: Any, status: Any) -> None: pass
+            def presence(self, pubnub: Any, presence: Any) -> None: pass
+            def message(self, pubnub: Any, message: Any) -> None:
+                inbox.put(message.channel, message.message)
+        return Listener()
+
+    async def start(self, channels: Channels) -> None:
+        if self._pn is None:
+            self._pn = await asyncio.to_thread(self._client)
+        self._pn.add_listener(self._listener())
+        self._pn.subscribe().channels(_as_list(channels)).execute()
+        self._ready.set()
+
+    async def stop(self) -> None:
+        if self._pn is None: return
+        self._pn.unsubscribe_all(); await asyncio.sleep(0.1)
+
+    async def publish(self, channel: str, message: Any, meta: Optional[Dict[str, Any]] = None) -> None:
+        if not self._ready.is_set():
+            try: await asyncio.wait_for(self._ready.wait(), self.connect_timeout)
+            except asyncio.TimeoutError: raise TransportError("PubNub not connected") from None
+        try:
+            req = self._pn.publish().channel(channel).message(message)
+            if meta: req = req.meta(meta)
+            env = await req.future()
+        except Exception as e:
+            raise TransportError(str(e)) from e
+        if env.status.is_error():
+            raise TransportError(f"PubNub publish error: {env.status.error_data}")
+
+    async def next_messages(self, max_n: int = 32) -> List[Tuple[str, Any]]:
+        return await self._inbox.get_many(max_n)
+
+    async def next_message(self, channel: str) -> Any:
+        return (await self.next_messages(1))[0][1]
+
+class LogTransport:
+    """Used when the PubNub SDK is missing: publishes are logged, nothing is received."""
+    async def start(self, channels: Channels) -> None: pass
+    async def stop(self) -> None: pass
+
+    async def publish(self, channel: str, message: Any, meta: Optional[Dict[str, Any]] = None) -> None:
+        # json.dumps of every payload is not free; skip it when nobody listens
+        if logger.isEnabledFor(logging.INFO): logger.info("[NO-OP publish] %s", json.dumps(message))
+
+    async def next_message(self, channel: str) -> Any:
+        await asyncio.sleep(1.0); return None
+
+    async def next_messages(self, max_n: int = 32) -> List[Tuple[str, Any]]:
+        await asyncio.sleep(1.0); return []
+
+class LocalTransport:
+    """
+    In-process fake for tests and benchmarks. ``online`` can be flipped to
+    simulate an outage; published messages (and their meta) are kept in
+    ``sent``/``sent_meta`` and messages handed to ``inject`` are returned by
+    ``next_message``/``next_messages``. Injected messages go to the first
+    subscribed channel unless one is given.
+    """
+    def __init__(self, online: bool = True, latency_s: float = 0.0, keep: bool = True):
+        self.online = online; self.latency = latency_s; self.keep = keep
+        self.sent: List[Any] = []; self.sent_meta: List[Optional[Dict[str, Any]]] = []; self.publish_calls = 0
+        self.channels: List[str] = []
+        self._inbox = _Inbox(maxsize=1 << 30)
+
+    def set_online(self, online: bool) -> None:
+        self.online = online
+
+    async def start(self, channels: Channels) -> None:
+        self.channels = _as_list(channels)
+    async def stop(self) -> None: pass
+
+    async def publish(self, channel: str, message: Any, meta: Optional[Dict[str, Any]] = None) -> None:
+        if self.latency: await asyncio.sleep(self.latency)
+        if not self.online:
+            raise TransportError("local transport offline")
+        self.publish_calls += 1
+        if self.keep: self.sent.append(message); self.sent_meta.append(meta)
+
+    def inject(self, message: Any, channel: Optional[str] = None) -> None:
+        self._inbox.put(channel or (self.channels[0] if self.channels else ""), message)
+
+    async def next_messages(self, max_n: int = 32) -> List[Tuple[str, Any]]:
+        return await self._inbox.get_many(max_n)
+
+    async def next_message(self, channel: str) -> Optional[Any]:
+        return (await self.next_messages(1))[0][1]
+
+def default_transport(publish_key: str, subscribe_key: str, uuid: str, filter_expression: Optional[str] = None):
+    if pubnub_available():
+        return PubNubTransport(publish_key, subscribe_key, uuid, filter_expression=filter_expression)
+    logger.warning("PubNub SDK unavailable; running without PubNub connection.")
+    return LogTransport()
@@ -0,0 +1,159 @@
+from __future__ import annotations
+import logging, mmap, re, struct, time
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+logger = logging.getLogger("core.tsdb")
+
+_RAW = struct.Struct("<qf")         # ts_ms, value
+_ROLL = struct.Struct("<qfffI")     # bucket ts_ms, mean, min, max, count
+_METRIC = re.compile(r"^[a-z0-9_]{1,64}$")
+DAY_MS = 86_400_000
+
+# resolution -> (bucket ms, record struct, segment span ms)
+RESOLUTIONS: Dict[str, Tuple[int, struct.Struct, int]] = {
+    "raw": (0, _RAW, DAY_MS),
+    "1m": (60_000, _ROLL, 7 * DAY_MS),
+    "1h": (3_600_000, _ROLL, 90 * DAY_MS),
+}
+DEFAULT_RETENTION_DAYS = {"raw": 2, "1m": 30, "1h": 365}
+
+class _Rollup:
+    __slots__ = ("bucket", "sum", "min", "max", "n")
+    def __init__(self, bucket: int, v: float):
+        self.bucket = bucket; self.sum = v; self.min = v; self.max = v; self.n = 1
+    def add(self, v: float) -> None:
+        self.sum += v; self.n += 1
+        if v < self.min: self.min = v
+        if v > self.max: self.max = v
+    def pack(self) -> bytes:
+        return _ROLL.pack(self.bucket, self.sum / self.n, self.min, self.max, self.n)
+
+class HistoryStore:
+    """
+    Local time-series store for sensor history.
+
+    Each metric keeps three series — ``raw`` samples, ``1m`` and ``1h``
+    rollups (mean/min/max/count) — as fixed-width little-endian records in
+    time-bucketed segment files under ``root/<metric>/<resolution>/``.
+    Rollups are folded incrementally as samples arrive, so only one open
+    bucket per metric and resolution is held in memory. Segments older than
+    the per-resolution retention are deleted when a new segment starts.
+    Queries memory-map only the segments overlapping the range, binary-search
+    the start and stream records into at most ``max_points`` buckets.
+    """
+    def __init__(self, root: str | Path, retention_days: Optional[Dict[str, float]] = None):
+        self.root = Path(root)
+        self.retention = {r: float(d) * DAY_MS for r, d in {**DEFAULT_RETENTION_DAYS, **(retention_days or {})}.items()}
+        self._files: Dict[Tuple[str, str], Tuple[int, BinaryIO]] = {}
+        self._open: Dict[Tuple[str, str], _Rollup] = {}
+
+    # ---- writing ----
+    def _dir(self, metric: str, res: str) -> Path:
+        return self.root / metric / res
+
+    def _writer(self, metric: str, res: str, ts: int) -> BinaryIO:
+        span = RESOLUTIONS[res][2]; seg = ts - ts % span
+        cur = self._files.get((metric, res))
+        if cur is not None and cur[0] == seg: return cur[1]
+        if cur is not None: cur[1].close()
+        d = self._dir(metric, res); d.mkdir(parents=True, exist_ok=True)
+        f = open(d / f"{seg}.ts", "ab")
+        size = RESOLUTIONS[res][1].size
+        if f.tell() % size:   # torn record from a crash: drop it
+            f.truncate(f.tell() - f.tell() % size); f.seek(0, 2)
+        self._files[(metric, res)] = (seg, f)
+        self._prune(metric, res, ts)
+        return f
+
+    def _prune(self, metric: str, res: str, now_ms: int) -> None:
+        cutoff = now_ms - self.retention.get(res, float("inf")); span = RESOLUTIONS[res][2]
+        for p in self._dir(metric, res).glob("*.ts"):
+            try: start = int(p.stem)
+            except ValueError: continue
+            if start + span < cutoff: p.unlink(missing_ok=True)
+
+    def record(self, metric: str, value: Optional[float], ts_ms: Optional[int] = None) -> None:
+        if value is None: return
+        if not _METRIC.match(metric): raise ValueError(f"invalid metric name: {metric!r}")
+        ts = int(time.time() * 1000) if ts_ms is None else int(ts_ms); v = float(value)
+        self._writer(metric, "raw", ts).write(_RAW.pack(ts, v))
+        for res in ("1m", "1h"):
+            step = RESOLUTIONS[res][0]; bucket = ts - ts % step
+            r = self._open.get((metric, res))
+            if r is not None and r.bucket == bucket:
+                r.add(v); continue
+            if r is not None:
+                self._writer(metric, res, r.bucket).write(r.pack())
+            self._open[(metric, res)] = _Rollup(bucket, v)
+
+    def record_many(self, values: Dict[str, Optional[float]], ts_ms: Optional[int] = None) -> None:
+        ts = int(time.time() * 1000) if ts_ms is None else ts_ms
+        for k, v in values.items(): self.record(k, v, ts)
+        self.flush()
+
+    def flush(self) -> None:
+        for _, f in self._files.values(): f.flush()
+
+    def close(self) -> None:
+        for (metric, res), r in list(self._open.items()):
+            self._writer(metric, res, r.bucket).write(r.pack())
+        self._open.clear()
+        for _, f in self._files.values(): f.close()
+        self._files.clear()
+
+    # ---- reading ----
+    def metrics(self) -> List[str]:
+        return sorted(p.name for p in self.root.iterdir() if p.is_dir()) if self.root.exists() else []
+
+    def _scan(self, metric: str, res: str, start: int, end: int) -> Iterator[Tuple[int, float, float, float, int]]:
+        rec = RESOLUTIONS[res][1]; span = RESOLUTIONS[res][2]
+        d = self._dir(metric, res)
+        if not d.exists(): return
+        cur = self._files.get((metric, res))
+        if cur is not None: cur[1].flush()
+        segs = sorted(int(p.stem) for p in d.glob("*.ts") if p.stem.isdigit())
+        for seg in segs:
+            if seg + span <= start or seg > end: continue
+            path = d / f"{seg}.ts"
+            n = path.stat().st_size // rec.size
+            if not n: continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                lo, hi = 0, n   # first record with ts >= start
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if struct.unpack_from("<q", mm, mid * rec.size)[0] < start: lo = mid + 1
+                    else: hi = mid
+                view = memoryview(mm)[lo * rec.size:n * rec.size]
+                try:
+                    for r in rec.iter_unpack(view):
+                        if r[0] > end: break
+                        yield (r[0], r[1], r[1], r[1], 1) if res == "raw" else r  # type: ignore[misc]
+                finally:
+                    view.release()
+
+    def _pick_resolution(self, start: int, end: int, max_points: int) -> str:
+        span = end - start
+        if span <= 2 * 3_600_000: return "raw"
+        if span / RESOLUTIONS["1m"][0] <= max_points * 8: return "1m"
+        return "1h"
+
+    def query(self, metric: str, start_ms: int, end_ms: int, max_points: int = 500,
+              resolution: str = "auto") -> Dict[str, Any]:
+        """Points ``[ts_ms, mean, min, max]`` in ``[start_ms, end_ms]``, at most ``max_points`` of them."""
+        if not _METRIC.match(metric): raise ValueError(f"invalid metric name: {metric!r}")
+        max_points = max(1, int(max_points))
+        res = self._pick_resolution(start_ms, end_ms, max_points) if resolution == "auto" else resolution
+        if res not in RESOLUTIONS: raise ValueError(f"unknown resolution: {res}")
+        width = max(1, -(-(end_ms - start_ms + 1) // max_points))
+        buckets: Dict[int, List[float]] = {}
+        for ts, mean, lo, hi, n in self._scan(metric, res, start_ms, end_ms):
+            k = (ts - start_ms) // width
+            b = buckets.get(k)
+            if b is None: buckets[k] = [mean * n, lo, hi, n]
+            else:
+                b[0] += mean * n; b[3] += n
+                if lo < b[1]: b[1] = lo
+                if hi > b[2]: b[2] = hi
+        points = [[start_ms + k * width, round(b[0] / b[3], 3), round(b[1], 3), round(b[2], 3)]
+                  for k, b in sorted(buckets.items())]
+        return {"metric": metric, "resolution": res, "bucket_ms": width, "points": points}
@@ -1,34 +1,69 @@
 from __future__ import annotations
+import time
+_T_IMPORT=time.perf_counter()
 import asyncio, logging, signal
 from core.log import setup_logging
-from core.settings import load_settings
+from core.settings import device_settings, load_settings
 from core.bus import Bus
 from core.scheduler import Scheduler
+from core.hw import HardwareExecutor, open_devices
+from core.metrics import MetricsServer, default_registry
+from core.startup import StartupTimer
+from core.poller import SensorPoller
+from core.supervisor import LoopMonitor, Supervisor
+from core.tsdb import HistoryStore
 from services.telemetry import TelemetryService
 from services.water_level_service import WaterLevelService
 from services.command_router import CommandRouter
 from services.camera_controller import CameraController
+from services.frame_relay import FrameRelay
+from services.stream_quality import StreamQualityController
+from services.gateway import CommandDemux
 from actuators.feeder import Feeder
+from utils.time import now_iso
 
 async def amain()->None:
+    timer=StartupTimer(t0=_T_IMPORT)
+    timer.record('imports', _T_IMPORT)
     setup_logging('INFO')
     log=logging.getLogger('main')
-    settings=load_settings()
+    with timer.phase('settings'):
+        settings=load_settings()
+        if settings.raw.get('logging'): setup_logging(cfg=settings.raw['logging'], base_dir=settings.base_dir)
     log.info('Loaded settings for device %s', settings.device.get('id'))
 
+    # commands on their own channel(s); "{device_id}" makes one per device
+    devices=device_settings(settings)
+    cmd_tpl=str(settings.pubnub.get('command_channel') or settings.pubnub.get('channel','smart-feeder-main'))
+    cmd_channels=list(dict.fromkeys(cmd_tpl.format(device_id=ds.device.get('id','pi-feeder-01')) for ds in devices))
     bus=Bus(publish_key=settings.pubnub['publish_key'],
             subscribe_key=settings.pubnub['subscribe_key'],
             uuid=settings.pubnub.get('uuid', settings.device.get('id','pi-feeder-01')),
-            channel=settings.pubnub.get('channel','smart-feeder-main'))
-    await bus.start()
+            channel=settings.pubnub.get('channel','smart-feeder-main'),
+            batch_window_ms=int(settings.pubnub.get('batch_window_ms',50)),
+            max_batch=int(settings.pubnub.get('max_batch',50)),
+            max_inflight=int(settings.pubnub.get('max_inflight',2)),
+            max_queue=int(settings.pubnub.get('max_queue',500)),
+            journal_dir=(settings.base_dir/'data/journal') if settings.pubnub.get('journal',True) else None,
+            journal_max_mb=float(settings.pubnub.get('journal_max_mb',32)),
+            encoding=str(settings.pubnub.get('encoding','json')),
+            command_channel=cmd_channels,
+            filter_expression=settings.pubnub.get('filter_expression'))
+    # connect while the hardware comes up; publishes queue until it is ready
+    bus_up=asyncio.create_task(timer.track('bus_connect', bus.start()), name='bus-connect')
 
-    telemetry=TelemetryService(settings,bus)
-    feeder=Feeder(pin=int(settings.pins.get('servo_feed',12)))
+    metrics_cfg=settings.raw.get('metrics',{})
+    metrics_http=(MetricsServer(default_registry(), host=str(metrics_cfg.get('http_host','127.0.0.1')),
+                                port=int(metrics_cfg.get('http_port',9108)))
+                  if metrics_cfg.get('http_enabled',False) else None)
+    if metrics_http is not None: await metrics_http.start()
+
+    hw=HardwareExecutor()
+    hist_cfg=settings.raw.get('history',{})
+    # one camera and frame relay per host, shared by every device in gateway mode
     camera=CameraController(settings)
-    sched_path=settings.base_dir/'data/schedules.json'
-    sched=Scheduler(storage_path=str(sched_path), on_fire=None)  # type: ignore
-    router=CommandRouter(settings,bus,sched,feeder,camera)
-    sched.on_fire=router._on_fire
+    relay=FrameRelay(settings) if settings.camera.get('relay_enabled',False) else None
+    if relay is not None: await timer.track('frame_relay', relay.start())
 
     stop=asyncio.Event()
     def _stop(*_): stop.set()
@@ -38,15 +73,77 @@ async def amain()->None:
         try: loop.add_signal_handler(sig,_stop)
         except NotImplementedError: pass
 
-    tasks=[
-        asyncio.create_task(telemetry.run(), name='telemetry'),
-        asyncio.create_task(WaterLevelService(settings,bus).run(), name='water_level'),
-        asyncio.create_task(sched.run(), name='scheduler'),
-        asyncio.create_task(router.run(), name='commands'),
-    ]
+    sup_cfg=settings.raw.get('supervisor',{})
+    monitor=LoopMonitor(interval_s=float(sup_cfg.get('lag_interval_ms',100))/1000.0,
+                        stall_threshold_s=float(sup_cfg.get('stall_threshold_ms',250))/1000.0)
+    supervisor=Supervisor(bus, settings.device.get('id','pi-feeder-01'),
+                          restart_min_s=float(sup_cfg.get('restart_min_s',1.0)),
+                          restart_max_s=float(sup_cfg.get('restart_max_s',60.0)),
+                          shutdown_timeout_s=float(sup_cfg.get('shutdown_timeout_s',10.0)))
+    supervisor.add('loop_monitor', monitor.run)
+    # viewer counts and throughput come from the relay, so adapting needs it
+    if relay is not None and camera.is_enabled() and settings.camera.get('adaptive',True):
+        supervisor.add('stream_quality', StreamQualityController(settings, camera, relay).run)
+
+    # gateway mode: [[devices]] share the bus connection, executor and loop;
+    # commands are routed by command channel or device_id and each device keeps its own data dir
+    gateway=bool(settings.raw.get('devices'))
+    demux=CommandDemux(bus, inbox_size=int(settings.raw.get('commands',{}).get('inbox_size',64))) if gateway else None
+    if demux is not None: supervisor.add('command_demux', demux.run)
+    # every sensor read of every device goes through one poller
+    poller=SensorPoller(pipeline_size=int(settings.raw.get('poller',{}).get('pipeline_size',256)))
+    supervisor.add('sensors', poller.run)
+    scheds=[]; histories=[]; drivers={}
+    with timer.phase('services'):
+        for ds in devices:
+            dev_id=str(ds.device.get('id','pi-feeder-01'))
+            data=settings.base_dir/'data'/'devices'/dev_id if gateway else settings.base_dir/'data'
+            dbus=demux.view(dev_id, channel=cmd_tpl.format(device_id=dev_id)) if demux is not None else bus
+            metrics=default_registry().scoped(device=dev_id) if gateway else None
+            prefix=f'{dev_id}:' if gateway else ''
+            history=(HistoryStore(data/'history', retention_days=hist_cfg.get('retention_days'))
+                     if hist_cfg.get('enabled',True) else None)
+            telemetry=TelemetryService(ds,dbus,hw=hw,history=history,metrics=metrics,poller=poller)
+            fcfg=ds.raw.get('feeder',{})
+            feeder=Feeder(pin=int(ds.pins.get('servo_feed',12)),mock=bool(ds.device.get('mock_mode',False)),
+                          hw=hw,metrics=metrics,open_angle=float(fcfg.get('open_angle',90)),
+                          closed_angle=float(fcfg.get('closed_angle',0)),travel_s=float(fcfg.get('travel_s',0.4)),
+                          dwell_s=float(fcfg.get('dwell_s',0)))
+            sched_cfg=ds.raw.get('scheduler',{})
+            sched=Scheduler(storage_path=str(data/'schedules.json'), on_fire=None, metrics=metrics,  # type: ignore
+                            tz=sched_cfg.get('timezone'), misfire=str(sched_cfg.get('misfire','once')),
+                            misfire_grace_s=float(sched_cfg.get('misfire_grace_s',60)),
+                            catchup_limit=int(sched_cfg.get('catchup_limit',3)),
+                            misfire_max_age_s=float(sched_cfg.get('misfire_max_age_s',86400)))
+            router=CommandRouter(ds,dbus,sched,feeder,camera,history=history,relay=relay,metrics=metrics)
+            sched.on_fire=router._on_fire
+            water=WaterLevelService(ds,dbus,hw=hw,history=history,metrics=metrics,poller=poller)
+            supervisor.add(prefix+'scheduler', sched.run)
+            supervisor.add(prefix+'commands', router.run)
+            scheds.append(sched); histories.append(history)
+            drivers.update({prefix+'servo':feeder.servo, prefix+'dht22':telemetry.dht, prefix+'alarm':water.alarm})
+            if water.enabled: drivers[water.sensor.adc.name]=water.sensor.adc
+            log.info('Device %s configured (data in %s)', dev_id, data)
+
+    # drivers load lazily; bring them all up at once, each bounded by its own timeout
+    startup_cfg=settings.raw.get('startup',{})
+    opened=await timer.track('hardware', open_devices(drivers, float(startup_cfg.get('device_timeout_s',3.0))))
+    timer.details['devices']={n: {'hardware':ok, 'seconds':round(d,3)} for n,(ok,d) in opened.items()}
+    await bus_up
+    supervisor.start()
+    report=timer.report(log)
+    bus.publish_nowait({'type':'event','level':'info','code':'STARTUP','ts':now_iso(),
+                        'device_id':settings.device.get('id','pi-feeder-01'),'startup':report})
     await stop.wait()
-    for t in tasks: t.cancel()
+    log.info('Shutting down')
+    await supervisor.shutdown()
+    for sched in scheds: await sched.stop()
+    if relay is not None: await relay.stop()
+    if metrics_http is not None: await metrics_http.stop()
     await bus.stop()
+    for history in histories:
+        if history is not None: history.close()
+    hw.shutdown()
 
 if __name__=='__main__':
     try: asyncio.run(amain())
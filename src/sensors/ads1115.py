@@ -0,0 +1,135 @@
+from __future__ import annotations
+import logging, time, weakref
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+from core.hw import HardwareExecutor, LazyDevice, default_executor
+logger = logging.getLogger("sensors.ads1115")
+
+# full-scale range (V) per PGA gain; a raw count of 32767 is full scale
+PGA_FSR = {2/3: 6.144, 1: 4.096, 2: 2.048, 4: 1.024, 8: 0.512, 16: 0.256}
+PINS = ("A0", "A1", "A2", "A3")
+
+@dataclass
+class AdcReading:
+    raw: int
+    volts: float
+    value: float          # volts * scale + offset (e.g. battery voltage behind a divider)
+    pct: float            # raw mapped onto min_raw..max_raw, clamped to 0..100
+    ts: float             # monotonic time of the conversion
+
+class AdcChannel:
+    """
+    A named input with its own gain and calibration; reads go through the
+    shared device but convert this object's own pin and gain, so consumers
+    may reuse a name (every device in gateway mode has a "water" input).
+    """
+    def __init__(self, adc: "ADS1115", name: str, pin: str, gain: float = 1, min_raw: int = 0,
+                 max_raw: int = 65535, scale: float = 1.0, offset: float = 0.0, mock_raw: int = 32768):
+        if pin.upper() not in PINS: raise ValueError(f"ADS1115 has no input {pin!r}")
+        if gain not in PGA_FSR: raise ValueError(f"unsupported ADS1115 gain {gain!r}")
+        self.adc = adc; self.name = name; self.pin = pin.upper(); self.gain = gain
+        self.min_raw = int(min_raw); self.max_raw = int(max_raw)
+        self.scale = float(scale); self.offset = float(offset); self.mock_raw = int(mock_raw)
+        self.latest: Optional[AdcReading] = None
+
+    def to_pct(self, raw: float) -> float:
+        span = max(1, self.max_raw - self.min_raw)
+        pct = (raw - self.min_raw) / span * 100.0
+        return round(0.0 if pct < 0 else 100.0 if pct > 100 else pct, 1)
+
+    def reading(self, raw: int, ts: float) -> AdcReading:
+        volts = raw * PGA_FSR[self.gain] / 32767
+        r = AdcReading(raw, round(volts, 5), round(volts * self.scale + self.offset, 4), self.to_pct(raw), ts)
+        self.latest = r
+        return r
+
+    def read(self) -> Optional[AdcReading]:
+        return self.adc.scan([self]).get(self.name)
+
+    async def read_async(self, max_age_s: float = 0.0) -> Optional[AdcReading]:
+        """Fresh conversion, or the latest one if it is at most ``max_age_s`` old."""
+        if max_age_s > 0 and self.latest is not None and time.monotonic() - self.latest.ts <= max_age_s:
+            return self.latest
+        return (await self.adc.scan_async([self])).get(self.name)
+
+_shared: "weakref.WeakKeyDictionary[HardwareExecutor, Dict[int, ADS1115]]" = weakref.WeakKeyDictionary()
+
+class ADS1115(LazyDevice):
+    """
+    One ADS1115 shared by every consumer of its inputs.
+
+    Each channel read is a single conversion (``ads.read``); voltage is
+    derived from the raw count and the channel's gain instead of a second
+    conversion. ``scan`` reads several channels in one pass on the I2C worker.
+    With ``continuous`` the converter free-runs on the last channel read, so
+    back-to-back reads of one high-rate channel return the latest result
+    without waiting for a fresh single-shot conversion; reading another
+    channel switches the multiplexer (and costs one conversion) as usual.
+    """
+    def __init__(self, i2c_addr: int = 0x48, data_rate: Optional[int] = None, continuous: bool = False,
+                 mock: bool = False, hw: HardwareExecutor | None = None, timeout_s: float = 0.5,
+                 mock_latency_s: float = 0.008):
+        self.i2c_addr = int(i2c_addr); self.data_rate = data_rate; self.continuous = continuous
+        self.mock = mock; self.hw = hw or default_executor(); self.timeout = timeout_s
+        self.mock_latency = mock_latency_s   # one single-shot conversion at the default 128 SPS
+        self.channels: List[AdcChannel] = []
+        self.name = f"ADS1115 0x{self.i2c_addr:02X}"
+        self._ads = None; self._pins: Dict[str, object] = {}; self._gain: Optional[float] = None
+
+    @classmethod
+    def shared(cls, i2c_addr: int = 0x48, hw: HardwareExecutor | None = None, **kw) -> "ADS1115":
+        """The device at ``i2c_addr`` on ``hw``'s I2C bus, created by the first caller."""
+        hw = hw or default_executor()
+        per_hw = _shared.setdefault(hw, {})
+        dev = per_hw.get(int(i2c_addr))
+        if dev is None: dev = per_hw[int(i2c_addr)] = cls(i2c_addr, hw=hw, **kw)
+        return dev
+
+    def channel(self, name: str, pin: str, **calibration) -> AdcChannel:
+        """Register an input; the returned channel is what reads it."""
+        ch = AdcChannel(self, name, pin, **calibration)
+        self.channels.append(ch)
+        return ch
+
+    def _open(self) -> None:
+        import board  # type: ignore
+        from adafruit_ads1x15.ads1115 import ADS1115 as _Driver  # type: ignore
+        from adafruit_ads1x15 import ads1x15  # type: ignore
+        ads = _Driver(board.I2C(), address=self.i2c_addr)
+        if self.data_rate: ads.data_rate = self.data_rate
+        ads.mode = ads1x15.Mode.CONTINUOUS if self.continuous else ads1x15.Mode.SINGLE
+        self._pins = {p: getattr(ads1x15.Pin, p) for p in PINS}
+        self._ads = ads
+        logger.info("ADS1115 addr=0x%02X mode=%s rate=%s", self.i2c_addr,
+                    "continuous" if self.continuous else "single", ads.data_rate)
+
+    def _convert(self, ch: AdcChannel) -> int:
+        if self.mock:
+            if self.mock_latency: time.sleep(self.mock_latency)
+            return ch.mock_raw
+        if self._gain != ch.gain:
+            self._ads.gain = ch.gain; self._gain = ch.gain  # type: ignore
+        return int(self._ads.read(self._pins[ch.pin]))  # type: ignore
+
+    def scan(self, channels: Optional[Iterable[AdcChannel]] = None) -> Dict[str, AdcReading]:
+        """Read ``channels`` (all registered ones by default) by name; a failed channel is left out."""
+        self.open()
+        out: Dict[str, AdcReading] = {}
+        for ch in (self.channels if channels is None else channels):
+            try:
+                out[ch.name] = ch.reading(self._convert(ch), time.monotonic())
+            except Exception as e:
+                logger.warning("ADS1115 read error on %s (%s): %s", ch.name, ch.pin, e)
+        return out
+
+    async def scan_async(self, channels: Optional[Iterable[AdcChannel]] = None) -> Dict[str, AdcReading]:
+        channels = list(self.channels if channels is None else channels)
+        return await self.hw.run("i2c", self.scan, channels, timeout=self.timeout * max(1, len(channels)))
+
+def shared_adc(settings: Any, hw: HardwareExecutor | None = None, i2c_addr: Optional[int] = None) -> ADS1115:
+    """The shared converter configured from ``[sensors.adc]`` (``i2c_addr``, ``data_rate``, ``continuous``)."""
+    cfg = settings.raw.get("sensors", {}).get("adc", {})
+    rate = cfg.get("data_rate")
+    return ADS1115.shared(int(cfg.get("i2c_addr", 0x48) if i2c_addr is None else i2c_addr), hw=hw,
+                          mock=bool(settings.device.get("mock_mode", False)),
+                          data_rate=int(rate) if rate else None, continuous=bool(cfg.get("continuous", False)))
@@ -1,27 +1,29 @@
 from __future__ import annotations
-import logging, random, time
+import asyncio, logging, random, time
 from typing import Optional, Tuple
+from core.hw import HardwareExecutor, LazyDevice, default_executor
 logger = logging.getLogger("sensors.dht22")
 
-class DHT22Sensor:
-    def __init__(self, bcm_pin: int, mock: bool = False):
+ERROR_BACKOFF_S=0.5
+
+class DHT22Sensor(LazyDevice):
+    def __init__(self, bcm_pin: int, mock: bool = False, hw: HardwareExecutor | None = None,
+                 timeout_s: float = 2.0, mock_latency_s: float = 0.02):
         self.pin=bcm_pin; self.mock=mock; self._drv=None
-        if not mock:
-            try:
-                import adafruit_dht  # type: ignore
-                import board  # type: ignore
-                pin_attr = f"D{self.pin}"
-                if hasattr(board, pin_attr):
-                    self._drv = adafruit_dht.DHT22(getattr(board, pin_attr), use_pulseio=False)
-                else:
-                    logger.warning("Board pin not found; using mock.")
-                    self.mock=True
-            except Exception as e:
-                logger.warning("DHT init failed (%s); using mock.", e)
-                self.mock=True
+        self.hw=hw or default_executor(); self.timeout=timeout_s; self.mock_latency=mock_latency_s
+        self.name=f"DHT22 GPIO{bcm_pin}"
 
-    def read(self) -> Tuple[Optional[float], Optional[float]]:
+    def _open(self) -> None:
+        import adafruit_dht  # type: ignore
+        import board  # type: ignore
+        pin_attr = f"D{self.pin}"
+        if not hasattr(board, pin_attr): raise RuntimeError("board pin not found")
+        self._drv = adafruit_dht.DHT22(getattr(board, pin_attr), use_pulseio=False)
+
+    def _read_once(self) -> Tuple[Optional[float], Optional[float]]:
+        self.open()
         if self.mock:
+            if self.mock_latency: time.sleep(self.mock_latency)   # bit-banged transfer time
             return round(random.uniform(20.0, 28.0),1), round(random.uniform(35.0, 60.0),1)
         try:
             t = self._drv.temperature  # type: ignore
@@ -29,4 +31,15 @@ class DHT22Sensor:
             if t is None or h is None: raise RuntimeError("Invalid DHT22 reading")
             return float(t), float(h)
         except Exception as e:
-            logger.warning("DHT read error: %s", e); time.sleep(0.5); return None, None
+            logger.warning("DHT read error: %s", e); return None, None
+
+    def read(self) -> Tuple[Optional[float], Optional[float]]:
+        t, h = self._read_once()
+        if t is None: time.sleep(ERROR_BACKOFF_S)
+        return t, h
+
+    async def read_async(self) -> Tuple[Optional[float], Optional[float]]:
+        """Read on the GPIO worker; the error back-off is awaited here so it doesn't hold the bus."""
+        t, h = await self.hw.run("gpio", self._read_once, timeout=self.timeout)
+        if t is None: await asyncio.sleep(ERROR_BACKOFF_S)
+        return t, h
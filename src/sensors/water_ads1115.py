@@ -1,10 +1,17 @@
 from __future__ import annotations
 import logging
 from typing import Optional, Tuple
+from core.hw import HardwareExecutor
+from sensors.ads1115 import ADS1115
 
 logger = logging.getLogger("sensors.water_ads")
 
 class WaterAnalogADS1115:
+    """
+    Water-level probe on one input of a shared ``ADS1115`` (``adc``, or the
+    one at ``i2c_addr``; the converter's mode and data rate are set by
+    whoever created it first). ``adc`` is the device to open at startup.
+    """
     def __init__(
         self,
         channel: str = "A3",
@@ -13,43 +20,32 @@ class WaterAnalogADS1115:
         min_adc: int = 0,
         max_adc: int = 65535,
         mock: bool = False,
+        hw: HardwareExecutor | None = None,
+        timeout_s: float = 0.5,
+        adc: ADS1115 | None = None,
     ) -> None:
-        self.mock = mock
-        self.min_adc = int(min_adc)
-        self.max_adc = int(max_adc)
-        self._chan = None
-        if not mock:
-            try:
-                import board  # type: ignore
-                from adafruit_ads1x15.ads1115 import ADS1115  # type: ignore
-                from adafruit_ads1x15.analog_in import AnalogIn  # type: ignore
-                from adafruit_ads1x15 import ads1x15  # type: ignore
-                i2c = board.I2C()
-                ads = ADS1115(i2c, address=i2c_addr)
-                ads.gain = gain
-                pin = getattr(ads1x15.Pin, channel.upper())
-                self._chan = AnalogIn(ads, pin)
-                logger.info("ADS1115 water sensor on %s addr=0x%02X gain=%s", channel, i2c_addr, gain)
-            except Exception as e:
-                logger.warning("ADS1115 init failed: %s; switching to mock.", e)
-                self.mock = True
+        self.adc = adc or ADS1115.shared(i2c_addr, hw=hw, mock=mock, timeout_s=timeout_s)
+        self.chan = self.adc.channel("water", channel, gain=gain, min_raw=min_adc, max_raw=max_adc)
+        self.channel = channel; self.i2c_addr = i2c_addr; self.gain = gain
 
     def read_raw(self) -> Tuple[Optional[int], Optional[float]]:
-        if self.mock:
-            return 32768, 2.048
-        try:
-            v = int(self._chan.value)     # 0..65535
-            volt = float(self._chan.voltage)
-            return v, volt
-        except Exception as e:
-            logger.warning("ADS1115 read error: %s", e)
-            return None, None
+        r = self.chan.read()
+        return (None, None) if r is None else (r.raw, r.volts)
+
+    async def read_raw_async(self) -> Tuple[Optional[int], Optional[float]]:
+        r = await self.chan.read_async()
+        return (None, None) if r is None else (r.raw, r.volts)
 
     def read_pct(self) -> dict:
-        raw, volt = self.read_raw()
+        return self._to_pct(*self.read_raw())
+
+    async def read_pct_async(self) -> dict:
+        return self._to_pct(*(await self.read_raw_async()))
+
+    def raw_to_pct(self, raw: float) -> float:
+        return self.chan.to_pct(raw)
+
+    def _to_pct(self, raw: Optional[int], volt: Optional[float]) -> dict:
         if raw is None:
             return {"raw": None, "voltage": volt, "level_pct": None}
-        span = max(1, self.max_adc - self.min_adc)
-        pct = (raw - self.min_adc) / span * 100.0
-        pct = 0.0 if pct < 0 else 100.0 if pct > 100 else pct
-        return {"raw": raw, "voltage": volt, "level_pct": round(pct, 1)}
+        return {"raw": raw, "voltage": volt, "level_pct": self.raw_to_pct(raw)}
@@ -1,7 +1,7 @@
 from __future__ import annotations
-import logging, os, socket, subprocess
+import asyncio, logging, os, socket, subprocess, time
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 from core.settings import Settings
 
 logger = logging.getLogger("services.camera")
@@ -10,6 +10,15 @@ class CameraController:
     """
     Thin wrapper around mjpg_streamer_pi5.sh so commands can toggle the camera
     through PubNub the same way the feeder is controlled.
+
+    The script runs as an asyncio subprocess. ``status()`` serves a cached
+    payload for ``status_ttl_s``; after that a stale payload (up to
+    ``status_max_stale_s`` old) is returned while one background probe
+    refreshes it, and concurrent callers share a single in-flight probe.
+    ``start``/``stop`` invalidate the cache. The LAN host list is cached for
+    ``hosts_ttl_s`` and a change of address invalidates the status too.
+    ``apply_profile`` switches RES/FPS/Q (see ``StreamQualityController``)
+    and restarts a running streamer only when one of them changes.
     """
     def __init__(self, settings: Settings):
         cfg = settings.camera or {}
@@ -29,9 +38,21 @@ class CameraController:
             "Q": str(cfg.get("quality", 85)),
             "PORT": str(cfg.get("port", 8080)),
         }
+        self.profile: Optional[str] = None
+        self.actions = 0   # start/stop calls so far; lets automation notice manual toggles
+        self._lock = asyncio.Lock()   # start/stop/apply_profile from commands and automation take turns
         self.stream_suffix = cfg.get("stream_suffix", "?action=stream")
         # Allow an explicit public URL to override the derived one.
         self.public_url = cfg.get("public_url") or cfg.get("url")
+        self.status_ttl = float(cfg.get("status_ttl_s", 5.0))
+        self.status_max_stale = float(cfg.get("status_max_stale_s", 60.0))
+        self.hosts_ttl = float(cfg.get("hosts_ttl_s", 60.0))
+        self._status: Optional[Tuple[float, Dict[str, Any]]] = None
+        self._probe: Optional[asyncio.Task] = None
+        self._probe_gen = -1
+        self._gen = 0   # bumped by invalidate(); probes started earlier don't store their result
+        self._hosts: Optional[Tuple[float, List[str]]] = None
+        self._tunnel_pid_val: Optional[int] = None
 
     def is_enabled(self) -> bool:
         return self.enabled
@@ -44,33 +65,89 @@ class CameraController:
         if not os.access(self.script_path, os.X_OK):
             raise RuntimeError(f"Camera script not executable: {self.script_path}")
 
-    def _run(self, action: str, capture: bool = True) -> subprocess.CompletedProcess[str]:
+    async def _run(self, action: str, capture: bool = True) -> subprocess.CompletedProcess[str]:
         self._ensure_ready()
         cmd = [str(self.script_path), action]
         if self.use_sudo and os.geteuid() != 0:
             cmd.insert(0, "sudo")
         env = os.environ.copy()
         env.update({k: v for k, v in self.env_overrides.items() if v})
-        logger.info("CameraController invoking: %s", " ".join(cmd))
-        stdout = subprocess.PIPE if capture else None
-        stderr = subprocess.PIPE if capture else None
-        return subprocess.run(cmd, check=True, stdout=stdout, stderr=stderr, text=True, env=env)
-
-    def start(self) -> Dict[str, Any]:
-        self._run("start", capture=False)
-        self._start_tunnel()
-        return self.status()
-
-    def stop(self) -> Dict[str, Any]:
-        self._run("stop", capture=False)
-        self._stop_tunnel()
-        return self.status()
-
-    def status(self) -> Dict[str, Any]:
-        proc = self._run("status", capture=True)
+        # status probes run on every poll; only state changes are worth INFO
+        logger.log(logging.DEBUG if action == "status" else logging.INFO, "CameraController invoking: %s", " ".join(cmd))
+        pipe = asyncio.subprocess.PIPE if capture else None
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=pipe, stderr=pipe, env=env)
+        out, err = await proc.communicate()
+        stdout = out.decode(errors="replace") if out is not None else None
+        stderr = err.decode(errors="replace") if err is not None else None
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+        return subprocess.CompletedProcess(cmd, proc.returncode or 0, stdout, stderr)
+
+    def invalidate(self) -> None:
+        self._status = None; self._gen += 1
+
+    async def start(self, expect_actions: Optional[int] = None) -> Dict[str, Any]:
+        """Start stream and tunnel; with ``expect_actions``, only if no start/stop happened since."""
+        async with self._lock:
+            if expect_actions is not None and expect_actions != self.actions:
+                return await self.status()
+            self.actions += 1
+            await self._run("start", capture=False)
+            self._start_tunnel()
+            return await self.status(fresh=True)
+
+    async def stop(self, tunnel: bool = True, expect_actions: Optional[int] = None) -> Dict[str, Any]:
+        async with self._lock:
+            if expect_actions is not None and expect_actions != self.actions:
+                return await self.status()
+            self.actions += 1
+            await self._run("stop", capture=False)
+            if tunnel: self._stop_tunnel()
+            return await self.status(fresh=True)
+
+    async def apply_profile(self, name: str, resolution: str, fps: int, quality: int) -> bool:
+        """Use these stream settings from now on; True if they differ from the current ones."""
+        env = {"RES": str(resolution), "FPS": str(fps), "Q": str(quality)}
+        async with self._lock:
+            changed = any(self.env_overrides.get(k) != v for k, v in env.items())
+            if not changed and self.profile == name:
+                return False
+            running = changed and (await self.status())["state"] == "running"
+            self.profile = name
+            if not changed: return False
+            self.env_overrides.update(env)
+            if running:
+                await self._run("restart", capture=False)
+            self.invalidate()
+            return True
+
+    async def status(self, fresh: bool = False) -> Dict[str, Any]:
+        now = time.monotonic()
+        cached = self._status
+        if not fresh and cached is not None:
+            age = now - cached[0]
+            if age < self.status_ttl:
+                return cached[1]
+            if age < self.status_max_stale:
+                self._probe_once()   # refresh in the background, answer from cache
+                return cached[1]
+        if fresh: self.invalidate()
+        return await asyncio.shield(self._probe_once())
+
+    def _probe_once(self) -> asyncio.Task:
+        if self._probe is None or self._probe.done() or self._probe_gen != self._gen:
+            self._probe_gen = self._gen
+            self._probe = asyncio.create_task(self._do_probe(self._gen), name="camera-status")
+            self._probe.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self._probe
+
+    async def _do_probe(self, gen: int) -> Dict[str, Any]:
+        proc = await self._run("status", capture=True)
         output = (proc.stdout or "").strip()
         running = "RUNNING" in output.upper()
-        return self._build_payload("running" if running else "stopped", output)
+        payload = await self._build_payload("running" if running else "stopped", output)
+        if gen == self._gen: self._status = (time.monotonic(), payload)
+        return payload
 
     def _is_pid_running(self, pid: int) -> bool:
         try:
@@ -79,14 +156,18 @@ class CameraController:
         except OSError:
             return False
 
+    def _tunnel_pid(self) -> Optional[int]:
+        # the pid file is only read once; after that we track it ourselves
+        if self._tunnel_pid_val is None:
+            try:
+                self._tunnel_pid_val = int(self.tunnel_pid.read_text().strip())
+            except (ValueError, OSError):
+                return None
+        return self._tunnel_pid_val
+
     def _is_tunnel_running(self) -> bool:
-        if not self.tunnel_pid.exists():
-            return False
-        try:
-            pid = int(self.tunnel_pid.read_text().strip())
-        except (ValueError, OSError):
-            return False
-        return self._is_pid_running(pid)
+        pid = self._tunnel_pid()
+        return pid is not None and self._is_pid_running(pid)
 
     def _start_tunnel(self) -> None:
         if not self.tunnel_token:
@@ -107,17 +188,15 @@ class CameraController:
             log_f.close()
             return
         self.tunnel_pid.write_text(str(proc.pid), encoding="utf-8")
+        self._tunnel_pid_val = proc.pid
         log_f.close()
 
     def _stop_tunnel(self) -> None:
         if not self.tunnel_token:
             return
-        if not self._is_tunnel_running():
-            self.tunnel_pid.unlink(missing_ok=True)
-            return
-        try:
-            pid = int(self.tunnel_pid.read_text().strip())
-        except (ValueError, OSError):
+        pid = self._tunnel_pid()
+        self._tunnel_pid_val = None
+        if pid is None or not self._is_pid_running(pid):
             self.tunnel_pid.unlink(missing_ok=True)
             return
         try:
@@ -147,9 +226,20 @@ class CameraController:
             pass
         return hosts
 
-    def _build_payload(self, state: str, output: str) -> Dict[str, Any]:
+    async def _cached_hosts(self) -> List[str]:
+        now = time.monotonic()
+        if self._hosts is not None and now - self._hosts[0] < self.hosts_ttl:
+            return self._hosts[1]
+        hosts = await asyncio.to_thread(self._local_hosts)
+        if self._hosts is not None and hosts != self._hosts[1]:
+            logger.info("LAN addresses changed: %s -> %s", self._hosts[1], hosts)
+            self.invalidate()
+        self._hosts = (now, hosts)
+        return hosts
+
+    async def _build_payload(self, state: str, output: str) -> Dict[str, Any]:
         port = self.env_overrides["PORT"]
-        hosts = self._local_hosts()
+        hosts = await self._cached_hosts()
         suffix = self.stream_suffix.lstrip("/")
         if self.public_url:
             url = self.public_url
@@ -166,6 +256,7 @@ class CameraController:
             "resolution": self.env_overrides["RES"],
             "fps": self.env_overrides["FPS"],
             "quality": self.env_overrides["Q"],
+            "profile": self.profile,
             "url": url.rstrip("/"),
             "lan_urls": lan_urls,
             "tunnel_running": bool(self.tunnel_token) and self._is_tunnel_running(),
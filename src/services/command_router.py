@@ -1,21 +1,80 @@
 from __future__ import annotations
-import logging, uuid
-from typing import Any, Dict
+import asyncio, base64, logging, time, uuid
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
 from core.bus import Bus
+from core.metrics import MetricsRegistry, default_registry
 from core.scheduler import Scheduler, Job
 from core.settings import Settings
-from actuators.feeder import Feeder
+from core.tsdb import HistoryStore
+from actuators.feeder import DispenseQueue, Feeder, FeedRateLimited
 from services.camera_controller import CameraController
+from services.frame_relay import FrameRelay
+from utils.ttl_cache import TTLCache
 logger = logging.getLogger("services.command")
 
+Handler = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
 class CommandRouter:
+    """
+    Dispatches bus commands through a registry of handlers.
+
+    Each handler is bound to an optional resource (``feeder``, ``camera``,
+    ``schedule``); commands on different resources run concurrently, commands
+    on the same resource run one at a time. Feeding goes through a
+    ``DispenseQueue`` instead, so feeds arriving together share one motion. At most ``max_inflight`` commands
+    are in progress before the router stops pulling from the bus. Commands
+    that carry a ``command_id`` are deduplicated: a repeat within
+    ``dedupe_ttl_s`` gets the first ack again (marked ``duplicate``) instead of
+    being executed twice.
+    """
     def __init__(self, settings: Settings, bus: Bus, scheduler: Scheduler, feeder: Feeder,
-                 camera: CameraController):
+                 camera: CameraController, history: HistoryStore | None=None,
+                 relay: FrameRelay | None=None, metrics: MetricsRegistry | None=None):
         self.settings=settings
+        self.metrics=metrics or default_registry()
+        self.history=history
+        self.relay=relay
         self.bus=bus
         self.scheduler=scheduler
         self.feeder=feeder
         self.camera=camera
+        fcfg=settings.raw.get('feeder', {})
+        self.dispenser=DispenseQueue(feeder, window_s=float(fcfg.get('coalesce_window_s', 0.25)),
+                                     max_motion_portions=int(fcfg.get('max_motion_portions', 6)),
+                                     max_request_portions=int(fcfg.get('max_request_portions', 4)),
+                                     rate_limit_portions=int(fcfg.get('rate_limit_portions', 12)),
+                                     rate_limit_window_s=float(fcfg.get('rate_limit_window_s', 3600)),
+                                     metrics=self.metrics)
+        cfg=settings.raw.get('commands', {})
+        self.max_inflight=max(1, int(cfg.get('max_inflight', 8)))
+        self._dedupe: TTLCache[Dict[str, Any]]=TTLCache(int(cfg.get('dedupe_size', 256)),
+                                                        float(cfg.get('dedupe_ttl_s', 600)))
+        self._pending: Dict[str, asyncio.Future]={}
+        self._handlers: Dict[str, Tuple[Handler, Optional[str]]]={}
+        self._locks: Dict[str, asyncio.Lock]={}
+        self._tasks: Set[asyncio.Task]=set()
+        m=self.metrics
+        self._m_seconds=m.histogram('command_seconds','Command handling time, receipt to ack',('command',))
+        self._m_total=m.counter('commands_total','Commands handled',('command','status'))
+        self._m_duplicates=m.counter('commands_duplicate_total','Repeated command_ids answered from the dedupe cache')
+        m.gauge('commands_inflight','Commands being handled').set_function(lambda: len(self._tasks))
+        self.register('feedNow', self._cmd_feed_now)
+        self.register('scheduleFeed', self._cmd_schedule_feed, resource='schedule')
+        self.register('cancelSchedule', self._cmd_cancel_schedule, resource='schedule')
+        self.register('listSchedules', self._cmd_list_schedules)
+        for name in ('cameraOn','cameraOff'):
+            self.register(name, self._camera_handler(name), resource='camera')
+        # status probes are collapsed inside CameraController, no need to queue them
+        self.register('cameraStatus', self._camera_handler('cameraStatus'))
+        self.register('cameraSnapshot', self._cmd_camera_snapshot)
+        self.register('getHistory', self._cmd_get_history)
+        self.register('getMetrics', self._cmd_get_metrics)
+
+    def register(self, command: str, handler: Handler, resource: Optional[str]=None)->None:
+        """``handler(args)`` returns the ack fields (at least ``status``)."""
+        self._handlers[command]=(handler, resource)
+        if resource and resource not in self._locks: self._locks[resource]=asyncio.Lock()
 
     async def _ack(self, command: str, status: str='ok', **extra: Any)->None:
         await self.bus.publish({'type':'ack','command':command,'status':status, **extra})
@@ -23,44 +82,142 @@ class CommandRouter:
     async def _event(self, code: str, msg: str, **extra: Any)->None:
         await self.bus.publish({'type':'event','level':'info','code':code,'msg':msg, **extra})
 
-    async def _on_fire(self, job: Job)->None:
+    async def _on_fire(self, job: Job, lateness_s: float=0.0)->None:
         try:
-            self.feeder.dispense_small()
-            await self._event('FEED_DISPENSED', f'Job {job.id} dispensed food.')
+            d=await self.dispenser.request(job.portions or 1)
+            await self._event('FEED_DISPENSED', f'Job {job.id} dispensed food.', job_id=job.id,
+                              scheduled_for=job.last_fired, lateness_s=round(lateness_s, 3),
+                              portions=d.portions, merged=d.merged, duration_s=d.duration_s)
+        except FeedRateLimited as e:
+            await self._event('FEED_ERROR', f'Job {job.id} skipped: {e}', level='warning', retry_after_s=e.retry_after_s)
         except Exception as e:
             await self._event('FEED_ERROR', f'Job {job.id} failed: {e}', level='error')
 
+    # ---- handlers ----
+    async def _cmd_feed_now(self, args: Dict[str, Any])->Dict[str, Any]:
+        try:
+            d=await self.dispenser.request(int(args.get('portions', 1)), args.get('angle'))
+        except FeedRateLimited as e:
+            return {'status':'error', 'error':str(e), 'retry_after_s':e.retry_after_s}
+        return {'status':'ok', 'portions':d.portions, 'merged':d.merged, 'motion_portions':d.motion_portions,
+                'duration_s':d.duration_s, 'waited_s':d.waited_s}
+
+    async def _cmd_schedule_feed(self, args: Dict[str, Any])->Dict[str, Any]:
+        mode=args.get('mode','once')
+        misfire=args.get('misfire'); limit=args.get('catchup_limit')
+        if mode=='once':
+            job=Job(id=str(uuid.uuid4()), type='once', at=args.get('at'), misfire=misfire)
+        else:
+            job=Job(id=str(uuid.uuid4()), type='daily', time_local=args.get('time_local'), days=args.get('days'),
+                    misfire=misfire, catchup_limit=int(limit) if limit is not None else None)
+        if args.get('portions') is not None:
+            job.portions=int(args['portions'])
+            if not 1<=job.portions<=self.dispenser.max_request:
+                return {'status':'error', 'error':f'portions must be 1..{self.dispenser.max_request}'}
+        try: self.scheduler.add_job(job)
+        except ValueError as e: return {'status':'error', 'error':str(e)}
+        return {'status':'ok', 'job':job.__dict__}
+
+    async def _cmd_cancel_schedule(self, args: Dict[str, Any])->Dict[str, Any]:
+        jid=args.get('id')
+        return {'status':'ok' if (jid and self.scheduler.remove_job(jid)) else 'error', 'id':jid}
+
+    async def _cmd_list_schedules(self, args: Dict[str, Any])->Dict[str, Any]:
+        return {'status':'ok', 'jobs':[j.__dict__ for j in self.scheduler.jobs]}
+
+    @staticmethod
+    def _to_ms(v: Any)->int:
+        if isinstance(v, (int, float)): return int(v)
+        return int(datetime.fromisoformat(str(v).replace('Z','+00:00')).timestamp()*1000)
+
+    async def _cmd_get_history(self, args: Dict[str, Any])->Dict[str, Any]:
+        if self.history is None:
+            return {'status':'error', 'error':'history store disabled'}
+        metric=args.get('metric')
+        if not metric:
+            return {'status':'ok', 'metrics':self.history.metrics()}
+        end=self._to_ms(args['end']) if args.get('end') is not None else int(time.time()*1000)
+        start=(self._to_ms(args['start']) if args.get('start') is not None
+               else end-int(float(args.get('hours', 24))*3_600_000))
+        max_points=min(2000, int(args.get('max_points', 300)))
+        result=await asyncio.to_thread(self.history.query, str(metric), start, end, max_points,
+                                       str(args.get('resolution', 'auto')))
+        return {'status':'ok', 'history':result}
+
+    async def _cmd_get_metrics(self, args: Dict[str, Any])->Dict[str, Any]:
+        return {'status':'ok', 'metrics':self.metrics.snapshot(str(args.get('prefix', '')))}
+
+    async def _cmd_camera_snapshot(self, args: Dict[str, Any])->Dict[str, Any]:
+        if self.relay is None:
+            return {'status':'error', 'error':'frame relay disabled'}
+        frame=await self.relay.snapshot(timeout=float(args.get('timeout_s', 5.0)))
+        if frame is None:
+            return {'status':'error', 'error':'no frame available'}
+        return {'status':'ok', 'content_type':'image/jpeg', 'size':len(frame),
+                'jpeg_b64':base64.b64encode(frame).decode('ascii')}
+
+    def _camera_handler(self, cmd: str)->Handler:
+        async def handler(args: Dict[str, Any])->Dict[str, Any]:
+            if not self.camera or not self.camera.is_enabled():
+                return {'status':'error', 'error':'camera controller unavailable'}
+            payload=await (self.camera.start() if cmd=='cameraOn'
+                           else self.camera.stop() if cmd=='cameraOff'
+                           else self.camera.status())
+            return {'status':'ok', 'camera':payload}
+        return handler
+
+    # ---- dispatch ----
+    async def _execute(self, cmd: Optional[str], args: Dict[str, Any])->Dict[str, Any]:
+        entry=self._handlers.get(cmd or '')
+        if entry is None:
+            self._m_total.labels('unknown', 'error').inc()
+            return {'status':'error', 'error':'unknown command'}
+        handler, resource=entry
+        t0=time.perf_counter()
+        try:
+            if resource is None:
+                result=await handler(args)
+            else:
+                async with self._locks[resource]:
+                    result=await handler(args)
+        except Exception as e:
+            logger.exception('Command handling error')
+            result={'status':'error', 'error':str(e)}
+        self._m_seconds.labels(cmd).observe(time.perf_counter()-t0)
+        self._m_total.labels(cmd, result.get('status', 'ok')).inc()
+        return result
+
+    async def dispatch(self, msg: Dict[str, Any])->None:
+        cmd=msg.get('command'); args=msg.get('args') or {}
+        cid=msg.get('command_id')
+        if not cid:
+            await self._ack(cmd or 'unknown', **(await self._execute(cmd, args))); return
+        cached=self._dedupe.get(cid)
+        if cached is None and cid in self._pending:
+            cached=await asyncio.shield(self._pending[cid])
+        if cached is not None:
+            logger.info('Duplicate command %s (%s); replaying ack', cid, cmd)
+            self._m_duplicates.inc()
+            await self._ack(cmd or 'unknown', **cached, command_id=cid, duplicate=True); return
+        fut=asyncio.get_running_loop().create_future(); self._pending[cid]=fut
+        try:
+            result=await self._execute(cmd, args)
+            self._dedupe.put(cid, result); fut.set_result(result)
+        finally:
+            self._pending.pop(cid, None)
+            if not fut.done(): fut.cancel()
+        await self._ack(cmd or 'unknown', **result, command_id=cid)
+
     async def run(self)->None:
         self.scheduler.load()
-        while True:
-            msg=await self.bus.next_command()
-            if not msg: continue
-            cmd=msg.get('command'); args=msg.get('args',{})
-            try:
-                if cmd=='feedNow':
-                    self.feeder.dispense_small(); await self._ack(cmd,'ok')
-                elif cmd=='scheduleFeed':
-                    mode=args.get('mode','once')
-                    if mode=='once':
-                        job=Job(id=str(uuid.uuid4()), type='once', at=args.get('at'))
-                    else:
-                        job=Job(id=str(uuid.uuid4()), type='daily', time_local=args.get('time_local'), days=args.get('days'))
-                    self.scheduler.add_job(job); await self._ack(cmd,'ok', job=job.__dict__)
-                elif cmd=='cancelSchedule':
-                    jid=args.get('id'); 
-                    await self._ack(cmd, 'ok' if (jid and self.scheduler.remove_job(jid)) else 'error', id=jid)
-                elif cmd=='listSchedules':
-                    await self._ack(cmd, 'ok', jobs=[j.__dict__ for j in self.scheduler.jobs])
-                elif cmd in ('cameraOn','cameraOff','cameraStatus'):
-                    if not self.camera or not self.camera.is_enabled():
-                        await self._ack(cmd,'error', error='camera controller unavailable')
-                        continue
-                    payload = (self.camera.start() if cmd=='cameraOn'
-                               else self.camera.stop() if cmd=='cameraOff'
-                               else self.camera.status())
-                    await self._ack(cmd,'ok', camera=payload)
-                else:
-                    await self._ack(cmd or 'unknown', 'error', error='unknown command')
-            except Exception as e:
-                logger.exception('Command handling error')
-                await self._ack(cmd or 'unknown', 'error', error=str(e))
+        slots=asyncio.Semaphore(self.max_inflight)
+        try:
+            while True:
+                msg=await self.bus.next_command()
+                if not msg: continue
+                await slots.acquire()
+                t=asyncio.create_task(self.dispatch(msg))
+                self._tasks.add(t)
+                t.add_done_callback(lambda task: (self._tasks.discard(task), slots.release()))
+        finally:
+            for t in list(self._tasks): t.cancel()
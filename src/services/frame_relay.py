@@ -0,0 +1,196 @@
+from __future__ import annotations
+import asyncio, logging, time
+from typing import Dict, Optional, Tuple
+from core.settings import Settings
+
+logger = logging.getLogger("services.frame_relay")
+
+BOUNDARY = b"relayframe"
+
+class FrameRelay:
+    """
+    Single-upstream fan-out proxy in front of mjpg-streamer.
+
+    One connection to the streamer's ``?action=stream`` is held while anyone
+    is watching (or a snapshot was asked for within ``idle_s``). The newest
+    JPEG is kept as one immutable ``bytes`` object that every client writes
+    from directly. Each client sends the latest frame whenever its socket
+    has drained, so a slow viewer skips frames instead of buffering them or
+    slowing down the others. ``?action=snapshot`` (and ``snapshot()``) serve
+    the cached frame when it is younger than ``snapshot_max_age_s``.
+    """
+    def __init__(self, settings: Settings):
+        cfg = settings.camera or {}
+        self.enabled = bool(cfg.get("relay_enabled", False))
+        self.upstream_host = str(cfg.get("relay_upstream_host", "127.0.0.1"))
+        self.upstream_port = int(cfg.get("port", 8080))
+        self.upstream_path = str(cfg.get("relay_upstream_path", "/?action=stream"))
+        self.listen_host = str(cfg.get("relay_host", "0.0.0.0"))
+        self.listen_port = int(cfg.get("relay_port", 8090))
+        self.idle_s = float(cfg.get("relay_idle_s", 10.0))
+        self.snapshot_max_age = float(cfg.get("snapshot_max_age_s", 2.0))
+        self.client_buffer = int(cfg.get("relay_client_buffer", 256 * 1024))
+        self._frame: Optional[bytes] = None
+        self._frame_at = 0.0
+        self._seq = 0
+        self._cond = asyncio.Condition()
+        self._demand = asyncio.Event()
+        self._last_demand = 0.0
+        self._clients = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._upstream: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"frames_in": 0, "frames_out": 0, "frames_dropped": 0,
+                                      "bytes_out": 0, "upstream_connects": 0, "snapshots": 0}
+
+    # ---- lifecycle ----
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_client, self.listen_host, self.listen_port)
+        self._upstream = asyncio.create_task(self._upstream_loop(), name="frame-relay-upstream")
+        logger.info("Frame relay on %s:%d -> %s:%d", self.listen_host, self.listen_port,
+                    self.upstream_host, self.upstream_port)
+
+    async def stop(self) -> None:
+        if self._upstream is not None: self._upstream.cancel()
+        if self._server is not None:
+            self._server.close(); await self._server.wait_closed()
+
+    @property
+    def clients(self) -> int:
+        return self._clients
+
+    def idle_for(self) -> float:
+        """Seconds since the last viewer left or snapshot was asked for; 0 while anyone is watching."""
+        return 0.0 if self._clients else time.monotonic() - self._last_demand
+
+    def _want(self) -> None:
+        self._last_demand = time.monotonic(); self._demand.set()
+
+    def _wanted(self) -> bool:
+        return self._clients > 0 or time.monotonic() - self._last_demand < self.idle_s
+
+    # ---- upstream ----
+    async def _upstream_loop(self) -> None:
+        backoff = 0.5
+        while True:
+            if not self._wanted():
+                self._demand.clear()
+                await self._demand.wait()
+            try:
+                await self._pull()
+                backoff = 0.5
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Frame relay upstream error: %s; retrying in %.1fs", e, backoff)
+                await asyncio.sleep(backoff); backoff = min(backoff * 2, 10.0)
+
+    async def _pull(self) -> None:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.upstream_host, self.upstream_port), timeout=5.0)
+        self.stats["upstream_connects"] += 1
+        try:
+            writer.write(f"GET {self.upstream_path} HTTP/1.0\r\nHost: {self.upstream_host}\r\n\r\n".encode())
+            await writer.drain()
+            status, headers = await self._read_head(reader)
+            if b" 200 " not in status + b" ":
+                raise RuntimeError(f"upstream answered {status.decode(errors='replace')}")
+            ctype = headers.get(b"content-type", b"")
+            if b"boundary=" not in ctype:
+                raise RuntimeError("upstream is not a multipart stream")
+            boundary = b"--" + ctype.split(b"boundary=", 1)[1].split(b";")[0].strip().strip(b'"').lstrip(b"-")
+            while self._wanted():
+                line = await asyncio.wait_for(reader.readline(), timeout=10.0)
+                if not line: raise ConnectionError("upstream closed")
+                if not line.strip().startswith(boundary): continue
+                _, part = await self._read_head(reader, first_is_status=False)
+                n = part.get(b"content-length")
+                if n is not None:
+                    frame = await reader.readexactly(int(n))
+                else:
+                    frame = (await reader.readuntil(b"\r\n" + boundary))[:-len(boundary) - 2]
+                await self._publish(frame)
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_head(reader: asyncio.StreamReader, first_is_status: bool = True) -> Tuple[bytes, Dict[bytes, bytes]]:
+        status = b""; headers: Dict[bytes, bytes] = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=10.0)
+            if not line: raise ConnectionError("upstream closed")
+            line = line.rstrip(b"\r\n")
+            if not line:
+                if first_is_status and not status: continue
+                return status, headers
+            if first_is_status and not status:
+                status = line; continue
+            k, _, v = line.partition(b":")
+            headers[k.strip().lower()] = v.strip()
+
+    async def _publish(self, frame: bytes) -> None:
+        async with self._cond:
+            self._frame = frame; self._frame_at = time.monotonic(); self._seq += 1
+            self.stats["frames_in"] += 1
+            self._cond.notify_all()
+
+    # ---- downstream ----
+    async def _next_frame(self, after: int, timeout: Optional[float] = None) -> Tuple[int, bytes]:
+        async with self._cond:
+            await asyncio.wait_for(self._cond.wait_for(lambda: self._seq > after), timeout)
+            return self._seq, self._frame  # type: ignore[return-value]
+
+    async def snapshot(self, timeout: float = 5.0) -> Optional[bytes]:
+        """Latest JPEG, fetching a fresh one if the cached frame is too old."""
+        self._want(); self.stats["snapshots"] += 1
+        if self._frame is not None and time.monotonic() - self._frame_at < self.snapshot_max_age:
+            return self._frame
+        try:
+            return (await self._next_frame(self._seq, timeout))[1]
+        except asyncio.TimeoutError:
+            return None
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=10.0)
+            while (await asyncio.wait_for(reader.readline(), timeout=10.0)).strip():
+                pass
+            target = request.split(b" ")[1] if request.count(b" ") >= 2 else b"/"
+            if b"action=snapshot" in target:
+                await self._serve_snapshot(writer)
+            elif b"action=stream" in target:
+                await self._serve_stream(writer)
+            else:
+                writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_snapshot(self, writer: asyncio.StreamWriter) -> None:
+        frame = await self.snapshot()
+        if frame is None:
+            writer.write(b"HTTP/1.0 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n")
+        else:
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: image/jpeg\r\nCache-Control: no-cache\r\n"
+                         b"Content-Length: %d\r\n\r\n" % len(frame))
+            writer.write(frame)
+        await writer.drain()
+
+    async def _serve_stream(self, writer: asyncio.StreamWriter) -> None:
+        writer.transport.set_write_buffer_limits(high=self.client_buffer)
+        writer.write(b"HTTP/1.0 200 OK\r\nCache-Control: no-cache\r\nConnection: close\r\n"
+                     b"Content-Type: multipart/x-mixed-replace;boundary=" + BOUNDARY + b"\r\n\r\n")
+        self._clients += 1; self._want()
+        seen = self._seq - 1 if self._frame is not None else self._seq
+        try:
+            while True:
+                seq, frame = await self._next_frame(seen)
+                if seen and seq > seen + 1: self.stats["frames_dropped"] += seq - seen - 1
+                seen = seq
+                writer.write(b"--" + BOUNDARY + b"\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(frame))
+                writer.write(frame); writer.write(b"\r\n")
+                await writer.drain()   # slow client: frames published meanwhile are skipped
+                self.stats["frames_out"] += 1; self.stats["bytes_out"] += len(frame)
+        finally:
+            self._clients -= 1; self._last_demand = time.monotonic()
@@ -0,0 +1,85 @@
+from __future__ import annotations
+import asyncio, logging
+from typing import Any, Dict, Optional
+from core.bus import Bus
+logger = logging.getLogger("services.gateway")
+
+class DeviceBus:
+    """
+    One device's view of a shared ``Bus``.
+
+    Outgoing payloads are stamped with the device id (unless they already
+    carry one) and go through the shared queue and connection; incoming
+    commands arrive from ``CommandDemux`` via a bounded per-device inbox.
+    """
+    def __init__(self, bus: Bus, device_id: str, inbox_size: int = 64):
+        self.bus = bus; self.device_id = device_id
+        self.inbox: asyncio.Queue = asyncio.Queue(maxsize=max(1, int(inbox_size)))
+
+    def _stamp(self, payload: dict) -> dict:
+        return payload if "device_id" in payload else {**payload, "device_id": self.device_id}
+
+    def publish_nowait(self, payload: dict) -> bool:
+        return self.bus.publish_nowait(self._stamp(payload))
+
+    async def publish(self, payload: dict) -> None:
+        await self.bus.publish(self._stamp(payload))
+
+    async def next_command(self) -> Optional[dict]:
+        return await self.inbox.get()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.bus.stats()
+
+class CommandDemux:
+    """
+    Reads commands off the shared bus and hands each to its device: the one
+    whose command channel it arrived on (see ``view``), else the one named in
+    its ``device_id``. With a single device, commands naming neither go to
+    it; otherwise they, commands for unknown devices, commands whose
+    ``device_id`` contradicts their channel and commands for a device whose
+    inbox is full are answered with an error ack.
+    """
+    def __init__(self, bus: Bus, inbox_size: int = 64):
+        self.bus = bus; self.inbox_size = inbox_size
+        self._views: Dict[str, DeviceBus] = {}
+        self._channels: Dict[str, Optional[str]] = {}   # command channel -> device; None when shared
+
+    def view(self, device_id: str, channel: Optional[str] = None) -> DeviceBus:
+        """The device's bus view; ``channel`` is its command channel, used for routing unless shared."""
+        v = self._views.get(device_id)
+        if v is None: v = self._views[device_id] = DeviceBus(self.bus, device_id, self.inbox_size)
+        if channel:
+            owner = self._channels.get(channel, device_id)
+            self._channels[channel] = owner if owner == device_id else None
+        return v
+
+    async def _reject(self, msg: dict, target: Any, error: str) -> None:
+        ack = {"type": "ack", "command": msg.get("command") or "unknown", "status": "error", "error": error}
+        if target: ack["device_id"] = target
+        if msg.get("command_id"): ack["command_id"] = msg["command_id"]
+        await self.bus.publish(ack)
+
+    async def run(self) -> None:
+        while True:
+            item = await self.bus.next_command_on()
+            if not item: continue
+            channel, msg = item
+            target = msg.get("device_id"); owner = self._channels.get(channel)
+            if owner is not None:
+                if target and target != owner:
+                    logger.warning("Command %s for %r arrived on %s's channel", msg.get("command"), target, owner)
+                    await self._reject(msg, target, "device_id does not match command channel")
+                    continue
+                target = owner
+            if not target and len(self._views) == 1: target = next(iter(self._views))
+            view = self._views.get(target) if target else None
+            if view is None:
+                logger.warning("Command %s for unknown device %r", msg.get("command"), target)
+                await self._reject(msg, target, "unknown device" if target else "device_id required")
+                continue
+            try:
+                view.inbox.put_nowait(msg)
+            except asyncio.QueueFull:
+                logger.warning("Command inbox of %s full; rejecting %s", target, msg.get("command"))
+                await self._reject(msg, target, "device busy")
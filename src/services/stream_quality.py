@@ -0,0 +1,181 @@
+"""
+Adaptive camera stream quality.
+
+``StreamQualityController`` samples the frame relay every ``adaptive_interval_s``:
+viewer count, delivered kbps and the share of upstream frames that did not
+reach a viewer because its socket had not drained (a saturated uplink). It walks the
+``[[camera.profiles]]`` ladder (best first) with hysteresis: one step down
+after ``adaptive_down_after_s`` of congestion, one step up after
+``adaptive_up_after_s`` of headroom, never within ``adaptive_min_hold_s`` of
+the previous change. The streamer is restarted only when the chosen profile's
+settings differ from what it runs with. With nobody watching for
+``idle_stop_s`` the stream is stopped (the tunnel stays up) and restarted
+when the next viewer or snapshot request arrives, unless the camera was
+switched on or off by a command in between.
+"""
+from __future__ import annotations
+import asyncio, logging, time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+from core.metrics import MetricsRegistry, default_registry
+from core.settings import Settings
+from services.camera_controller import CameraController
+from services.frame_relay import FrameRelay
+
+logger = logging.getLogger("services.stream_quality")
+
+@dataclass(frozen=True)
+class StreamProfile:
+    name: str
+    resolution: str
+    fps: int
+    quality: int
+
+DEFAULT_PROFILES = (StreamProfile("high", "1280x720", 30, 85),
+                    StreamProfile("medium", "960x540", 20, 75),
+                    StreamProfile("low", "640x360", 10, 60))
+
+def load_profiles(raw: Optional[Sequence[Dict[str, Any]]]) -> List[StreamProfile]:
+    """``[[camera.profiles]]`` tables (name, resolution, fps, quality), best first."""
+    if not raw: return list(DEFAULT_PROFILES)
+    out = []
+    for i, p in enumerate(raw):
+        try:
+            out.append(StreamProfile(str(p.get("name", f"p{i}")), str(p["resolution"]), int(p["fps"]), int(p["quality"])))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"camera.profiles[{i}] needs resolution, fps and quality: {e}") from e
+    return out
+
+class StreamQualityController:
+    """Picks the stream profile from relay measurements; run it under the supervisor."""
+    def __init__(self, settings: Settings, camera: CameraController, relay: FrameRelay,
+                 metrics: MetricsRegistry | None = None):
+        cfg = settings.camera or {}
+        self.camera = camera; self.relay = relay
+        self.profiles = load_profiles(cfg.get("profiles"))
+        self.interval_s = float(cfg.get("adaptive_interval_s", 2.0))
+        self.down_ratio = float(cfg.get("adaptive_down_drop_ratio", 0.25))
+        self.up_ratio = float(cfg.get("adaptive_up_drop_ratio", 0.05))
+        self.down_after_s = float(cfg.get("adaptive_down_after_s", 6.0))
+        self.up_after_s = float(cfg.get("adaptive_up_after_s", 30.0))
+        self.min_hold_s = float(cfg.get("adaptive_min_hold_s", 20.0))
+        self.min_frames = int(cfg.get("adaptive_min_frames", 5))
+        self.max_kbps = float(cfg.get("max_kbps", 0))   # 0: no bitrate budget
+        self.up_headroom = float(cfg.get("adaptive_up_headroom", 0.5))
+        self.idle_stop_s = float(cfg.get("idle_stop_s", 300.0))   # 0: never stop
+        # start on the profile matching the configured resolution/fps/quality, else the best one
+        env = camera.env_overrides
+        self.index = next((i for i, p in enumerate(self.profiles)
+                           if (p.resolution, str(p.fps), str(p.quality)) == (env["RES"], env["FPS"], env["Q"])), 0)
+        self.viewers = 0; self.kbps = 0.0; self.drop_ratio = 0.0
+        self._last: Optional[tuple] = None   # (t, frames_in, frames_out, bytes_out)
+        self._bad_since: Optional[float] = None
+        self._good_since: Optional[float] = None
+        self._changed_at = -float("inf")
+        self._running_since: Optional[float] = None
+        self._idle_stopped: Optional[int] = None   # camera.actions right after our idle stop
+        self._seen_actions = camera.actions
+        m = metrics or default_registry()
+        m.gauge("camera_stream_profile", "Index of the active stream profile (0 = best)").set_function(lambda: self.index)
+        m.gauge("camera_viewers", "Clients watching through the frame relay").set_function(lambda: self.viewers)
+        m.gauge("camera_stream_kbps", "Relay output bitrate over the last sample").set_function(lambda: self.kbps)
+        m.gauge("camera_frame_drop_ratio", "Share of frames skipped for slow viewers").set_function(lambda: self.drop_ratio)
+        changes = m.counter("camera_profile_changes_total", "Stream profile switches", ("direction",))
+        self._m_down = changes.labels("down"); self._m_up = changes.labels("up")
+        self._m_idle = m.counter("camera_idle_stops_total", "Streams stopped for lack of viewers")
+
+    @property
+    def profile(self) -> StreamProfile:
+        return self.profiles[self.index]
+
+    def status(self) -> Dict[str, Any]:
+        return {"profile": self.profile.name, "viewers": self.viewers, "kbps": round(self.kbps, 1),
+                "drop_ratio": round(self.drop_ratio, 3), "idle_s": round(self.relay.idle_for(), 1)}
+
+    async def _apply(self, index: int, now: float) -> None:
+        old = self.profile; self.index = index; p = self.profile
+        self._changed_at = now; self._bad_since = self._good_since = None
+        (self._m_down if index > self.profiles.index(old) else self._m_up).inc()
+        logger.info("Stream profile %s -> %s (%s@%d q%d; %d viewers, %.0f kbps, %.0f%% dropped)",
+                    old.name, p.name, p.resolution, p.fps, p.quality, self.viewers, self.kbps, self.drop_ratio * 100)
+        await self.camera.apply_profile(p.name, p.resolution, p.fps, p.quality)
+
+    def _sample(self, now: float) -> int:
+        """Update viewers/kbps/drop_ratio from the relay counters; returns upstream frames in the window."""
+        # frames_dropped is only counted once a stalled viewer drains, so compare
+        # what was delivered with what every viewer should have received instead
+        st = self.relay.stats
+        cur = (now, st["frames_in"], st["frames_out"], st["bytes_out"])
+        last, self._last = self._last, cur
+        self.viewers = self.relay.clients
+        if last is None or cur[0] <= last[0]: return 0
+        got, sent, nbytes = cur[1] - last[1], cur[2] - last[2], cur[3] - last[3]
+        self.kbps = nbytes * 8 / 1000.0 / (cur[0] - last[0])
+        due = got * self.viewers
+        self.drop_ratio = min(1.0, max(0.0, 1.0 - sent / due)) if due else 0.0
+        return got
+
+    def _step(self, now: float, frames: int) -> int:
+        """+1 to step down, -1 to step up, 0 to stay."""
+        congested = frames >= self.min_frames and (self.drop_ratio >= self.down_ratio
+                                                   or (self.max_kbps > 0 and self.kbps > self.max_kbps))
+        healthy = frames >= self.min_frames and self.drop_ratio <= self.up_ratio and (
+            self.max_kbps <= 0 or self.kbps <= self.max_kbps * self.up_headroom)
+        if congested:
+            self._good_since = None
+            if self._bad_since is None: self._bad_since = now
+        elif healthy:
+            self._bad_since = None
+            if self._good_since is None: self._good_since = now
+        else:
+            self._bad_since = self._good_since = None
+        if now - self._changed_at < self.min_hold_s: return 0
+        if self._bad_since is not None and now - self._bad_since >= self.down_after_s and self.index < len(self.profiles) - 1:
+            return 1
+        if self._good_since is not None and now - self._good_since >= self.up_after_s and self.index > 0:
+            return -1
+        return 0
+
+    async def tick(self) -> None:
+        now = time.monotonic()
+        frames = self._sample(now)
+        actions = self.camera.actions
+        running = (await self.camera.status())["state"] == "running"
+        if actions != self._seen_actions:   # toggled by a command: the idle clock starts over
+            self._seen_actions = actions; self._running_since = None
+        if not running:
+            self._running_since = None; self._bad_since = self._good_since = None
+            if (self._idle_stopped is not None and self._idle_stopped == actions
+                    and self.relay.idle_for() < self.interval_s):
+                logger.info("Viewer is back; restarting the idle-stopped stream")
+                self._idle_stopped = None
+                await self.camera.start(expect_actions=actions)   # a command in between wins
+                self._seen_actions = self.camera.actions
+            return
+        self._idle_stopped = None
+        if self._running_since is None: self._running_since = now
+        idle = min(self.relay.idle_for(), now - self._running_since)
+        if self.idle_stop_s > 0 and idle >= self.idle_stop_s:
+            await self.camera.stop(tunnel=False, expect_actions=actions)
+            self._seen_actions = self.camera.actions
+            if self._seen_actions == actions + 1:
+                logger.info("No viewers for %.0fs; stopped the stream", idle)
+                self._idle_stopped = self._seen_actions; self._m_idle.inc()
+            return
+        if not self.viewers:
+            self._bad_since = self._good_since = None
+            return
+        step = self._step(now, frames)
+        if step: await self._apply(self.index + step, now)
+
+    async def run(self) -> None:
+        applied = False
+        while True:
+            try:
+                if not applied:
+                    p = self.profile
+                    await self.camera.apply_profile(p.name, p.resolution, p.fps, p.quality); applied = True
+                await self.tick()
+            except Exception as e:   # script missing/failing: keep sampling, the next tick retries
+                logger.warning("Stream quality tick failed: %s", e)
+            await asyncio.sleep(self.interval_s)
@@ -1,26 +1,99 @@
 from __future__ import annotations
-import asyncio, logging
-from typing import Dict, Any
+import logging
+from typing import Dict, Any, List, Optional, Tuple
 from core.bus import Bus
+from core.deadband import TelemetryGate
+from core.hw import HardwareExecutor
+from core.metrics import MetricsRegistry, default_registry
+from core.poller import AdaptiveRate, Reading, SensorPoller
 from core.settings import Settings
+from core.tsdb import HistoryStore
 from utils.time import now_iso
+from sensors.ads1115 import AdcChannel, AdcReading, shared_adc
 from sensors.dht22_sensor import DHT22Sensor
 logger = logging.getLogger("services.telemetry")
 
+_CALIBRATION=("gain","min_raw","max_raw","scale","offset","mock_raw")
+
 class TelemetryService:
-    def __init__(self, settings: Settings, bus: Bus):
-        self.settings=settings; self.bus=bus
+    """
+    Environment telemetry. The DHT22 is read by the shared ``SensorPoller``
+    every ``poll_interval_ms``, stretching up to ``max_interval_ms`` while
+    temperature and humidity stay within ``[sensors.environment]
+    adapt_band``; each reading goes to history and, past the deadband gate,
+    to the bus. Inputs listed under ``[sensors.analog.channels]`` (hopper
+    level, battery voltage, ...) are read from the shared ADS1115 in one scan
+    every ``[sensors.analog] poll_interval_ms`` and published as ``analog``.
+    """
+    def __init__(self, settings: Settings, bus: Bus, hw: HardwareExecutor | None = None,
+                 history: HistoryStore | None = None, metrics: MetricsRegistry | None = None,
+                 poller: SensorPoller | None = None):
+        self.settings=settings; self.bus=bus; self.history=history
         self.dht=DHT22Sensor(bcm_pin=int(settings.pins.get("dht22_data",4)),
-                             mock=bool(settings.device.get("mock_mode", False)))
+                             mock=bool(settings.device.get("mock_mode", False)), hw=hw)
+        self.gate=TelemetryGate.from_settings(settings)
+        self.device_id=settings.device.get("id","pi-feeder-01")
+        cfg=settings.raw.get("sensors",{}).get("environment",{})
+        base=int(settings.device.get("poll_interval_ms",3000))
+        self.rate=AdaptiveRate(base/1000.0, int(cfg.get("min_interval_ms",base))/1000.0,
+                               int(cfg.get("max_interval_ms",5*base))/1000.0,
+                               bands=cfg.get("adapt_band",{"temperature_c":0.3,"humidity_pct":2.0}))
+        m=metrics or default_registry()
+        samples=m.counter("telemetry_samples_total","Telemetry samples by gate decision",("source","result"))
+        self._m_published=samples.labels("environment","published")
+        self._m_suppressed=samples.labels("environment","suppressed")
+        self._m_analog_published=samples.labels("analog","published")
+        self._m_analog_suppressed=samples.labels("analog","suppressed")
+        self._own_poller=poller is None
+        self.poller=poller or SensorPoller(metrics=m)
+        self.poller.add(f"{self.device_id}/dht22", self._read, self.rate, self._on_reading,
+                        lane="gpio", metrics=m, sensor="dht22")
+        acfg=settings.raw.get("sensors",{}).get("analog",{})
+        self.analog: List[AdcChannel]=[]
+        if acfg.get("channels"):
+            self.adc=shared_adc(settings, hw)
+            self.analog=[self.adc.channel(name, str(c.get("pin","A0")), **{k: c[k] for k in _CALIBRATION if k in c})
+                         for name,c in acfg["channels"].items()]
+            self.analog_gate=TelemetryGate.from_settings(settings)
+            base=int(acfg.get("poll_interval_ms",10000))
+            self.analog_rate=AdaptiveRate(base/1000.0, int(acfg.get("min_interval_ms",base))/1000.0,
+                                          int(acfg.get("max_interval_ms",6*base))/1000.0,
+                                          bands=acfg.get("adapt_band",{}))
+            self.poller.add(f"{self.device_id}/analog", self._scan, self.analog_rate, self._on_analog,
+                            lane="i2c", metrics=m, sensor="analog")
+
+    async def _read(self)->Optional[Tuple[Optional[float], Optional[float]]]:
+        t,h=await self.dht.read_async()
+        return None if t is None and h is None else (t,h)
+
+    async def _scan(self)->Optional[Dict[str, AdcReading]]:
+        return (await self.adc.scan_async(self.analog)) or None
+
+    async def _on_analog(self, r: Reading)->None:
+        if r.value is None: return
+        values={name: rd.value for name,rd in r.value.items()}
+        self.analog_rate.observe(values)
+        if self.history is not None: self.history.record_many({f"analog_{k}": v for k,v in values.items()})
+        if not self.analog_gate.should_publish(values):
+            self._m_analog_suppressed.inc(); return
+        self._m_analog_published.inc()
+        analog={name: {"raw":rd.raw,"volts":rd.volts,"value":rd.value,"pct":rd.pct} for name,rd in r.value.items()}
+        self.bus.publish_nowait({"type":"telemetry","ts":now_iso(),"device_id":self.device_id,"sensors":{"analog":analog}})
+
+    async def _on_reading(self, r: Reading)->None:
+        t,h=r.value if r.value is not None else (None,None)
+        values={"temperature_c":t,"humidity_pct":h}
+        self.rate.observe(values)
+        if self.history is not None: self.history.record_many(values)
+        if not self.gate.should_publish(values):
+            self._m_suppressed.inc(); return
+        self._m_published.inc()
+        sensors={"environment":{}}
+        if t is not None: sensors["environment"]["temperature_c"]=t
+        if h is not None: sensors["environment"]["humidity_pct"]=h
+        payload: Dict[str, Any]={"type":"telemetry","ts":now_iso(),"device_id":self.device_id,"sensors":sensors}
+        self.bus.publish_nowait(payload)
 
     async def run(self)->None:
-        interval=int(self.settings.device.get("poll_interval_ms",3000))/1000.0
-        device_id=self.settings.device.get("id","pi-feeder-01")
-        while True:
-            t,h=self.dht.read()
-            sensors={"environment":{}}
-            if t is not None: sensors["environment"]["temperature_c"]=t
-            if h is not None: sensors["environment"]["humidity_pct"]=h
-            payload: Dict[str, Any]={"type":"telemetry","ts":now_iso(),"device_id":device_id,"sensors":sensors}
-            await self.bus.publish(payload)
-            await asyncio.sleep(interval)
+        """Drives the poller when it was not given a shared one (which its owner runs)."""
+        if self._own_poller: await self.poller.run()
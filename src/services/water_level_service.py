@@ -1,23 +1,68 @@
 # src/services/water_level_service.py
 from __future__ import annotations
-import asyncio, logging, os
-from gpiozero import DigitalOutputDevice
+import logging, math, os
+from typing import Any, Dict, Optional, Tuple
 
 from core.settings import Settings
+from core.tsdb import HistoryStore
 from core.bus import Bus
+from core.deadband import TelemetryGate
+from core.hw import HardwareExecutor, LazyDevice, default_executor
+from core.metrics import MetricsRegistry, default_registry
+from core.poller import AdaptiveRate, Reading, SensorPoller
+from utils.ring import RingBuffer
 from utils.time import now_iso
+from sensors.ads1115 import shared_adc
 from sensors.water_ads1115 import WaterAnalogADS1115  # ✅ fixed import
 
 logger = logging.getLogger("services.water")
 
+class _MockOutput:
+    """Stands in for the buzzer/LED line in mock mode or when gpiozero is unavailable."""
+    def on(self): pass
+    def off(self): pass
+
+class AlarmOutput(LazyDevice):
+    """Buzzer + LED on one active-high GPIO line; gpiozero is loaded on first use."""
+    def __init__(self, pin: int, mock: bool = False):
+        self.pin = pin; self.mock = mock; self.name = f"alarm GPIO{pin}"
+        self._dev = None; self._mock_dev = _MockOutput()
+
+    def _open(self) -> None:
+        os.environ.setdefault("GPIOZERO_PIN_FACTORY", "lgpio")
+        from gpiozero import DigitalOutputDevice  # type: ignore
+        # Active-high output; change active_high=False if your circuit is inverted
+        self._dev = DigitalOutputDevice(pin=self.pin, active_high=True, initial_value=False)
+
+    def _out(self):
+        self.open()
+        return self._mock_dev if self.mock or self._dev is None else self._dev
+
+    def on(self) -> None: self._out().on()
+    def off(self) -> None: self._out().off()
+
 class WaterLevelService:
     """
     Periodically reads water level and publishes telemetry.
     Drives a buzzer+LED line when below threshold, with simple hysteresis to avoid chatter.
+
+    The shared ``SensorPoller`` oversamples the sensor at ``sample_rate_hz``
+    into a fixed-size ring holding one ``window_s`` window; every
+    ``poll_interval_ms`` the window's median/EMA/min/max are published and
+    the alarm hysteresis runs on the filtered level (``filter = "median" |
+    "ema"``), so sloshing and single noisy reads don't toggle the buzzer.
+    Sampling and evaluation speed up to ``max_sample_rate_hz`` when the level
+    is within ``adapt_margin_pct`` of the alarm thresholds or moving by more
+    than ``adapt_band_pct`` per sample, and slow down to
+    ``min_sample_rate_hz`` while it is stable.
     """
-    def __init__(self, settings: Settings, bus: Bus):
+    def __init__(self, settings: Settings, bus: Bus, hw: HardwareExecutor | None = None,
+                 history: HistoryStore | None = None, metrics: MetricsRegistry | None = None,
+                 poller: SensorPoller | None = None):
         self.settings = settings
         self.bus = bus
+        self.history = history
+        self.hw = hw or default_executor()
 
         cfg = settings.raw.get("sensors", {}).get("water_level", {})
         self.enabled = bool(cfg.get("enabled", False))
@@ -25,6 +70,23 @@ class WaterLevelService:
         self.threshold_low = float(settings.raw.get("thresholds", {}).get("min_water_level_pct", 30.0))
         # hysteresis: turn alarm off when rising above this (low + 5% by default)
         self.threshold_clear = float(cfg.get("threshold_clear_pct", self.threshold_low + 5.0))
+        self.sample_rate = max(0.1, float(cfg.get("sample_rate_hz", 20.0)))
+        window_s = float(cfg.get("window_s", self.interval))
+        self.filter = str(cfg.get("filter", "median")).lower()
+        self.ema_alpha = min(1.0, max(0.001, float(cfg.get("ema_alpha", 0.2))))
+        self.samples = RingBuffer(max(1, math.ceil(self.sample_rate * window_s)))
+        self._ema: Optional[float] = None
+        self._last_eval: Optional[float] = None
+        self.rate = AdaptiveRate(1.0 / self.sample_rate,
+                                 1.0 / max(self.sample_rate, float(cfg.get("max_sample_rate_hz", 2 * self.sample_rate))),
+                                 1.0 / min(self.sample_rate, max(0.01, float(cfg.get("min_sample_rate_hz", self.sample_rate / 4)))),
+                                 bands={"level_pct": float(cfg.get("adapt_band_pct", 1.0))},
+                                 thresholds={"level_pct": (self.threshold_low, self.threshold_clear)},
+                                 margin=float(cfg.get("adapt_margin_pct", 5.0)))
+        self._last_volt: Optional[float] = None
+        self.read_errors = 0
+        self.gate = TelemetryGate.from_settings(
+            settings, thresholds={"level_pct": (self.threshold_low, self.threshold_clear)})
 
         self.sensor = WaterAnalogADS1115(
             channel=str(cfg.get("channel", "A3")),
@@ -33,52 +95,104 @@ class WaterLevelService:
             min_adc=int(cfg.get("min_adc", 0)),
             max_adc=int(cfg.get("max_adc", 65535)),
             mock=bool(settings.device.get("mock_mode", False)),
+            hw=self.hw,
+            adc=shared_adc(settings, self.hw, i2c_addr=cfg.get("i2c_addr")),
         )
 
         # Buzzer + LED (shared line)
-        os.environ.setdefault("GPIOZERO_PIN_FACTORY", "lgpio")
-        pin = int(settings.pins.get("buzzer_led", 26))
-        # Active-high output; change active_high=False if your circuit is inverted
-        self.alarm = DigitalOutputDevice(pin=pin, active_high=True, initial_value=False)
+        self.alarm = AlarmOutput(int(settings.pins.get("buzzer_led", 26)),
+                                 mock=bool(settings.device.get("mock_mode", False)))
         self._alarm_on = False
 
-    def _set_alarm(self, on: bool):
+        m = metrics or default_registry()
+        samples = m.counter("telemetry_samples_total", "Telemetry samples by gate decision", ("source", "result"))
+        self._m_published = samples.labels("water", "published")
+        self._m_suppressed = samples.labels("water", "suppressed")
+        self._m_level = m.gauge("water_level_pct", "Filtered water level")
+        m.gauge("water_alarm", "1 while the low-water alarm is on").set_function(lambda: float(self._alarm_on))
+        self.device_id = settings.device.get("id", "pi-feeder-01")
+        self._own_poller = poller is None
+        self.poller = poller or SensorPoller(metrics=m)
+        if self.enabled:
+            self.poller.add(f"{self.device_id}/ads1115", self._read, self.rate, self._on_sample,
+                            lane="i2c", metrics=m, sensor="ads1115")
+
+    async def _set_alarm(self, on: bool):
         if on and not self._alarm_on:
-            self.alarm.on(); self._alarm_on = True
+            await self.hw.run("gpio", self.alarm.on, timeout=1.0); self._alarm_on = True
             logger.info("WATER ALERT: buzzer/LED ON")
         elif (not on) and self._alarm_on:
-            self.alarm.off(); self._alarm_on = False
+            await self.hw.run("gpio", self.alarm.off, timeout=1.0); self._alarm_on = False
             logger.info("WATER ALERT: buzzer/LED OFF")
 
+    async def _read(self) -> Optional[Tuple[int, Optional[float]]]:
+        raw, volt = await self.sensor.read_raw_async()
+        return None if raw is None else (raw, volt)
+
+    async def _on_sample(self, r: Reading) -> None:
+        if r.value is None:
+            self.read_errors += 1
+        else:
+            raw, volt = r.value
+            self.samples.append(raw); self._last_volt = volt
+            self._ema = raw if self._ema is None else self._ema + self.ema_alpha * (raw - self._ema)
+            self.rate.observe({"level_pct": self.sensor.raw_to_pct(self._ema)})
+        # evaluation follows the sampling rate: faster near the thresholds, slower when stable
+        if self._last_eval is None: self._last_eval = r.t_mono
+        if r.t_mono - self._last_eval >= self.interval * self.rate.scale:
+            self._last_eval = r.t_mono
+            await self._evaluate()
+
+    def summary(self) -> Dict[str, Any]:
+        """Window summary in the shape of ``read_pct`` plus a ``window`` block."""
+        st = self.samples.stats()
+        if st is None or self._ema is None:
+            return {"raw": None, "voltage": self._last_volt, "level_pct": None}
+        pct = self.sensor.raw_to_pct
+        filtered = self._ema if self.filter == "ema" else st["median"]
+        return {
+            "raw": int(round(filtered)), "voltage": self._last_volt, "level_pct": pct(filtered),
+            "window": {"n": st["n"], "median_pct": pct(st["median"]), "ema_pct": pct(self._ema),
+                       "min_pct": pct(st["min"]), "max_pct": pct(st["max"])},
+        }
+
+    async def _evaluate(self) -> None:
+        reading = self.summary()
+        lvl = reading.get("level_pct")
+        self._m_level.set(lvl)
+        if self.history is not None: self.history.record_many({"water_level_pct": lvl})
+        alarm_was = self._alarm_on
+        # Hysteresis
+        if lvl is not None:
+            if not self._alarm_on and lvl < self.threshold_low:
+                await self._set_alarm(True)
+                await self.bus.publish({
+                    "type": "event", "level": "warn", "code": "WATER_LOW",
+                    "ts": now_iso(), "device_id": self.device_id,
+                    "reading": reading, "threshold_low": self.threshold_low
+                })
+            elif self._alarm_on and lvl >= self.threshold_clear:
+                await self._set_alarm(False)
+                await self.bus.publish({
+                    "type": "event", "level": "info", "code": "WATER_OK",
+                    "ts": now_iso(), "device_id": self.device_id,
+                    "reading": reading, "threshold_clear": self.threshold_clear
+                })
+
+        if not self.gate.should_publish({"level_pct": lvl}, force=self._alarm_on != alarm_was):
+            self._m_suppressed.inc()
+            return
+        self._m_published.inc()
+        self.bus.publish_nowait({
+            "type": "telemetry",
+            "ts": now_iso(),
+            "device_id": self.device_id,
+            "sensors": {"water": reading}
+        })
+
     async def run(self):
+        """Drives the poller when it was not given a shared one (which its owner runs)."""
         if not self.enabled:
             logger.info("WaterLevelService disabled; not starting.")
             return
-        device_id = self.settings.device.get("id", "pi-feeder-01")
-        while True:
-            reading = self.sensor.read_pct()
-            lvl = reading.get("level_pct")
-            # Hysteresis
-            if lvl is not None:
-                if not self._alarm_on and lvl < self.threshold_low:
-                    self._set_alarm(True)
-                    await self.bus.publish({
-                        "type": "event", "level": "warn", "code": "WATER_LOW",
-                        "ts": now_iso(), "device_id": device_id,
-                        "reading": reading, "threshold_low": self.threshold_low
-                    })
-                elif self._alarm_on and lvl >= self.threshold_clear:
-                    self._set_alarm(False)
-                    await self.bus.publish({
-                        "type": "event", "level": "info", "code": "WATER_OK",
-                        "ts": now_iso(), "device_id": device_id,
-                        "reading": reading, "threshold_clear": self.threshold_clear
-                    })
-
-            await self.bus.publish({
-                "type": "telemetry",
-                "ts": now_iso(),
-                "device_id": device_id,
-                "sensors": {"water": reading}
-            })
-            await asyncio.sleep(self.interval)
+        if self._own_poller: await self.poller.run()
@@ -0,0 +1,242 @@
+"""
+Fleet simulator: thousands of mock-mode feeders in one process (or a pool of
+processes) for load testing the control plane.
+
+    PYTHONPATH=src python src/simulator.py --devices 2000 --duration 60 \
+        --command-rate 200 --mix feedNow=1,listSchedules=4,scheduleFeed=1 [--procs 4] [--json out.json]
+
+Every simulated device is the real service stack — ``TelemetryService``,
+``WaterLevelService``, ``Scheduler``, ``CommandRouter`` and a ``Feeder`` —
+wired like gateway mode: one ``Bus`` per process, commands routed by
+``device_id``. Hardware calls run inline (mock reads are instant and servo
+travel is off by default) so the numbers describe the software path, not
+the one GPIO worker every device would otherwise queue on.
+
+The transport is pluggable (``--transport module:Class``, default the
+in-process ``SimTransport``); the command generator injects commands into it
+at ``--command-rate`` per second and measures command -> ack latency from
+the acks the bus publishes.
+"""
+from __future__ import annotations
+import argparse, asyncio, gc, importlib, json, logging, random, resource, statistics, sys, tempfile, time, tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from core.bus import Bus
+from core.hw import HardwareExecutor
+from core.metrics import MetricsRegistry
+from core.poller import SensorPoller
+from core.scheduler import Scheduler
+from core.settings import Settings
+from core.supervisor import LoopMonitor
+from core.transport import LocalTransport
+from actuators.feeder import Feeder
+from services.command_router import CommandRouter
+from services.gateway import CommandDemux
+from services.telemetry import TelemetryService
+from services.water_level_service import WaterLevelService
+logger = logging.getLogger("simulator")
+
+class InlineExecutor(HardwareExecutor):
+    """Runs (mock) driver calls directly on the loop instead of on per-bus worker threads."""
+    def __init__(self) -> None:
+        super().__init__(buses=())
+
+    async def run(self, bus: str, fn: Any, *args: Any, timeout: Optional[float] = None, **kwargs: Any) -> Any:
+        return fn(*args, **kwargs)
+
+class SimTransport(LocalTransport):
+    """
+    ``LocalTransport`` that counts what the bus publishes instead of keeping
+    it, and times acks against the commands the generator injected.
+    """
+    def __init__(self, latency_s: float = 0.0):
+        super().__init__(latency_s=latency_s, keep=False)
+        self.by_type: Dict[str, int] = {}
+        self.sent_at: Dict[str, float] = {}
+        self.ack_ms: List[float] = []
+        self.ack_errors = 0
+
+    async def publish(self, channel: str, message: Any, meta: Optional[Dict[str, Any]] = None) -> None:
+        await super().publish(channel, message, meta)
+        now = time.perf_counter()
+        for p in message if isinstance(message, list) else (message,):
+            kind = p.get("type", "?") if isinstance(p, dict) else "compact"
+            self.by_type[kind] = self.by_type.get(kind, 0) + 1
+            if kind == "ack":
+                t0 = self.sent_at.pop(p.get("command_id", ""), None)
+                if t0 is not None: self.ack_ms.append((now - t0) * 1e3)
+                if p.get("status") != "ok": self.ack_errors += 1
+
+    def inject(self, message: Any, channel: Optional[str] = None) -> None:
+        if isinstance(message, dict) and message.get("command_id"):
+            self.sent_at[message["command_id"]] = time.perf_counter()
+        super().inject(message, channel)
+
+def _settings(dev_id: str, args: argparse.Namespace, base: Path) -> Settings:
+    raw: Dict[str, Any] = {
+        "device": {"id": dev_id, "mock_mode": True, "poll_interval_ms": args.telemetry_ms},
+        "pubnub": {}, "camera": {}, "pins": {"servo_feed": 12},
+        "thresholds": {"min_water_level_pct": 30.0},
+        "sensors": {"water_level": {"enabled": args.water_ms > 0, "poll_interval_ms": max(1, args.water_ms),
+                                    "sample_rate_hz": args.water_hz}},
+        "telemetry": {"max_silence_s": args.heartbeat_s},
+    }
+    return Settings(raw=raw, device=raw["device"], pubnub=raw["pubnub"], camera=raw["camera"],
+                    thresholds=raw["thresholds"], pins=raw["pins"], base_dir=base)
+
+def _parse_mix(spec: str) -> Tuple[List[str], List[float]]:
+    names, weights = [], []
+    for part in filter(None, spec.split(",")):
+        name, _, w = part.partition("=")
+        names.append(name.strip()); weights.append(float(w or 1))
+    if not names or sum(weights) <= 0: raise ValueError(f"empty command mix: {spec!r}")
+    return names, weights
+
+def _args_for(cmd: str, rng: random.Random) -> Dict[str, Any]:
+    if cmd == "scheduleFeed":
+        return {"mode": "daily", "time_local": f"{rng.randrange(24):02d}:{rng.randrange(60):02d}"}
+    if cmd == "getMetrics":
+        return {"prefix": "command"}
+    return {}
+
+def _transport(spec: str, latency_s: float) -> Any:
+    if spec == "sim": return SimTransport(latency_s=latency_s)
+    module, _, cls = spec.partition(":")
+    return getattr(importlib.import_module(module), cls)()
+
+async def _generate(transport: Any, ids: List[str], rate: float, mix: Tuple[List[str], List[float]],
+                    duration: float, seed: int) -> int:
+    """Poisson arrivals at ``rate``/s spread uniformly over the fleet."""
+    if rate <= 0 or not hasattr(transport, "inject"): return 0
+    rng = random.Random(seed); sent = 0
+    loop = asyncio.get_running_loop(); end = loop.time() + duration; at = loop.time()
+    while True:
+        at += rng.expovariate(rate)
+        if at >= end: return sent
+        await asyncio.sleep(max(0.0, at - loop.time()))
+        cmd = rng.choices(*mix)[0]
+        transport.inject({"type": "command", "command": cmd, "device_id": rng.choice(ids),
+                          "command_id": f"sim-{seed}-{sent}", "args": _args_for(cmd, rng)})
+        sent += 1
+
+async def _simulate(first: int, count: int, args: argparse.Namespace) -> Dict[str, Any]:
+    base = Path(tempfile.mkdtemp(prefix="feeder-sim-"))
+    transport = _transport(args.transport, args.latency_ms / 1000.0)
+    metrics = MetricsRegistry()
+    bus = Bus("sim", "sim", f"sim-{first}", "sim", transport=transport, max_queue=args.max_queue,
+              metrics=metrics, encoding=args.encoding)
+    hw = InlineExecutor(); demux = CommandDemux(bus, inbox_size=args.inbox)
+    ids = [f"sim-{i:05d}" for i in range(first, first + count)]
+
+    gc.collect(); tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    services: List[Any] = []; scheds: List[Scheduler] = []
+    poller = SensorPoller(pipeline_size=max(256, 2 * count), metrics=metrics)
+    for dev_id in ids:
+        st = _settings(dev_id, args, base); m = metrics.scoped(device=dev_id); view = demux.view(dev_id)
+        feeder = Feeder(pin=12, mock=True, hw=hw, metrics=m); feeder.servo.travel_s = args.servo_travel_s
+        sched = Scheduler(str(base / dev_id / "schedules.json"), on_fire=None, fsync=False, metrics=m)  # type: ignore
+        router = CommandRouter(st, view, sched, feeder, None, metrics=m)
+        sched.on_fire = router._on_fire
+        telemetry = TelemetryService(st, view, hw=hw, metrics=m, poller=poller); telemetry.dht.mock_latency = 0
+        water = WaterLevelService(st, view, hw=hw, metrics=m, poller=poller); water.sensor.adc.mock_latency = 0
+        services += [sched, router]; scheds.append(sched)
+    gc.collect()
+    per_device = (tracemalloc.get_traced_memory()[0] - before) / max(1, count)
+    tracemalloc.stop()
+
+    monitor = LoopMonitor(interval_s=0.05, stall_threshold_s=0.5, metrics=metrics)
+    await bus.start()
+    tasks = [asyncio.create_task(s.run()) for s in services]
+    tasks += [asyncio.create_task(poller.run()), asyncio.create_task(demux.run()), asyncio.create_task(monitor.run())]
+    rng = random.Random(first)
+    await asyncio.sleep(rng.uniform(0, 0.1))
+    t0 = time.perf_counter()
+    sent = await _generate(transport, ids, args.command_rate * count / args.devices,
+                           _parse_mix(args.mix), args.duration, first)
+    await asyncio.sleep(max(0.0, args.duration - (time.perf_counter() - t0)) + args.drain_s)
+    elapsed = time.perf_counter() - t0
+    for t in tasks: t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for s in scheds: await s.stop()
+    await bus.stop()
+
+    bs = bus.stats()
+    return {"devices": count, "elapsed_s": elapsed, "commands_sent": sent,
+            "ack_ms": getattr(transport, "ack_ms", []), "ack_errors": getattr(transport, "ack_errors", 0),
+            "unacked": len(getattr(transport, "sent_at", {})), "by_type": getattr(transport, "by_type", {}),
+            "bus_sent": bs["sent"], "bus_batches": bs["batches"], "bus_dropped": bs["dropped"],
+            "bytes_per_device": per_device, "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "loop_lag_max_ms": monitor.max_lag * 1e3, "loop_stalls": len(monitor.stalls)}
+
+def _worker(first: int, count: int, args: argparse.Namespace) -> Dict[str, Any]:
+    logging.basicConfig(level=logging.WARNING if not args.verbose else logging.INFO)
+    return asyncio.run(_simulate(first, count, args))
+
+def _pct(xs: List[float], p: float) -> Optional[float]:
+    if not xs: return None
+    s = sorted(xs); return round(s[min(len(s) - 1, int(len(s) * p))], 3)
+
+def _report(parts: List[Dict[str, Any]], args: argparse.Namespace) -> Dict[str, Any]:
+    elapsed = max(p["elapsed_s"] for p in parts)
+    acks = [x for p in parts for x in p["ack_ms"]]
+    by_type: Dict[str, int] = {}
+    for p in parts:
+        for k, v in p["by_type"].items(): by_type[k] = by_type.get(k, 0) + v
+    sent = sum(p["bus_sent"] for p in parts)
+    return {
+        "devices": args.devices, "procs": len(parts), "duration_s": round(elapsed, 2),
+        "messages_per_s": round(sent / elapsed, 1),
+        "publishes_per_s": round(sum(p["bus_batches"] for p in parts) / elapsed, 1),
+        "messages_by_type": by_type, "dropped": sum(p["bus_dropped"] for p in parts),
+        "commands_sent": sum(p["commands_sent"] for p in parts), "commands_acked": len(acks),
+        "commands_per_s": round(len(acks) / elapsed, 1),
+        "ack_errors": sum(p["ack_errors"] for p in parts), "unacked": sum(p["unacked"] for p in parts),
+        "ack_ms": {"mean": round(statistics.mean(acks), 3) if acks else None, "p50": _pct(acks, .5),
+                   "p95": _pct(acks, .95), "p99": _pct(acks, .99), "max": _pct(acks, 1.0)},
+        "memory_per_device_kb": round(statistics.mean(p["bytes_per_device"] for p in parts) / 1024, 1),
+        "max_rss_mb_per_proc": round(max(p["max_rss_kb"] for p in parts) / 1024, 1),
+        "loop_lag_max_ms": round(max(p["loop_lag_max_ms"] for p in parts), 1),
+        "loop_stalls": sum(p["loop_stalls"] for p in parts),
+    }
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--devices", type=int, default=1000)
+    ap.add_argument("--procs", type=int, default=1, help="worker processes; devices are split evenly")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds of command traffic")
+    ap.add_argument("--drain-s", type=float, default=2.0, help="extra time for in-flight commands to ack")
+    ap.add_argument("--command-rate", type=float, default=50.0, help="commands per second across the fleet")
+    ap.add_argument("--mix", default="feedNow=1,listSchedules=4,scheduleFeed=1,getMetrics=1")
+    ap.add_argument("--telemetry-ms", type=int, default=3000)
+    ap.add_argument("--water-ms", type=int, default=3000, help="0 disables the water service")
+    ap.add_argument("--water-hz", type=float, default=1.0, help="water oversampling rate per device")
+    ap.add_argument("--heartbeat-s", type=float, default=300.0)
+    ap.add_argument("--servo-travel-s", type=float, default=0.0)
+    ap.add_argument("--transport", default="sim", help="'sim' or module:Class with the transport interface")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="per-publish latency of the sim transport")
+    ap.add_argument("--encoding", choices=("json", "compact"), default="json")
+    ap.add_argument("--max-queue", type=int, default=5000)
+    ap.add_argument("--inbox", type=int, default=64)
+    ap.add_argument("--json", help="also write the report here")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.WARNING if not args.verbose else logging.INFO)
+
+    procs = max(1, min(args.procs, args.devices))
+    shares = [args.devices // procs + (1 if i < args.devices % procs else 0) for i in range(procs)]
+    firsts = [sum(shares[:i]) for i in range(procs)]
+    print(f"simulating {args.devices} devices in {procs} process(es) for {args.duration:g}s ...", file=sys.stderr)
+    if procs == 1:
+        parts = [_worker(0, args.devices, args)]
+    else:
+        with ProcessPoolExecutor(max_workers=procs) as pool:
+            parts = list(pool.map(_worker, firsts, shares, [args] * procs))
+    report = _report(parts, args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.json: Path(args.json).write_text(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+from __future__ import annotations
+from array import array
+from typing import Any, Dict, Optional
+
+_np: Any = False   # False = not looked up yet, None = unavailable
+
+def _numpy() -> Any:
+    """NumPy if installed (optional: only used to vectorise window statistics), imported on first use."""
+    global _np
+    if _np is False:
+        try: import numpy as _np  # type: ignore
+        except Exception: _np = None
+    return _np
+
+class RingBuffer:
+    """
+    Fixed-capacity ring of floats backed by a preallocated ``array('d')``.
+
+    Memory is allocated once; ``append`` overwrites the oldest sample when full.
+    Window statistics run over a zero-copy NumPy view when NumPy is installed
+    and fall back to C-level ``sorted``/``min``/``max`` on the array otherwise.
+    """
+    __slots__ = ("capacity", "_buf", "_head", "_size")
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, int(capacity))
+        self._buf = array("d", bytes(8 * self.capacity))
+        self._head = 0   # next write position
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, value: float) -> None:
+        self._buf[self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        if self._size < self.capacity: self._size += 1
+
+    def clear(self) -> None:
+        self._head = 0; self._size = 0
+
+    def last(self, n: Optional[int] = None) -> array:
+        """The newest ``n`` samples (all if None), oldest first, as a new array."""
+        n = self._size if n is None else max(0, min(int(n), self._size))
+        start = (self._head - n) % self.capacity
+        if start + n <= self.capacity:
+            return self._buf[start:start + n]
+        return self._buf[start:] + self._buf[:self._head]
+
+    def stats(self, n: Optional[int] = None) -> Optional[Dict[str, float]]:
+        """median/mean/min/max over the newest ``n`` samples, or None when empty."""
+        win = self.last(n)
+        if not win: return None
+        np = _numpy()
+        if np is not None:
+            v = np.frombuffer(win, dtype=np.float64)
+            return {"median": float(np.median(v)), "mean": float(v.mean()),
+                    "min": float(v.min()), "max": float(v.max()), "n": int(v.size)}
+        s = sorted(win); k = len(s); mid = k // 2
+        median = s[mid] if k % 2 else (s[mid - 1] + s[mid]) / 2.0
+        return {"median": median, "mean": sum(s) / k, "min": s[0], "max": s[-1], "n": k}
@@ -0,0 +1,32 @@
+from __future__ import annotations
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, Tuple, TypeVar
+
+V = TypeVar("V")
+
+class TTLCache(Generic[V]):
+    """Small LRU cache whose entries also expire ``ttl_s`` seconds after insertion."""
+    def __init__(self, maxsize: int = 256, ttl_s: float = 600.0):
+        self.maxsize = max(1, int(maxsize)); self.ttl = float(ttl_s)
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Optional[V]:
+        item = self._data.get(key)
+        if item is None: return default
+        if item[0] < time.monotonic():
+            del self._data[key]; return default
+        self._data.move_to_end(key)
+        return item[1]
+
+    def put(self, key: Hashable, value: V) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)